@@ -24,7 +24,6 @@ from common import clear_folder
 from common import from_jsonpickle
 from common import just_file_stem
 from common import now
-from common import read_archived_file
 
 
 # udp classes
@@ -34,6 +33,7 @@ from daemon import Daemon
 
 # udp lib
 import database
+import package
 import udp
 
 
@@ -128,7 +128,7 @@ class ArchiveDaemon(Daemon):
     def update_stat_log(self, capture_file_name):
 
         # extract job.log/last_job.log from capture zip and merge these into stat_log table
-        job_log_data = read_archived_file(capture_file_name, "job.log", default=None)
+        job_log_data = package.read_package_entry(capture_file_name, "job.log", default=None)
         if job_log_data:
             job_log_json = from_jsonpickle(job_log_data)
             for row in job_log_json:
@@ -139,7 +139,7 @@ class ArchiveDaemon(Daemon):
                     self.target_db_conn.insert_into_table("udp_sys", "stat_log", **row)
 
         # if 'last_job.log' in archive.namelist():
-        job_log_data = read_archived_file(
+        job_log_data = package.read_package_entry(
             capture_file_name, "last_job.log", default=None
         )
         if job_log_data:
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+batch.py
+
+Typed columnar batch format for capture output.
+
+A columnar batch is a json document with a small header and one typed value array per column:
+
+{
+  "format": "udp-columnar",
+  "version": 1,
+  "table_name": "<table_name>",
+  "row_count": <row count>,
+  "columns": [
+    {"name": "<column_name>", "codec": "<codec>", "nulls": "<base64 null bitmap>", "values": [<non-null values>]},
+    ...
+  ]
+}
+
+Column codecs are driven by the table schema's data types. Only non-null values are stored; a column's
+null bitmap has bit n set when row n is null and is omitted (null) when a column has no null values.
+Columns beyond the table schema (eg. udp_job, udp_timestamp) have their codec inferred from their values.
+Columns whose values don't match their schema codec fall back to the jsonpickle based object codec.
+
+Legacy batches (jsonpickle encoded lists of row lists) are still readable via load_batch().
+
+BatchSizer sizes a table's batches from a target byte budget and the average row size of its first fetch.
+"""
+
+
+# standard lib
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import sys
+import threading
+
+
+# common lib
+from common import from_jsonpickle
+from common import log_setup
+from common import log_session_info
+from common import memory_available
+from common import process_memory_used
+from common import split
+from common import to_jsonpickle
+
+
+# udp lib
+import tableschema
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# batch format identifiers
+batch_format_name = 'udp-columnar'
+batch_format_version = 1
+
+
+# adaptive batch sizing defaults
+default_batch_bytes = 64 * 1024 * 1024
+probe_batch_size = 1_000
+min_batch_size = 1_000
+max_batch_size = 1_000_000
+
+
+# database data types (lowercase) mapped to column codecs; unmapped data types use the object codec
+codec_data_types = dict(
+    int='bigint, bigserial, int, integer, serial, smallint, smallserial, tinyint',
+    float='double precision, float, real',
+    decimal='decimal, money, numeric, smallmoney',
+    bool='bit, boolean',
+    datetime='datetime, datetime2, smalldatetime, timestamp with time zone, timestamp without time zone',
+    date='date',
+    time='time, time without time zone',
+    bytes='binary, bytea, image, rowversion, timestamp, varbinary',
+    str='char, character, character varying, nchar, ntext, nvarchar, sysname, text, uniqueidentifier, uuid, '
+        'varchar, xml',
+)
+
+data_type_codecs = {
+    data_type: codec for codec, data_types in codec_data_types.items() for data_type in split(data_types, ',')
+}
+
+
+class BatchCodecError(Exception):
+    """Raised when a value does not match its column's codec."""
+    pass
+
+
+def _expect(value, value_type, reject_type=None):
+    """Raise BatchCodecError if value is not an instance of value_type (or is an instance of reject_type)."""
+    if not isinstance(value, value_type) or (reject_type and isinstance(value, reject_type)):
+        raise BatchCodecError(f'Unexpected {type(value).__name__} value')
+    return value
+
+
+# codec name: (encode function, decode function)
+codecs = dict(
+    int=(lambda value: _expect(value, int, bool), lambda value: value),
+    float=(lambda value: _expect(value, float), lambda value: value),
+    decimal=(lambda value: str(_expect(value, decimal.Decimal)), decimal.Decimal),
+    bool=(lambda value: _expect(value, bool), lambda value: value),
+    datetime=(lambda value: _expect(value, datetime.datetime).isoformat(), datetime.datetime.fromisoformat),
+    date=(lambda value: _expect(value, datetime.date, datetime.datetime).isoformat(), datetime.date.fromisoformat),
+    time=(lambda value: _expect(value, datetime.time).isoformat(), datetime.time.fromisoformat),
+    bytes=(lambda value: base64.b64encode(_expect(value, (bytes, bytearray))).decode('ascii'), base64.b64decode),
+    str=(lambda value: _expect(value, str), lambda value: value),
+    object=(to_jsonpickle, from_jsonpickle),
+)
+
+
+def data_type_codec(data_type):
+    """Return codec name for a database data type."""
+    return data_type_codecs.get(str(data_type).lower(), 'object')
+
+
+def infer_codec(values):
+    """Return codec name based on the type of the first non-null value in a list of values."""
+    for value in values:
+        if value is None:
+            continue
+        elif isinstance(value, bool):
+            return 'bool'
+        elif isinstance(value, int):
+            return 'int'
+        elif isinstance(value, float):
+            return 'float'
+        elif isinstance(value, decimal.Decimal):
+            return 'decimal'
+        elif isinstance(value, datetime.datetime):
+            return 'datetime'
+        elif isinstance(value, datetime.date):
+            return 'date'
+        elif isinstance(value, datetime.time):
+            return 'time'
+        elif isinstance(value, (bytes, bytearray)):
+            return 'bytes'
+        elif isinstance(value, str):
+            return 'str'
+        else:
+            return 'object'
+
+    # all values are null; any codec will do
+    return 'str'
+
+
+def encode_nulls(values):
+    """Return base64 encoded null bitmap for list of values or None if no values are null."""
+    bitmap = bytearray((len(values) + 7) // 8)
+    has_nulls = False
+    for index, value in enumerate(values):
+        if value is None:
+            bitmap[index >> 3] |= 1 << (index & 7)
+            has_nulls = True
+    return base64.b64encode(bytes(bitmap)).decode('ascii') if has_nulls else None
+
+
+def decode_nulls(nulls, row_count):
+    """Return list of is-null flags from a base64 encoded null bitmap."""
+    if not nulls:
+        return [False] * row_count
+    bitmap = base64.b64decode(nulls)
+    return [bool(bitmap[index >> 3] & (1 << (index & 7))) for index in range(row_count)]
+
+
+def encode_column(column_name, codec, values):
+    """Return column dict for a list of column values; falls back to object codec for unexpected values."""
+    try:
+        encode = codecs[codec][0]
+        encoded_values = [encode(value) for value in values if value is not None]
+    except (BatchCodecError, ValueError):
+        logger.debug(f'Column {column_name} values do not match codec {codec}; using object codec')
+        codec = 'object'
+        encode = codecs[codec][0]
+        encoded_values = [encode(value) for value in values if value is not None]
+
+    return dict(name=column_name, codec=codec, nulls=encode_nulls(values), values=encoded_values)
+
+
+def decode_column(column, row_count, convert=None):
+    """Return list of row_count column values from a column dict; optionally convert()'s non-null values."""
+    decode = codecs[column['codec']][1]
+    values = iter(column['values'])
+    is_nulls = decode_nulls(column['nulls'], row_count)
+    if convert:
+        return [None if is_null else convert(decode(next(values))) for is_null in is_nulls]
+    return [None if is_null else decode(next(values)) for is_null in is_nulls]
+
+
+def encode_batch(rows, table_schema):
+    """Return a batch of rows (sequences of column values) as columnar json text."""
+    schema_columns = list(table_schema.columns.values())
+    row_count = len(rows)
+    column_count = len(rows[0]) if rows else len(schema_columns)
+
+    columns = []
+    for column_index in range(column_count):
+        values = [row[column_index] for row in rows]
+        if column_index < len(schema_columns):
+            column_name = schema_columns[column_index].column_name
+            codec = data_type_codec(schema_columns[column_index].data_type)
+        else:
+            # extended columns (eg. udp_job, udp_timestamp) are not part of the table schema
+            column_name = f'column_{column_index + 1}'
+            codec = infer_codec(values)
+        columns.append(encode_column(column_name, codec, values))
+
+    batch = dict(
+        format=batch_format_name,
+        version=batch_format_version,
+        table_name=table_schema.table_name,
+        row_count=row_count,
+        columns=columns,
+    )
+    return json.dumps(batch, separators=(',', ':'))
+
+
+def is_columnar_batch(obj):
+    """Return True if obj is a decoded columnar batch header."""
+    return isinstance(obj, dict) and obj.get('format') == batch_format_name
+
+
+def decode_batch(text, converters=None):
+    """
+    Return list of row lists from columnar or legacy jsonpickle batch text.
+
+    Optional converters, a list of (column index, convert function) pairs, convert a column's non-null values as
+    they're decoded: columnar batches convert whole columns as each column is decoded; legacy batches convert each
+    row's columns in a single pass per row.
+    """
+    obj = json.loads(text)
+    if not is_columnar_batch(obj):
+        # legacy batch: jsonpickle encoded list of row lists
+        rows = from_jsonpickle(text)
+        if converters:
+            for row in rows:
+                for column_index, convert in converters:
+                    value = row[column_index]
+                    if value is not None:
+                        row[column_index] = convert(value)
+        return rows
+
+    if obj['version'] > batch_format_version:
+        raise NotImplementedError(f'Unsupported batch format version ({obj["version"]})')
+
+    row_count = obj['row_count']
+    column_converters = dict(converters or [])
+    columns = []
+    for column_index, column in enumerate(obj['columns']):
+        columns.append(decode_column(column, row_count, column_converters.get(column_index)))
+    if not columns:
+        return [[] for _ in range(row_count)]
+    return [list(row) for row in zip(*columns)]
+
+
+class RowStreamHash:
+
+    """
+    Content hash of the leading column_count values of a table's rows, updated with each fetch's rows in row order.
+    Independent of batch boundaries (ie. batch sizes vary with available memory). Not thread safe.
+    """
+
+    def __init__(self, column_count):
+        self.column_count = column_count
+        self.row_hash = hashlib.sha256()
+
+        # numbers of batches hashed
+        self.batch_numbers = []
+
+    def update(self, batch_number, rows):
+        self.batch_numbers.append(batch_number)
+        for row in rows:
+            self.row_hash.update(repr(tuple(row[:self.column_count])).encode('UTF8'))
+
+    def hexdigest(self):
+        """Return row stream's content hash (hex str)."""
+        return self.row_hash.hexdigest()
+
+
+def estimate_row_size(rows, sample_size=1_000):
+    """Return average in-memory size (bytes) of a sample of rows."""
+    sample = rows[:sample_size]
+    if not sample:
+        return 0
+    sample_bytes = 0
+    for row in sample:
+        sample_bytes += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return sample_bytes // len(sample)
+
+
+class BatchSizer:
+
+    """
+    Sizes a table's batches. Fixed when batch_size is provided, otherwise sized to fit a target byte budget
+    (batch_bytes) based on the average row size of the table's first (probe sized) fetch.
+
+    Batch byte budget is capped so in_flight_batches batches use no more than half of available memory.
+    """
+
+    def __init__(self, batch_size=None, batch_bytes=None, in_flight_batches=1):
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes or default_batch_bytes
+        self.in_flight_batches = max(1, in_flight_batches)
+        self.row_size = 0
+        self.lock = threading.Lock()
+
+    def fetch_size(self):
+        """Return number of rows to fetch; a small probe fetch until the table's batch size is known."""
+        return self.batch_size or probe_batch_size
+
+    def fit(self, rows):
+        """Size batches based on the average row size of a table's first fetch."""
+        with self.lock:
+            if self.batch_size:
+                return
+
+            self.row_size = max(1, estimate_row_size(rows))
+            memory_budget = memory_available() // 2 // self.in_flight_batches
+            batch_bytes = min(self.batch_bytes, memory_budget)
+            self.batch_size = max(min_batch_size, min(max_batch_size, batch_bytes // self.row_size))
+
+            memory_info = f'memory available {memory_available():,}, process memory used {process_memory_used():,}'
+            logger.info(f'Batch size {self.batch_size:,} rows ({self.row_size:,} bytes/row; {memory_info})')
+
+    def data_size(self):
+        """Return estimated in-memory size (bytes) of a batch."""
+        return self.batch_size * self.row_size if self.batch_size else 0
+
+
+def save_batch(file_name, rows, table_schema):
+    """Save batch of rows to file in columnar batch format."""
+    with open(file_name, 'w') as output_stream:
+        output_stream.write(encode_batch(rows, table_schema))
+
+
+def load_batch(file_name):
+    """Return list of row lists from columnar or legacy jsonpickle batch file."""
+    with open(file_name) as input_stream:
+        return decode_batch(input_stream.read())
+
+
+# temp test harness ...
+
+
+# test code
+def main():
+    table_schema = tableschema.TableSchema('test', [])
+    for definition in ('id int', 'amount decimal', 'created datetime2', 'name nvarchar'):
+        table_schema.add_definition(definition)
+
+    rows = [
+        [1, decimal.Decimal('1.25'), datetime.datetime(2019, 1, 1, 12, 30), 'abc', 900],
+        [2, None, None, None, 900],
+        [3, decimal.Decimal('-3.50'), datetime.datetime(2019, 1, 2), 'xyz', 900],
+    ]
+    text = encode_batch(rows, table_schema)
+    logger.info(text)
+    assert decode_batch(text) == rows
+    assert decode_batch(to_jsonpickle(rows)) == rows
+
+
+# test code
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()
@@ -16,49 +16,76 @@ Options
 --onetime - run once/immediately; use when this script called via external scheduler
 --nowait - execute immediately, then follow regular schedule
 --notransfer - don't transfer captured data to blobstore; use for local testing
+
+Continuous capture (project continuous_interval) runs micro-batch capture cycles that keep source connections,
+config, schemas and generated selects warm across cycles; each cycle emits a small capture package.
 """
 
 
 # standard lib
+import collections
+import concurrent.futures
 import contextlib
+import copy
 import datetime
+import functools
+import itertools
 import logging
-import shutil
+import os
+import pathlib
+import signal
+import sqlite3
 import sys
+import threading
+import time
+import zipfile
 
 
 # common lib
-from common import copy_file_if_exists
 from common import clear_folder
 from common import create_folder
+from common import delete_file
 from common import describe
 from common import file_size
+from common import from_jsonpickle
 from common import is_file
 from common import is_glob_match
 from common import iso_to_datetime
 from common import just_file_name
+from common import just_file_stem
 from common import load_jsonpickle
 from common import save_jsonpickle
 from common import save_text
 from common import script_name
 from common import split
+from common import to_jsonpickle
+from common import ZipWriter
 
 
 # udp lib
+import batch
 import cdc_select
 import database
+import governor
+import rowhash
+import tableschema
 
 
 # udp classes
 from blobstore import BlobStore
 from daemon import Daemon
 from event import Events
+from package import CapturePackage
 
 
 # module level logger
 logger = logging.getLogger(__name__)
 
 
+# table change probes combined per probe select
+probe_batch_size = 50
+
+
 # job.ini - job_id counter and last_run_time for range checks
 # allow last_run_time to be overridden for new tables being onboarded
 
@@ -74,8 +101,20 @@ logger = logging.getLogger(__name__)
 # .dataset_name (pulled from parent folder)
 
 
+def rowversion_value(value):
+    """Convert a rowversion config value (int or 0x<hex> str) to an int; blank values convert to 0."""
+    value = str(value or 0).strip()
+    if value.lower().startswith('0x'):
+        return int(value, 16)
+    else:
+        return int(value)
+
+
 class TableHistory:
 
+    # table history watermark attributes persisted by JobHistory
+    history_attributes = ('last_filehash', 'last_rowhash', 'last_rowversion', 'last_sequence', 'last_timestamp')
+
     def __init__(self, table_name):
         self.table_name = table_name
         self.last_filehash = None
@@ -87,14 +126,30 @@ class TableHistory:
     def __str__(self):
         return describe(self, 'table_name, last_filehash, last_rowhash, last_rowversion, last_sequence, last_timestamp')
 
+    def history_values(self):
+        """Return table's watermark values as jsonpickle strs (preserves value types, eg. datetimes)."""
+        return tuple(to_jsonpickle(getattr(self, attribute_name)) for attribute_name in self.history_attributes)
+
 
 class JobHistory:
 
+    """
+    Capture job id and table histories stored in a SQLite database (<state_folder>/capture.db).
+
+    Saves are transactional and only write table histories that changed since they were loaded or last saved,
+    vs rewriting every table's history. A legacy capture.job (jsonpickle) file is imported on first load.
+    """
+
     def __init__(self, file_name):
-        self.file_name = file_name
+        self.file_name = str(pathlib.Path(file_name).with_suffix('.db'))
+        self.legacy_file_name = str(pathlib.Path(file_name).with_suffix('.job'))
         self.job_id = 1
         self.tables = dict()
 
+        # table history values as last loaded/saved; used to detect changed table histories
+        self.saved_values = dict()
+        self.conn = None
+
     def __str__(self):
         return describe(self, 'file_name, job_id, tables')
 
@@ -113,29 +168,293 @@ class JobHistory:
         logger.info(table_history)
         return table_history
 
+    def connect(self):
+        if not self.conn:
+            self.conn = sqlite3.connect(self.file_name)
+            with self.conn:
+                self.conn.execute('create table if not exists job (job_id integer not null)')
+                # watermark values are stored as jsonpickle text to preserve their types
+                column_definitions = ', '.join([f'{name} text' for name in TableHistory.history_attributes])
+                sql = f'create table if not exists table_history (table_name text primary key, {column_definitions})'
+                self.conn.execute(sql)
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
     def load(self):
-        if not is_file(self.file_name):
-            # file doesn't exist, initialize object with default values
+        is_new = not is_file(self.file_name)
+        self.connect()
+
+        row = self.conn.execute('select job_id from job').fetchone()
+        if row:
+            logger.info(f'Loading {self.file_name}')
+            self.job_id = row[0]
+            self.tables = dict()
+            self.saved_values = dict()
+            for table_name, *values in self.conn.execute('select * from table_history'):
+                table_history = TableHistory(table_name)
+                for attribute_name, value in zip(TableHistory.history_attributes, values):
+                    setattr(table_history, attribute_name, from_jsonpickle(value))
+                self.tables[table_name] = table_history
+                self.saved_values[table_name] = tuple(values)
+
+        elif is_new and is_file(self.legacy_file_name):
+            # import legacy capture.job file into new job history database
+            logger.info(f'Importing {self.legacy_file_name} into {self.file_name}')
+            obj = load_jsonpickle(self.legacy_file_name)
+            self.job_id = obj.job_id
+            self.tables = dict()
+            for table_name, legacy_table_history in obj.tables.items():
+                table_history = TableHistory(table_name)
+                for attribute_name in TableHistory.history_attributes:
+                    setattr(table_history, attribute_name, getattr(legacy_table_history, attribute_name, None))
+                self.tables[table_name] = table_history
+            self.saved_values = dict()
+            self.save(is_maintenance=True)
+
+        else:
+            # initialize object with default values
             logger.info(f'Initializing {self.file_name}')
             self.job_id = 1
             self.tables = dict()
+            self.saved_values = dict()
+
+    # updating get_table_history()'s table_history object updates original in self.tables[]
+    def save(self, is_maintenance=False):
+        """Save job id and changed (and deleted) table histories in a single transaction."""
+
+        # increment job_id if we're not in maintenance mode
+        job_id = self.job_id if is_maintenance else self.job_id + 1
+
+        self.connect()
+        changed_tables = []
+        for table_name, table_history in self.tables.items():
+            if table_history.history_values() != self.saved_values.get(table_name):
+                changed_tables.append(table_name)
+        deleted_tables = [name for name in self.saved_values if name not in self.tables]
+        logger.info(f'Saving {self.file_name} ({len(changed_tables)} changed, {len(deleted_tables)} deleted tables)')
+        with self.conn:
+            self.conn.execute('delete from job')
+            self.conn.execute('insert into job (job_id) values (?)', (job_id,))
+            for table_name in changed_tables:
+                self.write_table_history(self.tables[table_name])
+            for table_name in deleted_tables:
+                self.conn.execute('delete from table_history where table_name = ?', (table_name,))
+                self.saved_values.pop(table_name)
+
+        self.job_id = job_id
+
+    def write_table_history(self, table_history):
+        values = table_history.history_values()
+        parameters = ', '.join(['?'] * (len(values) + 1))
+        sql = f'insert or replace into table_history values ({parameters})'
+        self.conn.execute(sql, (table_history.table_name, *values))
+        self.saved_values[table_history.table_name] = values
+
+
+class SchemaCache:
+
+    """
+    Schema catalog and each table's last captured schema saved in state_folder between capture jobs.
+
+    The cached schema catalog is reused while the source's schema checksum is unchanged. Tables whose schema
+    fingerprint differs from their last captured schema are reported as schema changes.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.schema_checksum = None
+        self.schema_catalog = None
+
+        # (table_schema, pk_columns) of each table's last capture indexed by lowercase table name
+        self.tables = dict()
+
+    def __str__(self):
+        return describe(self, 'file_name, schema_checksum, tables')
+
+    def load(self):
+        if not is_file(self.file_name):
+            logger.info(f'Initializing {self.file_name}')
+            self.schema_checksum = None
+            self.schema_catalog = None
+            self.tables = dict()
         else:
             logger.info(f'Loading {self.file_name}')
             obj = load_jsonpickle(self.file_name)
 
             # load key attributes
-            self.job_id = obj.job_id
+            self.schema_checksum = obj.schema_checksum
+            self.schema_catalog = obj.schema_catalog
             self.tables = obj.tables
 
-    # updating get_table_history()'s table_history object updates original in self.tables[]
-    def save(self, is_maintenance=False):
+    def save(self):
         logger.info(f'Saving file {self.file_name}')
+        save_jsonpickle(self.file_name, self)
 
-        # increment job_id if we're not in maintenance mode
-        if not is_maintenance:
-            self.job_id += 1
+    def schema_change(self, table_name, table_schema, pk_columns):
+        """
+        Return a dict describing a table's schema change since its last capture or None if its schema is unchanged.
+        Caches table's current schema. Change actions: create (first capture), alter (columns added), rebuild.
+        """
+        table_key = table_name.lower()
+        fingerprint = table_schema.fingerprint()
+        previous_schema, previous_pk_columns = self.tables.get(table_key, (None, None))
+        self.tables[table_key] = (table_schema, pk_columns)
+
+        if previous_schema is None:
+            action = 'create'
+            previous_fingerprint = None
+            added, dropped, altered = list(table_schema.columns), [], []
+        else:
+            previous_fingerprint = previous_schema.fingerprint()
+            if previous_fingerprint == fingerprint and previous_pk_columns == pk_columns:
+                return None
+
+            # columns appended to an otherwise unchanged table can be added to target table in place
+            added, dropped, altered = table_schema.compare(previous_schema)
+            is_appended = list(table_schema.columns)[:len(previous_schema.columns)] == list(previous_schema.columns)
+            if added and is_appended and not altered and previous_pk_columns == pk_columns:
+                action = 'alter'
+            else:
+                action = 'rebuild'
 
-        save_jsonpickle(self.file_name, self)
+        return dict(
+            table_name=table_name, action=action, fingerprint=fingerprint, previous_fingerprint=previous_fingerprint,
+            added_columns=added, dropped_columns=dropped, altered_columns=altered,
+            pk_columns=pk_columns, previous_pk_columns=previous_pk_columns
+        )
+
+
+class CaptureCheckpoint:
+
+    """
+    Progress of an in-progress capture job saved in state_folder as batches are written to the job's package.
+
+    A job restarted after a failure resumes from its checkpoint: tables completed by the failed job are skipped,
+    tables interrupted mid-extract resume after their last saved batch's key (keyset predicate), and the package
+    is resumed from the checkpoint's offset so batches already written are reused vs re-extracted.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.job_id = None
+        self.current_timestamp = None
+        self.current_rowversion = None
+
+        # package's (offset, entries) as of last saved batch
+        self.package = None
+
+        # table progress (status: partial, complete) indexed by lowercase table name
+        self.tables = dict()
+
+        # protects checkpoint updated by parallel table workers
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return describe(self, 'file_name, job_id, current_timestamp, current_rowversion')
+
+    def load(self):
+        if not is_file(self.file_name):
+            self.job_id = None
+            self.current_timestamp = None
+            self.current_rowversion = None
+            self.package = None
+            self.tables = dict()
+        else:
+            logger.info(f'Loading {self.file_name}')
+            obj = load_jsonpickle(self.file_name)
+
+            # load key attributes
+            self.job_id = obj['job_id']
+            self.current_timestamp = obj['current_timestamp']
+            self.current_rowversion = obj['current_rowversion']
+            self.package = obj['package']
+            self.tables = obj['tables']
+
+    def save(self):
+        # Note: Caller holds lock. Checkpoint is saved as a dict since our lock can't be pickled.
+        obj = dict(
+            job_id=self.job_id, current_timestamp=self.current_timestamp, current_rowversion=self.current_rowversion,
+            package=self.package, tables=self.tables
+        )
+        save_jsonpickle(f'{self.file_name}.new', obj)
+        os.replace(f'{self.file_name}.new', self.file_name)
+
+    def start(self, job_id):
+        """Start a new job's checkpoint."""
+        logger.info(f'Initializing {self.file_name}')
+        self.job_id = job_id
+        self.current_timestamp = None
+        self.current_rowversion = None
+        self.package = None
+        self.tables = dict()
+
+    def clear(self):
+        """Remove checkpoint once its job succeeds."""
+        delete_file(self.file_name)
+
+    def is_resumable(self, job_id, package_file_name):
+        """Return True if checkpoint is for job_id and its package is intact up to the checkpoint's offset."""
+        if self.job_id != job_id or not self.package:
+            return False
+        if not is_file(package_file_name) or file_size(package_file_name) < self.package[0]:
+            logger.warning(f'Capture package {package_file_name} missing or truncated; checkpoint ignored')
+            return False
+        return True
+
+    def table(self, table_name):
+        """Return table's checkpoint or None if table has no checkpoint."""
+        return self.tables.get(table_name.lower())
+
+    def resume_package(self):
+        """Return package checkpoint with entries of completed tables and interrupted tables' checkpointed batches."""
+        if not self.package:
+            return None
+
+        offset, entries = self.package
+        resumed_entries = []
+        for entry in entries:
+            # entry names: <table>#<batch_number>.json (batches) and <table>.<type> (table entries)
+            entry_name = entry['filename']
+            if '#' in entry_name:
+                table_name, _, batch_name = entry_name.partition('#')
+                batch_number = int(batch_name.partition('.')[0])
+            else:
+                table_name = entry_name.rpartition('.')[0]
+                batch_number = 0
+
+            table = self.table(table_name)
+            if not table:
+                continue
+            if table['status'] == 'complete' or batch_number <= table['batch_number']:
+                resumed_entries.append(entry)
+
+        return offset, resumed_entries
+
+    def save_batch(self, package, table_name, pk_positions, batch_number, last_row, row_count, data_size):
+        """Checkpoint a table's saved batch (batches are saved in batch order)."""
+        with self.lock:
+            table = self.tables.setdefault(table_name.lower(), dict(status='partial', row_count=0, data_size=0))
+            table['batch_number'] = batch_number
+            table['last_key'] = [last_row[position] for position in pk_positions]
+            table['row_count'] += row_count
+            table['data_size'] += data_size
+            self.package = package.checkpoint()
+            self.save()
+
+    def complete_table(self, package, table_name, history_updates, table_schema, pk_columns, row_count, data_size,
+                       rowhash_file_name=None):
+        """Checkpoint a captured table; completed tables are skipped when job is resumed."""
+        with self.lock:
+            self.tables[table_name.lower()] = dict(
+                status='complete', batch_number=0, history_updates=history_updates,
+                table_schema=table_schema, pk_columns=pk_columns, row_count=row_count, data_size=data_size,
+                rowhash_file_name=rowhash_file_name
+            )
+            self.package = package.checkpoint()
+            self.save()
 
 
 class CaptureDaemon(Daemon):
@@ -147,6 +466,7 @@ class CaptureDaemon(Daemon):
         # job specific files
         self.capture_file_name = None
         self.zip_file_name = None
+        self.package = None
 
         # capture specific properties
         self.dataset_name = None
@@ -155,10 +475,44 @@ class CaptureDaemon(Daemon):
         self.events = None
         self.job_id = None
 
+        # schema's table schemas and pks discovered at job start and cached between jobs
+        self.schema_catalog = None
+        self.schema_cache = None
+
+        # batch checkpoints of current job (project checkpoint=1) used to resume an interrupted job
+        self.checkpoint = None
+
+        # rowhash cdc index file names committed when job succeeds
+        self.rowhash_indexes = []
+
+        # limits job's load on source database (database_source's governor properties)
+        self.governor = governor.LoadGovernor()
+
+        # routes source connections across database_source's replicas
+        self.router = None
+
+        # source session: (db, db_engine) connection and parallel table connection pool; continuous capture
+        # (project continuous_interval) keeps source session, job history and schema cache open between cycles
+        self.source = None
+        self.table_pool = None
+        self.job_history = None
+
+        # source session's connection pools to the replicas tables are pinned to (table replica) by replica
+        self.replica_pools = dict()
+
+        # source session's prepared (SelectCDC.prepare()) selects and probes
+        self.select_cache = dict()
+
+        # continuous capture stops after its current cycle when signaled (SIGINT/SIGTERM) or a stop file exists
+        self.stop_event = threading.Event()
+
         # overall job metrics
         self.job_row_count = 0
         self.job_data_size = 0
 
+        # protects job metrics updated by parallel table workers
+        self.job_lock = threading.Lock()
+
     def startup(self):
         # not required in current implementation
         pass
@@ -176,8 +530,13 @@ class CaptureDaemon(Daemon):
         logger.info(f'Current timestamp: {current_timestamp}')
         return current_timestamp
 
-    def process_table(self, db, db_engine, schema_name, table_name, table_object, table_history, current_timestamp, current_sequence=0):
-        """Process a specific table."""
+    def process_table(self, db, db_engine, schema_name, table_name, table_object, table_history, current_timestamp,
+                      current_sequence=0, current_rowversion=0):
+        """
+        Process a specific table. Returns dict of table history updates if table was captured or None if skipped.
+
+        Note: Table history is updated by caller once all tables have been captured successfully.
+        """
 
         # skip default table and ignored tables
         if table_name == 'default':
@@ -213,6 +572,11 @@ class CaptureDaemon(Daemon):
                 table_object.first_sequence = 0
             table_history.last_sequence = table_object.first_sequence
 
+        # initialize table's last_rowversion to first_rowversion (int or 0x<hex> value) if not set yet
+        if not table_history.last_rowversion:
+            table_history.last_rowversion = rowversion_value(table_object.first_rowversion)
+        last_rowversion = table_history.last_rowversion
+
         self.events.start(table_name, 'table')
         # logger.info(f'Processing {table_name} ...')
 
@@ -220,11 +584,13 @@ class CaptureDaemon(Daemon):
         cursor = db.conn.cursor()
 
         # save table object for stage
-        table_file_name = f'{self.work_folder}/{table_name}.table'
-        save_jsonpickle(table_file_name, table_object)
+        self.package.write_text(f'{table_name}.table', to_jsonpickle(table_object))
 
-        # discover table schema
-        table_schema = db_engine.select_table_schema(schema_name, table_name)
+        # discover table schema from job's schema catalog
+        if self.schema_catalog:
+            table_schema = self.schema_catalog.table_schema(table_name)
+        else:
+            table_schema = db_engine.select_table_schema(schema_name, table_name)
 
         # handle non-existent tables
         if table_schema is None:
@@ -249,14 +615,22 @@ class CaptureDaemon(Daemon):
                 table_schema.columns.pop(column_name)
 
         # save table schema for stage to use
-        schema_table_name = f'{self.work_folder}/{table_name}.schema'
-        save_jsonpickle(schema_table_name, table_schema)
+        self.package.write_text(f'{table_name}.schema', to_jsonpickle(table_schema))
 
         # save table pk for stage to use
-        pk_columns = db_engine.select_table_pk(schema_name, table_name)
+        if self.schema_catalog:
+            pk_columns = self.schema_catalog.table_pk(table_name)
+        else:
+            pk_columns = db_engine.select_table_pk(schema_name, table_name)
         if not pk_columns and table_object.primary_key:
             pk_columns = table_object.primary_key
-        save_text(f'{self.work_folder}/{table_name}.pk', pk_columns)
+        self.package.write_text(f'{table_name}.pk', pk_columns)
+
+        # flag schema changes since table's last capture so stage knows to alter or rebuild its target table
+        schema_change = self.schema_cache.schema_change(table_name, table_schema, pk_columns)
+        if schema_change:
+            logger.info(f'Table({table_name}): schema change ({schema_change["action"]})')
+            self.package.write_text(f'{table_name}.schema_change', to_jsonpickle(schema_change))
 
         # normalize cdc setting
         table_object.cdc = table_object.cdc.lower()
@@ -274,6 +648,11 @@ class CaptureDaemon(Daemon):
             logger.warning(f'Warning: CDC enabled but no PK; CDC setting cleared ({table_name}.cdc={table_object.cdc})')
             table_object.cdc = ''
 
+        # clear rowversion cdc setting when no rowversion column is specified
+        if table_object.cdc == 'rowversion' and not table_object.rowversion:
+            logger.warning(f'Warning: Rowversion CDC but no rowversion column; CDC setting cleared ({table_name})')
+            table_object.cdc = ''
+
         # if no cdc, then clear cdc related attributes
         if not table_object.cdc:
             table_object.filehash = ''
@@ -282,55 +661,152 @@ class CaptureDaemon(Daemon):
             table_object.sequence = ''
             table_object.timestamp = ''
 
+        # cdc tables being rebuilt by stage are recaptured in full
+        # Note: Rowhash tables start from an empty row hash index (see row_filter below).
+        elif schema_change and schema_change['action'] == 'rebuild':
+            logger.warning(f'Table({table_name}): schema changed; recapturing from first timestamp/rowversion')
+            last_timestamp = iso_to_datetime(table_object.first_timestamp or '1900-01-01')
+            last_rowversion = rowversion_value(table_object.first_rowversion)
+
         # update table object properties for cdc select build
         column_names = list(table_schema.columns.keys())
         table_object.schema_name = schema_name
         table_object.table_name = table_name
         table_object.column_names = column_names
         select_cdc = cdc_select.SelectCDC(db_engine, table_object)
-        sql = select_cdc.select(self.job_id, current_timestamp, last_timestamp)
 
-        # save generated SQL to work folder for documentation purposes
-        sql_file_name = f'{self.work_folder}/{table_name}.sql'
-        save_text(sql_file_name, sql)
+        # table history updates to apply if job succeeds
+        history_updates = dict(last_timestamp=current_timestamp, last_sequence=current_sequence)
 
-        # run sql here vs via db_engine.capture_select
-        # cursor = db_engine.capture_select(schema_name, table_name, column_names, last_timestamp, current_timestamp)
-        cursor.execute(sql)
+        # rowversion cdc selects rows with rowversions >= last_rowversion and < current_rowversion
+        if table_object.cdc == 'rowversion':
+            select_cdc.rowversion_logic(current_rowversion, last_rowversion)
+            history_updates['last_rowversion'] = current_rowversion
 
-        # capture rows in fixed size batches to support unlimited size record counts
+        # capture rows in batches to support unlimited size record counts
         # Note: Batching on capture side allows stage to insert multiple batches in parallel.
-
-        if self.project.batch_size:
-            batch_size = int(self.project.batch_size)
-            # logger.info(f'Using project specific batch size: {self.project.batch_size}')
+        # Note: Filehash tables aren't partitioned; their row stream is hashed in row order.
+        if table_object.partition_column and table_object.partition_count and int(table_object.partition_count) > 1:
+            partition_count = int(table_object.partition_count)
         else:
-            batch_size = 250_000
-
-        batch_number = 0
-        row_count = 0
-        data_size = 0
-        while True:
-            batch_number += 1
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
-                break
+            partition_count = 1
+        if partition_count > 1 and table_object.cdc == 'filehash':
+            logger.info(f'Table({table_name}): filehash cdc; partitioning disabled')
+            partition_count = 1
+
+        # project specific batch_size fixes batch size, otherwise batches are sized to fit batch_bytes
+        # with memory headroom for every batch that may be in flight across parallel tables and partitions
+        batch_size = int(self.project.batch_size) if self.project.batch_size else None
+        batch_bytes = int(self.project.batch_bytes) if self.project.batch_bytes else None
+        max_parallel_tables = int(self.project.max_parallel_tables) if self.project.max_parallel_tables else 1
+        in_flight_batches = (self.pipeline_worker_count() * 2 + 1) * partition_count * max(1, max_parallel_tables)
+        batch_sizer = batch.BatchSizer(batch_size, batch_bytes, in_flight_batches)
+
+        # batch numbers are shared across a table's partitions so each batch file name is unique
+        batch_numbers = itertools.count(1)
+
+        # rowhash cdc captures new and changed rows based on table's row hash index from its last capture
+        # Note: Rebuilt tables ignore (and on commit, replace) their last index so every row reaches the new target.
+        if table_object.cdc == 'rowhash':
+            pk_positions = [column_names.index(column_name) for column_name in split(pk_columns)]
+            is_rebuild = bool(schema_change) and schema_change['action'] == 'rebuild'
+            index_file_name = f'{self.state_folder}/{table_name}'
+            index_args = (index_file_name, pk_positions, len(column_names))
+            last_fingerprint = table_history.last_rowhash
+            row_filter = rowhash.RowHashIndex(*index_args, is_rebuild=is_rebuild, last_fingerprint=last_fingerprint)
+        else:
+            row_filter = None
 
-            logger.info(f'Table({table_name}): batch={batch_number} using batch size {batch_size:,}')
-            self.progress_message(f'extracting({table_name}.{batch_number:04}) ...')
+        # filehash cdc hashes table's rows and spools batches until we know if table has changed
+        if table_object.cdc == 'filehash':
+            row_stream_hash = batch.RowStreamHash(len(table_schema.columns))
+        else:
+            row_stream_hash = None
+
+        # checkpoint saved batches so an interrupted job resumes after table's last saved key
+        # Note: Checkpointed tables are selected in pk order; partitioned, rowhash and filehash tables restart.
+        is_checkpointed = self.checkpoint and partition_count == 1 and not row_filter and not row_stream_hash
+        is_checkpointed = is_checkpointed and pk_columns and split(table_object.order) in ([], split(pk_columns))
+        resume_row_count, resume_data_size = 0, 0
+        if is_checkpointed:
+            table_object.order = pk_columns
+            pk_positions = [column_names.index(column_name) for column_name in split(pk_columns)]
+            table_checkpoint = self.checkpoint.table(table_name)
+            if table_checkpoint:
+                batch_number = table_checkpoint['batch_number']
+                logger.info(f'Table({table_name}): resuming after batch {batch_number}')
+                key_data_types = [table_schema.columns[column_name].data_type for column_name in split(pk_columns)]
+                select_cdc.keyset_logic(pk_columns, table_checkpoint['last_key'], key_data_types)
+                batch_numbers = itertools.count(batch_number + 1)
+                resume_row_count, resume_data_size = table_checkpoint['row_count'], table_checkpoint['data_size']
+            on_batch_saved = functools.partial(self.checkpoint.save_batch, self.package, table_name, pk_positions)
+        else:
+            on_batch_saved = None
 
-            # flatten rows to list of column values
-            json_rows = [list(row) for row in rows]
-            output_file = f'{self.work_folder}/{table_name}#{batch_number:04}.json'
-            save_jsonpickle(output_file, json_rows)
+        extract_args = (
+            table_name, table_schema, batch_sizer, batch_numbers, row_filter, row_stream_hash, on_batch_saved
+        )
+        try:
+            if partition_count > 1:
+                # split very large tables into key ranges extracted concurrently
+                timestamps = (current_timestamp, last_timestamp)
+                row_count, data_size = self.extract_partitions(cursor, select_cdc, *timestamps, *extract_args)
+            else:
+                # selects are prepared once per source session and rebound with each job's values
+                # Note: Resumed (keyset) selects are one-off selects.
+                if select_cdc.keyset_where_condition:
+                    sql = select_cdc.select(self.job_id, current_timestamp, last_timestamp)
+                else:
+                    prepared_sql = self.prepared_select(table_name.lower(), select_cdc)
+                    select_args = (current_timestamp, last_timestamp, current_rowversion, last_rowversion)
+                    sql = select_cdc.bind(prepared_sql, self.job_id, *select_args)
+
+                # save generated SQL to capture package for documentation purposes
+                self.package.write_text(f'{table_name}.sql', sql)
+
+                # run sql here vs via db_engine.capture_select
+                # cursor = db_engine.capture_select(schema_name, table_name, column_names, last_timestamp, current_timestamp)
+                # stream rows from server vs loading table's entire result set into memory
+                with self.governor.query(), contextlib.closing(db.stream_cursor()) as stream_cursor:
+                    stream_cursor.execute(sql)
+                    row_count, data_size = self.extract_batches(stream_cursor, *extract_args)
+                row_count, data_size = row_count + resume_row_count, data_size + resume_data_size
+        except Exception:
+            if row_filter:
+                row_filter.close()
+            raise
 
-            # track metrics
-            row_count += len(json_rows)
-            data_size += file_size(output_file)
+        # save table's new row hash index (committed when job succeeds) and optionally capture deleted keys
+        if row_filter:
+            deleted_keys = row_filter.finish()
+            if deleted_keys and table_object.rowhash_deletes == '1':
+                pk_schema = tableschema.TableSchema(table_name, [])
+                for column_name in split(pk_columns):
+                    pk_schema.columns[column_name] = table_schema.columns[column_name]
+                deleted_batch = batch.encode_batch(deleted_keys, pk_schema)
+                self.package.write_text(f'{table_name}.deletes', deleted_batch, len(deleted_keys))
+            with self.job_lock:
+                self.rowhash_indexes.append(row_filter.file_name)
+            history_updates['last_rowhash'] = row_filter.fingerprint
+
+        # filehash cdc only ships table's batches if their contents changed since table's last capture
+        if row_stream_hash:
+            batch_numbers = row_stream_hash.batch_numbers
+            batch_file_names = [self.spool_file_name(table_name, batch_number) for batch_number in batch_numbers]
+            filehash = row_stream_hash.hexdigest()
+            if filehash == table_history.last_filehash and not schema_change:
+                logger.info(f'Table({table_name}): unchanged (filehash={filehash}); batches dropped')
+                self.package.write_text(f'{table_name}.unchanged', filehash)
+                row_count, data_size = 0, 0
+            else:
+                for batch_file_name in batch_file_names:
+                    self.package.write_file(batch_file_name)
+            for batch_file_name in batch_file_names:
+                delete_file(batch_file_name)
+            history_updates['last_filehash'] = filehash
 
-        # update table history with new last timestamp and sequence values
-        table_history.last_timestamp = current_timestamp
-        table_history.last_sequence = current_sequence
+        # record table's batch size (rows) and estimated batch size (bytes)
+        self.events.add(f'{table_name}:batch_size', 'batch_size', 0, batch_sizer.batch_size or 0, batch_sizer.data_size())
 
         # track total row count and file size across all of a table's batched json files
         self.events.stop(table_name, row_count, data_size)
@@ -338,29 +814,451 @@ class CaptureDaemon(Daemon):
         # save interim metrics for diagnostics
         self.events.save()
 
-        self.job_row_count += row_count
-        self.job_data_size += data_size
+        with self.job_lock:
+            self.job_row_count += row_count
+            self.job_data_size += data_size
+
+        # completed tables are skipped if job is resumed
+        if self.checkpoint:
+            rowhash_file_name = row_filter.file_name if row_filter else None
+            checkpoint_args = (history_updates, table_schema, pk_columns, row_count, data_size, rowhash_file_name)
+            self.checkpoint.complete_table(self.package, table_name, *checkpoint_args)
 
         # explicitly close cursor when finished
         # cursor.close()
-        return
+        return history_updates
+
+    def prepared_select(self, cache_key, select_cdc, is_probe=False):
+        """Return select_cdc's prepared select (or probe); prepared SQL is cached for the source session."""
+        column_names = getattr(select_cdc.table, 'column_names', None)
+        prepared = self.select_cache.get(cache_key)
+        if not prepared or prepared[0] != column_names:
+            prepared = (column_names, select_cdc.prepare(is_probe))
+            self.select_cache[cache_key] = prepared
+        return prepared[1]
+
+    def spool_file_name(self, table_name, batch_number):
+        """Return work folder file name of a spooled batch."""
+        return f'{self.work_folder}/{table_name}#{batch_number:04}.json'
+
+    def save_batch(self, table_name, table_schema, batch_number, rows, is_spooled=False):
+        """
+        Serialize and write a batch of rows to capture package. Returns data size and stage timings.
+        Batches are spooled to work folder (vs written to capture package) when is_spooled (filehash cdc).
+        """
+
+        # encode rows as typed columnar batch (default) or legacy jsonpickle list of row lists
+        start_time = time.perf_counter()
+        if self.project.batch_format == 'jsonpickle':
+            json_rows = [list(row) for row in rows]
+            batch_text = to_jsonpickle(json_rows)
+        else:
+            batch_text = batch.encode_batch(rows, table_schema)
+        serialize_time = time.perf_counter() - start_time
+
+        # filehash cdc spools batches until table's row stream hash is known
+        if is_spooled:
+            start_time = time.perf_counter()
+            save_text(self.spool_file_name(table_name, batch_number), batch_text)
+            write_time = time.perf_counter() - start_time
+            return len(batch_text), serialize_time, write_time
+
+        # stream batch directly into capture package
+        start_time = time.perf_counter()
+        entry = self.package.write_text(f'{table_name}#{batch_number:04}.json', batch_text, len(rows))
+        write_time = time.perf_counter() - start_time
+
+        return entry.file_size, serialize_time, write_time
+
+    def pipeline_worker_count(self):
+        """Return number of pipeline workers that serialize and write each cursor's fetched batches."""
+        if self.project.pipeline_workers:
+            return int(self.project.pipeline_workers)
+        else:
+            return 2
 
-    def compress_work_folder(self):
-        """Compress all files in work_folder to single file in publish_folder."""
+    def extract_batches(self, cursor, table_name, table_schema, batch_sizer, batch_numbers, row_filter=None,
+                        row_stream_hash=None, on_batch_saved=None):
+        """
+        Save cursor's rows as numbered batches. Returns row count and data size of batches saved.
+        Adaptive batch sizers are fit to the table's first fetch; subsequent fetches use the fitted batch size.
+        Row filters (rowhash cdc) reduce fetched rows to new and changed rows before they're saved.
+        Row stream hashes (filehash cdc) hash rows in fetch order (excludes udp_job and udp_timestamp columns);
+        batches are spooled to work folder.
+        On_batch_saved(batch_number, last_row, row_count, data_size) is called as batches are saved in batch order.
 
-        # setup
-        self.events.start('compress', 'step')
+        Fetching (this thread) is pipelined with serializing and writing batches (pipeline workers) through a
+        bounded number of in-flight batches so the source connection isn't idle while we serialize and write.
+        Per-stage (fetch, serialize, write) timings are recorded as <table_name>:<stage> pipeline stats.
+        """
+
+        pipeline_workers = self.pipeline_worker_count()
+
+        # limit fetched batches held in memory waiting for a pipeline worker
+        in_flight_batches = threading.BoundedSemaphore(pipeline_workers * 2)
+
+        row_count = 0
+        data_size = 0
+        timings = dict(fetch=0, serialize=0, write=0)
+        if row_filter:
+            timings['rowhash'] = 0
+        if row_stream_hash:
+            timings['filehash'] = 0
+        if self.governor.is_limited():
+            timings['throttle'] = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pipeline_workers) as executor:
+            futures = []
+            while True:
+                in_flight_batches.acquire()
+                start_time = time.perf_counter()
+                rows = cursor.fetchmany(batch_sizer.fetch_size())
+                timings['fetch'] += time.perf_counter() - start_time
+                if not rows:
+                    in_flight_batches.release()
+                    break
+                batch_sizer.fit(rows)
+
+                # pace fetches to source's rows/bytes per second limits
+                if 'throttle' in timings:
+                    timings['throttle'] += self.governor.throttle(rows)
+
+                # rowhash cdc only saves new and changed rows
+                if row_filter:
+                    start_time = time.perf_counter()
+                    rows = row_filter.changes(rows)
+                    timings['rowhash'] += time.perf_counter() - start_time
+                    if not rows:
+                        in_flight_batches.release()
+                        continue
+
+                # Note: next() on an itertools.count() is atomic so partitions can share batch numbers.
+                batch_number = next(batch_numbers)
+                logger.info(f'Table({table_name}): batch={batch_number} using batch size {len(rows):,}')
+                self.progress_message(f'extracting({table_name}.{batch_number:04}) ...')
+
+                # filehash cdc hashes rows in fetch (row) order, independent of batch boundaries
+                if row_stream_hash:
+                    start_time = time.perf_counter()
+                    row_stream_hash.update(batch_number, rows)
+                    timings['filehash'] += time.perf_counter() - start_time
+
+                is_spooled = bool(row_stream_hash)
+                future = executor.submit(self.save_batch, table_name, table_schema, batch_number, rows, is_spooled)
+                future.add_done_callback(lambda _: in_flight_batches.release())
+                futures.append((future, batch_number, rows[-1], len(rows)))
+                row_count += len(rows)
+
+                # surface serialize/write errors without waiting for the table's remaining batches
+                while futures and futures[0][0].done():
+                    data_size += self.batch_saved(futures.pop(0), timings, on_batch_saved)
+
+            for saved_batch in futures:
+                data_size += self.batch_saved(saved_batch, timings, on_batch_saved)
+
+        # record stage timings so we can see which stage is each table's bottleneck
+        for stage_name, run_time in timings.items():
+            self.events.add(f'{table_name}:{stage_name}', 'pipeline', run_time, row_count)
+        stage_timings = ', '.join([f'{stage_name} {run_time:.1f}s' for stage_name, run_time in timings.items()])
+        logger.info(f'Table({table_name}): pipeline timings: {stage_timings}')
+
+        return row_count, data_size
+
+    @staticmethod
+    def batch_saved(saved_batch, timings, on_batch_saved=None):
+        """Accumulate a saved batch's stage timings. Returns batch's data size; raises batch's save exception."""
+        future, batch_number, last_row, batch_row_count = saved_batch
+        batch_data_size, serialize_time, write_time = future.result()
+        timings['serialize'] += serialize_time
+        timings['write'] += write_time
+        if on_batch_saved:
+            on_batch_saved(batch_number, last_row, batch_row_count, batch_data_size)
+        return batch_data_size
+
+    def extract_partition(self, pool, sql, *extract_args):
+        """Extract a table partition using a connection borrowed from a pool of partition connections."""
+        with pool.connection() as (db, db_engine):
+            with self.governor.query(), contextlib.closing(db.stream_cursor()) as cursor:
+                cursor.execute(sql)
+                return self.extract_batches(cursor, *extract_args)
+
+    def extract_partitions(self, cursor, select_cdc, current_timestamp, last_timestamp, *extract_args):
+        """
+        Extract a table as partition_count key ranges (partition_column) using concurrent sub-selects.
+        Each partition writes its own numbered batch files. Returns total row count and data size.
+        """
+        table_object = select_cdc.table
+        table_name = table_object.table_name
+        partition_count = int(table_object.partition_count)
+
+        # get partition boundaries from source
+        cursor.execute(select_cdc.partition_boundaries(partition_count))
+        rows = cursor.fetchall()
+        if table_object.partition_method.lower() == 'range':
+            boundaries = cdc_select.split_range(rows[0][0], rows[0][1], partition_count)
+        else:
+            # ntile returns each bucket's max value; last partition is open ended to include late arriving keys
+            boundaries = [row[0] for row in rows[:-1]]
+        boundaries = sorted(set(boundary for boundary in boundaries if boundary is not None))
+
+        # build a sub-select per key range
+        sqls = []
+        for partition_condition in select_cdc.partition_conditions(boundaries):
+            sqls.append(select_cdc.select(self.job_id, current_timestamp, last_timestamp, partition_condition))
+
+        # save generated SQL to capture package for documentation purposes
+        self.package.write_text(f'{table_name}.sql', '\n\n'.join(sqls))
+
+        # each partition runs on its own connection
+        logger.info(f'Table({table_name}): extracting {len(sqls)} partitions on {table_object.partition_column}')
+        row_count = 0
+        data_size = 0
+        pool = database.ConnectionPool(self.database, len(sqls), self.router, table_object.replica)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(sqls)) as executor:
+                futures = [executor.submit(self.extract_partition, pool, sql, *extract_args) for sql in sqls]
+                for future in concurrent.futures.as_completed(futures):
+                    partition_row_count, partition_data_size = future.result()
+                    row_count += partition_row_count
+                    data_size += partition_data_size
+        finally:
+            pool.close()
+
+        return row_count, data_size
+
+    def process_pooled_table(self, pool, *args):
+        """Process a table using a connection borrowed from a pool of worker connections."""
+        table_object = args[2]
+        if table_object.replica:
+            return self.process_pinned_table(*args)
+        with pool.connection() as (db, db_engine):
+            return self.process_table(db, db_engine, *args)
+
+    def process_pinned_table(self, *args):
+        """Process a table using a connection borrowed from the source session's pool to the table's replica."""
+        table_object = args[2]
+        with self.replica_pools[table_object.replica].connection() as (db, db_engine):
+            return self.process_table(db, db_engine, *args)
+
+    def open_replica_pools(self, tasks, max_parallel_tables):
+        """
+        Open (or grow) connection pools to the replicas that tables are pinned to, sized for the tables that may
+        extract in parallel. Pools stay open for source session's next job (closed by close_source()).
+        """
+        table_counts = collections.Counter([table_args[2].replica for table_args, _ in tasks if table_args[2].replica])
+        for replica, table_count in table_counts.items():
+            pool_size = min(max_parallel_tables, table_count)
+            pool = self.replica_pools.get(replica)
+            if pool and pool.size < pool_size:
+                pool.close()
+                pool = None
+            if not pool:
+                self.replica_pools[replica] = database.ConnectionPool(self.database, pool_size, self.router, replica)
+
+    def extract_tables(self, db, db_engine, job_history, current_timestamp):
+        """
+        Extract all tables, in parallel across a bounded pool of connections when max_parallel_tables > 1.
+        Returns list of (table_history, history_updates) updates to apply if job succeeds.
+        """
+
+        # discover all table schemas and pks in a couple of catalog queries vs several queries per table
+        # reuse last job's schema catalog if the source's cheap schema checksum hasn't changed
+        schema_name = self.database.schema
+        self.events.start('catalog', 'step')
+        schema_checksum = db_engine.select_schema_checksum(schema_name)
+        schema_catalog = self.schema_cache.schema_catalog
+        is_cached = schema_catalog and schema_catalog.schema_name == schema_name
+        is_schema_unchanged = is_cached and self.schema_cache.schema_checksum == schema_checksum
+        if is_schema_unchanged:
+            logger.info('Schema checksum unchanged; using cached schema catalog')
+            self.schema_catalog = schema_catalog
+        else:
+            self.schema_catalog = db_engine.select_schema_catalog(schema_name)
+            self.schema_cache.schema_checksum = schema_checksum
+            self.schema_cache.schema_catalog = self.schema_catalog
+            self.select_cache.clear()
+        self.events.stop('catalog', len(self.schema_catalog.table_schemas))
+
+        # rowversions are database wide; min_active_rowversion() at job start applies to all rowversion cdc tables
+        # resumed jobs reuse their original job's rowversion
+        if self.checkpoint and self.checkpoint.current_rowversion is not None:
+            current_rowversion = self.checkpoint.current_rowversion
+        elif any(table_object.cdc.lower() == 'rowversion' for table_object in self.tables.values()):
+            current_rowversion = db_engine.current_rowversion()
+            logger.info(f'Current rowversion: {cdc_select.rowversion_literal(current_rowversion)}')
+        else:
+            current_rowversion = 0
+        if self.checkpoint:
+            self.checkpoint.current_rowversion = current_rowversion
+
+        # probe tables for changes in bulk; probes are skipped when schema changes may require tables be recaptured
+        if is_schema_unchanged:
+            unchanged_tables = self.probe_tables(db, db_engine, job_history, current_timestamp, current_rowversion)
+        else:
+            unchanged_tables = set()
+
+        # build list of table tasks
+        tasks = []
+        table_updates = []
+        for table_name, table_object in self.tables.items():
+            table_history = job_history.get_table_history(table_name)
+
+            # skip tables completed before a resumed job was interrupted
+            table_checkpoint = self.checkpoint.table(table_name) if self.checkpoint else None
+            if table_checkpoint and table_checkpoint['status'] == 'complete':
+                logger.info(f'Table({table_name}): captured before job was interrupted; skipped')
+                table_updates.append((table_history, table_checkpoint['history_updates']))
+                table_schema, pk_columns = table_checkpoint['table_schema'], table_checkpoint['pk_columns']
+                self.schema_cache.tables[table_name.lower()] = (table_schema, pk_columns)
+                if table_checkpoint['rowhash_file_name']:
+                    self.rowhash_indexes.append(table_checkpoint['rowhash_file_name'])
+                self.job_row_count += table_checkpoint['row_count']
+                self.job_data_size += table_checkpoint['data_size']
+                continue
+
+            # skip tables whose probe found no changes; table's history advances to current timestamp/rowversion
+            # Note: Only the probed watermark advances; last_sequence is left as is.
+            if table_name.lower() in unchanged_tables:
+                logger.info(f'Table({table_name}): unchanged (probe); skipped')
+                self.package.write_text(f'{table_name}.unchanged', 'probe')
+                history_updates = dict(last_timestamp=current_timestamp)
+                if table_object.cdc.lower() == 'rowversion':
+                    history_updates['last_rowversion'] = current_rowversion
+                table_updates.append((table_history, history_updates))
+                continue
+
+            # get current_sequence from source database
+            if table_object.cdc == 'sequence':
+                current_sequence = db_engine.current_sequence(table_name)
+            else:
+                current_sequence = 0
+
+            table_args = (schema_name, table_name, table_object, table_history, current_timestamp, current_sequence,
+                          current_rowversion)
+            tasks.append((table_args, table_history))
+
+        if self.project.max_parallel_tables:
+            max_parallel_tables = min(int(self.project.max_parallel_tables), len(tasks))
+        else:
+            max_parallel_tables = 1
+        self.open_replica_pools(tasks, max(1, max_parallel_tables))
+
+        if max_parallel_tables <= 1:
+            for table_args, table_history in tasks:
+                table_object = table_args[2]
+                if table_object.replica:
+                    history_updates = self.process_pinned_table(*table_args)
+                else:
+                    history_updates = self.process_table(db, db_engine, *table_args)
+                if history_updates:
+                    table_updates.append((table_history, history_updates))
+            return table_updates
+
+        # each worker has its own connection (and cursors) borrowed from a bounded connection pool
+        # pool stays open for source session's next job (closed by close_source())
+        logger.info(f'Extracting {len(tasks)} tables across {max_parallel_tables} parallel connections')
+        if self.table_pool and self.table_pool.size < max_parallel_tables:
+            self.table_pool.close()
+            self.table_pool = None
+        if not self.table_pool:
+            self.table_pool = database.ConnectionPool(self.database, max_parallel_tables, self.router)
+        pool = self.table_pool
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_tables) as executor:
+            futures = dict()
+            for table_args, table_history in tasks:
+                futures[executor.submit(self.process_pooled_table, pool, *table_args)] = table_history
+
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    history_updates = future.result()
+                    if history_updates:
+                        table_updates.append((futures[future], history_updates))
+            except Exception:
+                # a failed table fails the job; don't start tables that are still queued
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return table_updates
+
+    def probe_tables(self, db, db_engine, job_history, current_timestamp, current_rowversion):
+        """
+        Return set of lowercase names of tables whose probe found no rows to capture since their last capture.
+
+        Tables opt in with probe=1 (timestamp and rowversion cdc). Probes are cheap exists selects of a table's cdc
+        predicate; probes are combined into union all selects (probe_batch_size probes per select).
+        """
+        probes = dict()
+        for table_name, table_object in self.tables.items():
+            table_history = job_history.get_table_history(table_name)
+            table_checkpoint = self.checkpoint.table(table_name) if self.checkpoint else None
+            cdc = table_object.cdc.lower()
+
+            # only probe previously captured cdc tables; first captures and skipped tables are handled by process_table
+            if table_object.probe != '1' or table_object.ignore_table or table_object.drop_table or table_checkpoint:
+                continue
+            if table_name.lower() not in self.schema_cache.tables or not self.schema_catalog.table_schema(table_name):
+                continue
+            if cdc == 'timestamp' and table_object.timestamp and table_history.last_timestamp:
+                pass
+            elif cdc == 'rowversion' and table_object.rowversion and table_history.last_rowversion:
+                pass
+            else:
+                continue
+
+            # tables pre-configured for the future are skipped by process_table without advancing their history
+            if table_history.last_timestamp and table_history.last_timestamp > current_timestamp:
+                continue
+
+            probe_table = copy.copy(table_object)
+            probe_table.schema_name = self.database.schema
+            probe_table.table_name = table_name
+            select_cdc = cdc_select.SelectCDC(db_engine, probe_table)
+            if cdc == 'rowversion':
+                select_cdc.rowversion_logic(current_rowversion, table_history.last_rowversion)
+            prepared_sql = self.prepared_select(f'{table_name.lower()}.probe', select_cdc, is_probe=True)
+            last_timestamp, last_rowversion = table_history.last_timestamp, table_history.last_rowversion
+            probe_args = (current_timestamp, last_timestamp, current_rowversion, last_rowversion)
+            probes[table_name] = select_cdc.bind(prepared_sql, self.job_id, *probe_args)
+
+        if not probes:
+            return set()
+
+        self.events.start('probe', 'step')
+        changed_tables = set()
+        cursor = db.conn.cursor()
+        table_names = list(probes)
+        for start in range(0, len(table_names), probe_batch_size):
+            batch_table_names = table_names[start:start + probe_batch_size]
+            sql = cdc_select.union_all([probes[table_name] for table_name in batch_table_names])
+            cursor.execute(sql)
+            changed_tables.update([row[0].lower() for row in cursor.fetchall()])
+        unchanged_tables = set([table_name.lower() for table_name in table_names]) - changed_tables
+        self.events.stop('probe', len(unchanged_tables))
+
+        logger.info(f'Probed {len(table_names)} tables: {len(unchanged_tables)} unchanged')
+        return unchanged_tables
+
+    def open_package(self):
+        """Create publish_folder's <dataset_name>#<job_id>.zip capture package that table entries stream into."""
         self.capture_file_name = f'{self.dataset_name}#{self.job_id:09}'
-        self.zip_file_name = f'{self.publish_folder}/{self.capture_file_name}'
+        self.zip_file_name = f'{self.publish_folder}/{self.capture_file_name}.zip'
+        resume_package = self.checkpoint.resume_package() if self.checkpoint else None
+        self.package = CapturePackage(self.zip_file_name, self.events, resume_package, self.project.package_codec)
+
+    def close_package(self):
+        """Add job logs to capture package and finish package's zip file."""
 
-        # copy capture_state files to work folder to be included in capture zip package as well
-        copy_file_if_exists(f'{self.state_folder}/last_job.log', self.work_folder)
+        # Note: Step remains named compress; archive posts compress step metrics to stat_log.
+        self.events.start('compress', 'step')
 
-        # compress (make_archive() appends a .zip file extension to zip_file_name)
-        self.zip_file_name = shutil.make_archive(self.zip_file_name, format='zip', root_dir=self.work_folder)
+        # include job and capture_state files in capture zip package as well
+        self.package.write_file(f'{self.work_folder}/job.log')
+        if is_file(f'{self.state_folder}/last_job.log'):
+            self.package.write_file(f'{self.state_folder}/last_job.log')
 
         # finish
-        self.events.stop('compress', 0, file_size(self.zip_file_name))
+        self.events.stop('compress', 0, self.package.close())
 
     def upload_to_blobstore(self):
         """Upload publish_folder's <dataset_name>-<job_id>.zip to landing blobstore."""
@@ -390,32 +1288,242 @@ class CaptureDaemon(Daemon):
         # Future: Save recovery file in capture.zip file and have archive extract and push back to dataset folder.
         # This way capture_state.zip is only updated AFTER its container file has been successfully archived.
 
-        # create recovery state archive file as dataset_<nnnn>.zip
-        # Note: Since this is always the latest state, it does not require a job id in file name.
-        recovery_file_name = f'{self.publish_folder}/{self.dataset_name}'
-        recovery_file_name = shutil.make_archive(recovery_file_name, format='zip', root_dir=self.state_folder)
-        recovery_blob_name = f'capture/{self.dataset_name}.zip'
+        # recovery state is uploaded as a full snapshot (capture/<dataset>.zip) every recovery_snapshot_jobs jobs
+        # and as a delta of state files changed since the last upload (capture/<dataset>#<job_id>.zip) in between
+        # Note: Restore a snapshot and then its deltas (job ids > manifest's snapshot_job_id) in job id order.
+        manifest_file_name = f'{self.state_folder}/recovery.manifest'
+        if is_file(manifest_file_name):
+            manifest = load_jsonpickle(manifest_file_name)
+        else:
+            manifest = dict(snapshot_job_id=0, files=dict())
+
+        # state file sizes and modification times identify changed files
+        state_files = dict()
+        for path in sorted(pathlib.Path(self.state_folder).rglob('*')):
+            if path.is_file() and path.name != just_file_name(manifest_file_name):
+                file_name = path.relative_to(self.state_folder).as_posix()
+                state_files[file_name] = [path.stat().st_size, path.stat().st_mtime_ns]
+
+        snapshot_jobs = int(self.project.recovery_snapshot_jobs) if self.project.recovery_snapshot_jobs else 24
+        is_snapshot = not manifest['snapshot_job_id'] or self.job_id - manifest['snapshot_job_id'] >= snapshot_jobs
+        if is_snapshot:
+            manifest['snapshot_job_id'] = self.job_id
+            file_names = list(state_files)
+            deleted_file_names = []
+            recovery_blob_name = f'capture/{self.dataset_name}.zip'
+        else:
+            last_files = manifest['files']
+            file_names = [name for name in state_files if last_files.get(name) != state_files[name]]
+            deleted_file_names = [file_name for file_name in manifest['files'] if file_name not in state_files]
+            recovery_blob_name = f'capture/{self.dataset_name}#{self.job_id:09}.zip'
+        manifest['files'] = state_files
+        manifest['job_id'] = self.job_id
+        manifest['deleted_files'] = deleted_file_names
+
+        # create recovery state archive file; state files are compressed in parallel
+        recovery_file_name = f'{self.publish_folder}/{just_file_name(recovery_blob_name)}'
+        with ZipWriter(recovery_file_name) as recovery_file:
+            recovery_file.write_files([f'{self.state_folder}/{file_name}' for file_name in file_names], file_names)
+            recovery_file.write_text(just_file_name(manifest_file_name), to_jsonpickle(manifest))
+        logger.info(f'Recovery state: {recovery_blob_name} ({len(file_names)} of {len(state_files)} state files)')
 
         # upload capture recovery state file to recovery blobstore
         resource = self.config(self.project.blobstore_recovery)
         bs_recovery = BlobStore()
         bs_recovery.connect(resource)
         bs_recovery.put(recovery_file_name, recovery_blob_name)
+
+        # a new snapshot replaces the previous snapshot's deltas
+        if is_snapshot:
+            for blob_name in self.recovery_delta_blob_names(bs_recovery):
+                bs_recovery.delete(blob_name)
         bs_recovery.disconnect()
 
+        # track state files uploaded
+        save_jsonpickle(manifest_file_name, manifest)
+
+    def recovery_delta_blob_names(self, bs_recovery):
+        """Return dataset's recovery state delta blob names in job id order."""
+        delta_prefix = f'capture/{self.dataset_name}#'
+        blob_names = bs_recovery.list(f'{delta_prefix}*.zip')
+        return sorted([blob_name for blob_name in blob_names if blob_name.startswith(delta_prefix)])
+
+    def restore_recovery_state(self):
+        """
+        Restore state folder from recovery blobstore when its job history is missing, eg. capture moved to a new
+        host: extracts dataset's last snapshot, then its deltas (job ids > snapshot's job id) in job id order.
+        """
+        if self.option('notransfer') or not self.project.blobstore_recovery:
+            return
+        if is_file(f'{self.state_folder}/capture.db') or is_file(f'{self.state_folder}/capture.job'):
+            return
+
+        resource = self.config(self.project.blobstore_recovery)
+        bs_recovery = BlobStore()
+        bs_recovery.connect(resource)
+        try:
+            snapshot_blob_name = f'capture/{self.dataset_name}.zip'
+            if not bs_recovery.list(snapshot_blob_name):
+                logger.info(f'Recovery state: no snapshot to restore ({snapshot_blob_name})')
+                return
+
+            create_folder(self.state_folder)
+            create_folder(self.work_folder)
+            manifest = self.restore_recovery_file(bs_recovery, snapshot_blob_name)
+            snapshot_job_id = manifest['snapshot_job_id']
+            delta_count = 0
+            for blob_name in self.recovery_delta_blob_names(bs_recovery):
+                if int(just_file_stem(blob_name).rpartition('#')[2]) > snapshot_job_id:
+                    manifest = self.restore_recovery_file(bs_recovery, blob_name)
+                    delta_count += 1
+        finally:
+            bs_recovery.disconnect()
+
+        logger.info(f'Recovery state: restored job {manifest["job_id"]} (snapshot + {delta_count} deltas)')
+
+    def restore_recovery_file(self, bs_recovery, blob_name):
+        """Extract a recovery state snapshot or delta into state folder. Returns its manifest."""
+        recovery_file_name = f'{self.work_folder}/{just_file_name(blob_name)}'
+        bs_recovery.get(recovery_file_name, blob_name)
+        with zipfile.ZipFile(recovery_file_name) as recovery_file:
+            recovery_file.extractall(self.state_folder)
+        delete_file(recovery_file_name)
+
+        manifest = load_jsonpickle(f'{self.state_folder}/recovery.manifest')
+        for file_name in manifest['deleted_files']:
+            delete_file(f'{self.state_folder}/{file_name}', ignore_errors=True)
+        return manifest
+
     def main(self):
-        db = None
+        try:
+            # continuous capture runs micro-batch capture cycles vs a single job per scheduled run
+            if self.project.continuous_interval:
+                self.capture_cycles()
+            else:
+                self.capture_job()
+        finally:
+            # explicitly close source session's database connections when finished
+            self.close_source()
+
+    def is_stop_requested(self):
+        """Return True if continuous capture was signaled to stop or a capture.stop file exists (consumed)."""
+        stop_file_name = f'{self.session_folder}/{self.namespace.dataset}/capture.stop'
+        if is_file(stop_file_name):
+            logger.info(f'Stop file found: {stop_file_name}')
+            delete_file(stop_file_name)
+            self.stop_event.set()
+        return self.stop_event.is_set() or self.schedule.is_stopped()
+
+    def on_stop_signal(self, signal_number, frame):
+        logger.info(f'Signal {signal.Signals(signal_number).name}: stopping after current capture cycle')
+        self.stop_event.set()
+
+    def capture_cycles(self):
+        """
+        Continuous capture: run a capture job every continuous_interval seconds, each emitting a small package of the
+        changes since the previous cycle. Cycles share a warm source session (connections, config, job history,
+        schemas and prepared selects); only each select's job id, timestamp and rowversion values change per cycle.
+
+        Cycles run until continuous_cycles cycles have run or a stop is requested between cycles: SIGINT/SIGTERM,
+        a <session>/<dataset>/capture.stop file (deleted when found) or a stopped schedule. A failed cycle ends the run.
+        """
+        interval = float(self.project.continuous_interval)
+        max_cycles = int(self.project.continuous_cycles) if self.project.continuous_cycles else 0
+        logger.info(f'Continuous capture: {interval:g}s interval, {max_cycles or "unlimited"} cycles')
+
+        self.stop_event.clear()
+        stop_signals = (signal.SIGINT, signal.SIGTERM)
+        previous_handlers = [signal.signal(signal_number, self.on_stop_signal) for signal_number in stop_signals]
+        try:
+            for cycle in itertools.count(1):
+                start_time = time.monotonic()
+                self.capture_job()
+                if cycle == max_cycles or self.is_stop_requested():
+                    break
+
+                # a cycle that overruns its interval starts the next cycle immediately; a stop signal ends the wait
+                if self.stop_event.wait(max(0.0, interval - (time.monotonic() - start_time))):
+                    break
+        finally:
+            for signal_number, previous_handler in zip(stop_signals, previous_handlers):
+                signal.signal(signal_number, previous_handler)
+
+    def open_source(self):
+        """Open source session: source config, (replica routed) connection, table config and load governor."""
+
+        # connect to source database (or one of its replicas)
+        # Note: Job's current timestamp/rowversion come from this connection's replica; timestamp step back
+        # must cover replication lag of database_source's other replicas.
+        self.database = self.config(self.project.database_source)
+        self.router = database.ReplicaRouter(self.database, self.events)
+        self.source = self.router.connect()
+
+        # build dict of table objects indexed by table name
+        self.tables = dict()
+        for section_name, section_object in self.config.sections.items():
+            if section_name.startswith('table:'):
+                table_name = section_name.partition(':')[2]
+                self.tables[table_name] = section_object
+
+        # limit job's load on source database
+        self.governor = governor.load_governor(self.database)
+        logger.info(f'Source load governor: {self.governor}')
+
+        # selects are prepared once per source session
+        self.select_cache = dict()
+
+    def close_source(self):
+        """Close source session's connections and job history."""
+        if self.table_pool:
+            self.table_pool.close()
+        for pool in self.replica_pools.values():
+            pool.close()
+        if self.source:
+            db, db_engine = self.source
+            self.router.disconnect(db)
+        if self.job_history:
+            self.job_history.close()
+
+        self.source = None
+        self.table_pool = None
+        self.replica_pools = dict()
+        self.job_history = None
+        self.schema_cache = None
+        self.select_cache = dict()
+
+    def end_source_transactions(self):
+        """
+        End source session's open (autocommit off) read transactions so a warm session between continuous capture
+        cycles holds no read locks or version store rows (mssql) and sees a fresh now() (postgresql) next cycle.
+        """
+        if self.source:
+            db, db_engine = self.source
+            db.conn.rollback()
+        if self.table_pool:
+            self.table_pool.rollback()
+        for pool in self.replica_pools.values():
+            pool.rollback()
+
+    def capture_job(self):
         try:
             # track dataset name for naming generated files and folders
             self.dataset_name = self.namespace.dataset
 
-            # get job id and table history
-            job_history_file_name = f'{self.state_folder}/capture.job'
-            job_history = JobHistory(job_history_file_name)
-            job_history.load()
+            # get job id and table history; continuous capture cycles keep job history loaded between cycles
+            # a missing job history (eg. new capture host) is restored from recovery state first
+            if not self.job_history:
+                self.restore_recovery_state()
+                self.job_history = JobHistory(f'{self.state_folder}/capture.db')
+                self.job_history.load()
+            job_history = self.job_history
             job_id = job_history.job_id
             self.job_id = job_id
             logger.info(f'\nCapture job {job_id} for {self.dataset_name} ...')
+
+            # get cached schema catalog and last captured table schemas
+            if not self.schema_cache:
+                self.schema_cache = SchemaCache(f'{self.state_folder}/capture.schema')
+                self.schema_cache.load()
             self.progress_message(f'starting job {job_id} ...')
 
             # track job (and table) metrics
@@ -426,57 +1534,67 @@ class CaptureDaemon(Daemon):
             # track overall job row count and file size
             self.job_row_count = 0
             self.job_data_size = 0
+            self.rowhash_indexes = []
+
+            # optionally checkpoint job's progress; a job interrupted by a failure resumes from its checkpoint
+            self.checkpoint = None
+            is_resumed = False
+            if self.project.checkpoint == '1':
+                self.checkpoint = CaptureCheckpoint(f'{self.state_folder}/capture.checkpoint')
+                self.checkpoint.load()
+                package_file_name = f'{self.publish_folder}/{self.dataset_name}#{job_id:09}.zip'
+                is_resumed = self.checkpoint.is_resumable(job_id, package_file_name)
+                if is_resumed:
+                    logger.info(f'Resuming interrupted capture job {job_id} from checkpoint')
+                else:
+                    self.checkpoint.start(job_id)
 
-            # create/clear job folders
+            # create/clear job folders; resumed jobs keep their partially written capture package
             create_folder(self.state_folder)
             clear_folder(self.work_folder)
-            clear_folder(self.publish_folder)
-
-            # connect to source database
-            self.database = self.config(self.project.database_source)
-            if self.database.platform == 'postgresql':
-                db = database.PostgreSQL(self.database)
-                db_engine = database.Database('postgresql', db.conn)
-            elif self.database.platform == 'mssql':
-                db = database.MSSQL(self.database)
-                db_engine = database.Database('mssql', db.conn)
+            if not is_resumed:
+                clear_folder(self.publish_folder)
+
+            # capture entries are streamed into the capture package as they are produced
+            self.open_package()
+
+            # open source session; continuous capture cycles reuse the previous cycle's source session
+            if self.source:
+                self.router.events = self.events
             else:
-                raise NotImplementedError(f'Unknown database platform ({self.database.platform})')
+                self.open_source()
+            db, db_engine = self.source
 
             # determine current timestamp for this job's run
 
             # get current_timestamp() from source database with step back and fast forward logic
-            current_timestamp = self.current_timestamp(db_engine)
+            # resumed jobs reuse their original job's current timestamp
+            if is_resumed and self.checkpoint.current_timestamp:
+                current_timestamp = self.checkpoint.current_timestamp
+                logger.info(f'Current timestamp: {current_timestamp} (resumed)')
+            else:
+                current_timestamp = self.current_timestamp(db_engine)
+            if self.checkpoint:
+                self.checkpoint.current_timestamp = current_timestamp
 
             # process all tables
             self.events.start('extract', 'step')
 
-            # build dict of table objects indexed by table name
-            self.tables = dict()
-            for section_name, section_object in self.config.sections.items():
-                if section_name.startswith('table:'):
-                    table_name = section_name.partition(':')[2]
-                    self.tables[table_name] = section_object
-
             # extract data from each table
-            for table_name, table_object in self.tables.items():
-                table_history = job_history.get_table_history(table_name)
-
-                # get current_sequence from source database
-                if table_object.cdc == 'sequence':
-                    current_sequence = db_engine.current_sequence(table_name)
-                else:
-                    current_sequence = 0
+            throttle_start = self.governor.throttle_time + self.governor.query_wait_time
+            table_updates = self.extract_tables(db, db_engine, job_history, current_timestamp)
 
-                self.process_table(db, db_engine, self.database.schema, table_name, table_object, table_history, current_timestamp, current_sequence)
+            # report time spent waiting on source load governor's limits
+            throttle_time = self.governor.throttle_time + self.governor.query_wait_time - throttle_start
+            self.events.add('governor', 'throttle', throttle_time)
             self.events.stop('extract', self.job_row_count, self.job_data_size)
 
-            # save interim job metrics to work_folder before compressing this folder
+            # save interim job metrics to work_folder before adding them to capture package
             self.events.stop('capture', self.job_row_count, self.job_data_size)
             self.events.save()
 
-            # compress work_folder files to publish_folder zip file
-            self.compress_work_folder()
+            # finish publish_folder zip file
+            self.close_package()
 
             # upload publish_folder zip file
             self.upload_to_blobstore()
@@ -486,10 +1604,22 @@ class CaptureDaemon(Daemon):
             self.events.save(f'{self.state_folder}/last_job.log')
             self.events.save()
 
+            # all tables captured; update table histories with new last timestamp, sequence, etc values
+            for table_history, history_updates in table_updates:
+                for attribute_name, value in history_updates.items():
+                    setattr(table_history, attribute_name, value)
+
             # update job_id and table histories
             if not self.option('notransfer'):
-                # only save job history if we're transferring data to landing
+                # only save job history (and schema cache) if we're transferring data to landing
                 job_history.save()
+                self.schema_cache.save()
+                for rowhash_file_name in self.rowhash_indexes:
+                    rowhash.commit_index(rowhash_file_name)
+
+            # job succeeded; next job starts fresh
+            if self.checkpoint:
+                self.checkpoint.clear()
 
             # compress capture_state and save to capture blobstore for recovery
             self.save_recovery_state_file()
@@ -505,9 +1635,13 @@ class CaptureDaemon(Daemon):
             raise
 
         finally:
-            # explicitly close database connection when finished with job
+            # close capture package if job failed before package was finished
+            with contextlib.suppress(Exception):
+                self.package.close()
+
+            # end job's source transactions before the (warm) source session idles between cycles
             with contextlib.suppress(Exception):
-                db.conn.close()
+                self.end_source_transactions()
 
 
 # main
@@ -112,9 +112,18 @@ class MergeCDC:
 	_      ({source_column_names});
 	'''
 
+	delete_template = '''
+	__ -- s:source (deleted keys), t:target
+	__ delete t
+	_  from {schema_name}.{table_name} as t
+	_  join {schema_name}._{table_name}_deletes as s
+	_    on {match_condition};
+	'''
+
 	def __init__(self, table, extended_definitions=None):
 		# indent template text
 		self.merge_template = indent(self.merge_template)
+		self.delete_template = indent(self.delete_template)
 
 		# object scope properties
 		self.table = table
@@ -169,6 +178,15 @@ class MergeCDC:
 		sql = expand(self.merge_template)
 		return delete_blank_lines(sql.strip())
 
+	# noinspection PyUnusedLocal
+	def delete(self, schema_name, nk):
+		"""Delete target rows matching the keys in _<table_name>_deletes."""
+		table_name = self.table.table_name
+		match_condition = self.match_condition(nk)
+
+		sql = expand(self.delete_template)
+		return delete_blank_lines(sql.strip())
+
 
 # test code
 def main():
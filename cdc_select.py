@@ -12,14 +12,20 @@ table_object.table_name = table_name
 table_object.column_names = '*'
 select_cdc = SelectCDC(table_object)
 sql = select_cdc.select(job_id, current_timestamp, last_timestamp)
+
+Selects run repeatedly (eg. continuous capture) can be prepared once and rebound each run:
+sql = select_cdc.bind(select_cdc.prepare(), job_id, current_timestamp, last_timestamp)
 """
 
 # standard lib
+import datetime
+import decimal
 import logging
 
 # common lib
 from common import delete_blank_lines
 from common import expand
+from common import expand_template
 from common import log_session_info
 from common import log_setup
 from common import spaces
@@ -55,6 +61,67 @@ def add_aliases(column_names, table_alias="s"):
     return [add_alias(column_name, table_alias) for column_name in column_names]
 
 
+def literal(value, platform=None, data_type=None):
+    """
+    Format a Python value (eg. partition boundary or keyset key) as a SQL literal for platform (mssql, postgresql).
+    Datetimes keep their full (microsecond) precision; binary values are formatted as platform's binary literals.
+    Optional data_type is the type of the column value was read from.
+    """
+    if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+        return str(value)
+    elif isinstance(value, datetime.datetime):
+        text = value.isoformat(sep=" ")
+        if platform == "mssql":
+            # datetime2/datetimeoffset literals keep microseconds; literals are cast to their column's type (eg.
+            # datetime's 1/300 second ticks) so they compare equal to the column value they were read from
+            literal_type = "datetimeoffset(7)" if value.tzinfo else "datetime2(7)"
+            text = f"cast('{text}' as {literal_type})"
+            if data_type and data_type.lower() not in ("datetime2", "datetimeoffset"):
+                text = f"cast({text} as {data_type})"
+            return text
+        return f"'{text}'"
+    elif isinstance(value, (bytes, bytearray)):
+        if platform == "postgresql":
+            return f"'\\x{value.hex()}'::bytea"
+        return f"0x{value.hex().upper()}"
+    else:
+        text = str(value).replace("'", "''")
+        if platform == "mssql":
+            return f"N'{text}'"
+        return f"'{text}'"
+
+
+def rowversion_literal(value):
+    """Format a rowversion (int or 8 byte binary value) as a binary(8) SQL literal."""
+    if isinstance(value, (bytes, bytearray)):
+        value = int.from_bytes(value, "big")
+    return f"0x{int(value or 0):016X}"
+
+
+def union_all(selects):
+    """Combine selects (without terminating semi-colons) into a single union all select."""
+    return "\nunion all\n".join(selects) + ";"
+
+
+def split_range(min_value, max_value, partition_count):
+    """Return partition_count - 1 evenly spaced boundaries between min_value and max_value."""
+    if min_value is None or max_value is None:
+        return []
+
+    boundaries = []
+    for partition in range(1, partition_count):
+        if isinstance(min_value, int):
+            boundary = min_value + (max_value - min_value) * partition // partition_count
+        elif isinstance(min_value, (float, decimal.Decimal, datetime.datetime, datetime.date)):
+            boundary = min_value + (max_value - min_value) * partition / partition_count
+        else:
+            raise NotImplementedError(
+                f"Range partitions not supported for {type(min_value).__name__} values; use partition_method=ntile"
+            )
+        boundaries.append(boundary)
+    return boundaries
+
+
 ###
 
 
@@ -258,6 +325,14 @@ class SelectCDC:
         )
     """
 
+    # rowversion values are compared as binary(8) literals, eg. 0x00000000000007D1
+    rowversion_where_template = """
+        (
+            {rowversion_value} >= {last_rowversion} and
+            {rowversion_value} < {current_rowversion}
+        )
+    """
+
     sequence_where_template = """
         (
             {sequence_value} >= '{last_sequence}' and
@@ -265,16 +340,54 @@ class SelectCDC:
         )
     """
 
+    # probes select a table's name if table has rows to capture; exists stops at table's first matching row
+    probe_template = """
+      select {table_literal} as "table_name"
+        where exists (
+        _ select 1
+        _ from "{schema_name}"."{table_name}" as "s"
+        _ {join_clause}
+        _ {where_clause}
+        )
+    """
+
+    # partition boundaries are the max value of each of n equal sized (ntile) buckets
+    partition_ntile_template = """
+      select max("v") as "boundary"
+        from (
+        _ select {partition_value} as "v", ntile({partition_count}) over (order by {partition_value}) as "p"
+        _ from "{schema_name}"."{table_name}" as "s"
+        ) as "t"
+        group by "p"
+        order by "p"
+    """
+
+    # partition boundaries are evenly spaced values between a column's min and max values
+    partition_range_template = """
+      select min({partition_value}) as "min_value", max({partition_value}) as "max_value"
+        from "{schema_name}"."{table_name}" as "s"
+    """
+
     def __init__(self, db_engine, table):
         # indent template text
         self.select_template = indent(self.select_template)
         self.timestamp_where_template = indent(self.timestamp_where_template)
+        self.rowversion_where_template = indent(self.rowversion_where_template)
+        self.probe_template = indent(self.probe_template)
+        self.partition_ntile_template = indent(self.partition_ntile_template)
+        self.partition_range_template = indent(self.partition_range_template)
 
         # object scope properties
         self.db_engine = db_engine
         self.table = table
         self.timestamp_value = ""
         self.timestamp_where_condition = ""
+        self.rowversion_where_condition = ""
+        self.keyset_where_condition = ""
+        self.partition_where_condition = ""
+
+        # prepared selects have {%parameter%} markers in place of their job id, timestamp and rowversion values
+        self.is_prepared = False
 
     def column_names(self):
         if self.table.column_names == "*":
@@ -300,7 +413,10 @@ class SelectCDC:
             # 	self.timestamp_where_condition = ''
 
             # May/Jun enhancement
-            self.timestamp_value = self.db_engine.timestamp_literal(current_timestamp)
+            if self.is_prepared:
+                self.timestamp_value = "{%timestamp_literal%}"
+            else:
+                self.timestamp_value = self.db_engine.timestamp_literal(current_timestamp)
             self.timestamp_where_condition = ""
 
         else:
@@ -319,6 +435,43 @@ class SelectCDC:
             self.timestamp_value = timestamp_value
             self.timestamp_where_condition = expand(self.timestamp_where_template)
 
+    # noinspection PyUnusedLocal
+    # Note: rowversion_value referenced in expanded where f-string.
+    def rowversion_logic(self, current_rowversion, last_rowversion):
+        """Limit select to rows whose rowversion is >= last_rowversion and < current_rowversion (int values)."""
+        if not self.table.rowversion:
+            self.rowversion_where_condition = ""
+        else:
+            rowversion_value = add_alias(self.table.rowversion, "s")
+            if self.is_prepared:
+                last_rowversion = "{%last_rowversion%}"
+                current_rowversion = "{%current_rowversion%}"
+            else:
+                last_rowversion = rowversion_literal(last_rowversion)
+                current_rowversion = rowversion_literal(current_rowversion)
+            self.rowversion_where_condition = expand(self.rowversion_where_template)
+
+    def keyset_logic(self, key_columns, last_key, key_data_types=None):
+        """
+        Limit select to rows whose key (key_columns) sorts after last_key; used to resume a checkpointed select.
+        Optional key_data_types are key columns' (source) data types.
+        """
+        key_values = add_aliases(split(key_columns), "s")
+        key_data_types = key_data_types or [None] * len(last_key)
+        platform = self.db_engine.platform
+        key_literals = [
+            literal(value, platform, data_type)
+            for value, data_type in zip(last_key, key_data_types)
+        ]
+
+        # (k1, k2, ...) > (v1, v2, ...) expanded as (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+        conditions = []
+        for index, (key_value, key_literal) in enumerate(zip(key_values, key_literals)):
+            key_conditions = [f"{k} = {v}" for k, v in zip(key_values[:index], key_literals)]
+            key_conditions.append(f"{key_value} > {key_literal}")
+            conditions.append("(" + " and ".join(key_conditions) + ")")
+        self.keyset_where_condition = "(" + " or ".join(conditions) + ")"
+
     def join_clause(self):
         schema_name = self.table.schema_name
         join_clause = self.table.join.strip("\\")
@@ -327,16 +480,57 @@ class SelectCDC:
         return join_clause
 
     def where_clause(self):
-        if not self.table.where and not self.timestamp_where_condition:
+        conditions = []
+        if self.table.where:
+            conditions.append(f"({self.table.where})")
+        if self.timestamp_where_condition:
+            conditions.append(self.timestamp_where_condition)
+        if self.rowversion_where_condition:
+            conditions.append(self.rowversion_where_condition)
+        if self.keyset_where_condition:
+            conditions.append(self.keyset_where_condition)
+        if self.partition_where_condition:
+            conditions.append(self.partition_where_condition)
+
+        if not conditions:
             where_clause = ""
-        elif self.table.where and not self.timestamp_where_condition:
-            where_clause = f"where\n{spaces(4)}({self.table.where})"
-        elif not self.table.where and self.timestamp_where_condition:
-            where_clause = f"where\n{spaces(4)}{self.timestamp_where_condition}"
         else:
-            where_clause = f"where\n{spaces(4)}({self.table.where}) and\n{spaces(4)}{self.timestamp_where_condition}"
+            where_clause = f"where\n{spaces(4)}" + f" and\n{spaces(4)}".join(conditions)
         return where_clause
 
+    def partition_value(self):
+        return add_alias(self.table.partition_column, "s")
+
+    # noinspection PyUnusedLocal
+    # Note: partition_count referenced in expanded template f-string.
+    def partition_boundaries(self, partition_count):
+        """Return SQL that selects partition boundaries based on table's partition_method (ntile or range)."""
+        schema_name = self.table.schema_name
+        table_name = self.table.table_name
+        partition_value = self.partition_value()
+        if self.table.partition_method.lower() in ("", "ntile"):
+            sql = expand(self.partition_ntile_template)
+        elif self.table.partition_method.lower() == "range":
+            sql = expand(self.partition_range_template)
+        else:
+            raise NotImplementedError(f"Unknown partition_method ({self.table.partition_method})")
+        return delete_blank_lines(sql.strip() + ";")
+
+    def partition_conditions(self, boundaries):
+        """Return list of where conditions that split table into len(boundaries) + 1 key ranges."""
+        partition_value = self.partition_value()
+        platform = self.db_engine.platform
+        boundaries = [literal(boundary, platform) for boundary in boundaries]
+        if not boundaries:
+            return [""]
+
+        # first partition also captures null partition values
+        conditions = [f"({partition_value} <= {boundaries[0]} or {partition_value} is null)"]
+        for lower, upper in zip(boundaries, boundaries[1:]):
+            conditions.append(f"({partition_value} > {lower} and {partition_value} <= {upper})")
+        conditions.append(f"({partition_value} > {boundaries[-1]})")
+        return conditions
+
     def order_clause(self):
         # order by option
         order_clause = ""
@@ -346,8 +540,22 @@ class SelectCDC:
         return order_clause
 
     # noinspection PyUnusedLocal
-    def select(self, job_id, current_timestamp, last_timestamp):
+    def probe(self, current_timestamp, last_timestamp):
+        """Return SQL (without terminating semi-colon) that selects table's name if table has rows to capture."""
+        self.timestamp_logic(current_timestamp, last_timestamp)
+
+        schema_name = self.table.schema_name
+        table_name = self.table.table_name
+        table_literal = literal(table_name)
+        join_clause = self.join_clause()
+        where_clause = self.where_clause()
+        sql = expand(self.probe_template)
+        return delete_blank_lines(sql.strip())
+
+    # noinspection PyUnusedLocal
+    def select(self, job_id, current_timestamp, last_timestamp, partition_condition=""):
         self.timestamp_logic(current_timestamp, last_timestamp)
+        self.partition_where_condition = partition_condition
 
         schema_name = self.table.schema_name
         table_name = self.table.table_name
@@ -359,6 +567,44 @@ class SelectCDC:
         sql = expand(self.select_template)
         return delete_blank_lines(sql.strip() + ";")
 
+    def prepare(self, is_probe=False):
+        """
+        Return select (or probe when is_probe) SQL with {%parameter%} markers in place of its job id, timestamp and
+        rowversion values. Call after any rowversion_logic(); bind() a prepared select vs regenerating its SQL.
+        """
+        self.is_prepared = True
+        if self.rowversion_where_condition:
+            self.rowversion_logic(None, None)
+
+        markers = ("{%current_timestamp%}", "{%last_timestamp%}")
+        if is_probe:
+            return self.probe(*markers)
+        else:
+            return self.select("{%job_id%}", *markers)
+
+    def bind(
+        self,
+        sql,
+        job_id,
+        current_timestamp,
+        last_timestamp,
+        current_rowversion=0,
+        last_rowversion=0,
+    ):
+        """Return prepared select (or probe) SQL with its {%parameter%} markers replaced by parameter values."""
+        parameters = dict(
+            job_id=job_id,
+            current_timestamp=current_timestamp,
+            last_timestamp=last_timestamp,
+            current_rowversion=rowversion_literal(current_rowversion),
+            last_rowversion=rowversion_literal(last_rowversion),
+        )
+        if "{%timestamp_literal%}" in sql:
+            parameters["timestamp_literal"] = self.db_engine.timestamp_literal(
+                current_timestamp
+            )
+        return expand_template(sql, parameters)
+
 
 # temporary test harness ...
 
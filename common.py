@@ -35,6 +35,8 @@ Venv (virtualenv)
 
 
 # standard lib
+import bz2
+import concurrent.futures
 import datetime
 import decimal
 import fnmatch
@@ -44,6 +46,7 @@ import hashlib
 import html
 import json
 import logging
+import lzma
 import os
 import pathlib
 import pkg_resources
@@ -51,10 +54,13 @@ import platform
 import re
 import shutil
 import socket
+import struct
 import sys
+import threading
 import types
 import urllib.parse
 import zipfile
+import zlib
 
 
 # 3rd party lib
@@ -1484,22 +1490,474 @@ class FileList:
         return str(self.file_names())
 
 
+# zip format limits; entries, offsets and entry counts past these limits use Zip64 extensions
+zip64_limit = (1 << 32) - 1
+zip64_count_limit = (1 << 16) - 1
+
+
+class LZMAZipCompressor:
+    """Zip's LZMA entry format: LZMA SDK version and properties header followed by a raw LZMA1 stream."""
+
+    def __init__(self):
+        lc, lp, pb, dict_size = 3, 0, 2, 1 << 23
+        lzma_filter = dict(
+            id=lzma.FILTER_LZMA1, dict_size=dict_size, lc=lc, lp=lp, pb=pb
+        )
+        self.compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[lzma_filter])
+        self.header = struct.pack("<BBHBL", 9, 4, 5, (pb * 5 + lp) * 9 + lc, dict_size)
+
+    def compress(self, data):
+        header, self.header = self.header, b""
+        return header + self.compressor.compress(data)
+
+    def flush(self):
+        header, self.header = self.header, b""
+        return header + self.compressor.flush()
+
+
+def zip_compressor(compress_type, compresslevel=None):
+    """Return a compressor (compress()/flush()) of zip entry data; None for stored entries."""
+    if compress_type == zipfile.ZIP_STORED:
+        return None
+    elif compress_type == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    elif compress_type == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Compressor(compresslevel or 9)
+    elif compress_type == zipfile.ZIP_LZMA:
+        return LZMAZipCompressor()
+    else:
+        raise NotImplementedError(f"Unsupported zip compression type: {compress_type}")
+
+
+def zip_directory_offset(input_stream):
+    """Return the offset of a zip file's central directory (read from its end of central directory records)."""
+    input_stream.seek(0, os.SEEK_END)
+    input_stream.seek(max(0, input_stream.tell() - (1 << 16) - 22))
+    tail = input_stream.read()
+    end_offset = tail.rfind(b"PK\x05\x06")
+    if end_offset < 0:
+        raise zipfile.BadZipFile("End of central directory record not found")
+
+    directory_offset = struct.unpack("<L", tail[end_offset + 16 : end_offset + 20])[0]
+    if directory_offset == 0xFFFFFFFF:
+        zip64_end_offset = struct.unpack("<4sLQL", tail[end_offset - 20 : end_offset])[
+            2
+        ]
+        input_stream.seek(zip64_end_offset)
+        directory_offset = struct.unpack("<4sQ2H2L4Q", input_stream.read(56))[9]
+    return directory_offset
+
+
+def strip_zip64_extra(extra):
+    """Return a zip entry's extra field without its Zip64 (0x0001) record; ZipWriter writes its own."""
+    output = b""
+    while len(extra) >= 4:
+        tag, size = struct.unpack("<HH", extra[:4])
+        if tag != 0x0001:
+            output += extra[: 4 + size]
+        extra = extra[4 + size :]
+    return output
+
+
+class ZipWriter:
+    """
+    Zip file writer that compresses entries in parallel.
+
+    Zip entries compress independently, so entries are compressed outside the writer's
+    lock (on the caller's thread or across the writer's thread pool via write_files())
+    and only appending compressed entries to the zip file is serialized. zlib, bz2 and
+    lzma release the GIL while compressing so a thread pool uses all available cores.
+
+    The writer writes zip records itself (local file headers as entries are appended,
+    then the central directory and end records on close) so precompressed entries can
+    be appended without zipfile's internals. Entries, offsets and entry counts past
+    zip's limits use Zip64 extensions. Zip files are read with zipfile.
+
+    Files larger than max_entry_size are streamed into the zip (vs compressed in memory)
+    one at a time.
+    """
+
+    def __init__(
+        self,
+        file_name,
+        mode="w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=None,
+        max_workers=None,
+        max_entry_size=256 * 1024 * 1024,
+    ):
+        """
+        File name may be a file name or seekable stream; streams are written from their
+        current position. Mode "a" appends entries to an existing zip file. Max_workers
+        defaults to CPUs.
+        """
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_entry_size = max_entry_size
+        self.lock = threading.Lock()
+
+        # entries (ZipInfo) in central directory order indexed by entry name
+        self.entries = dict()
+
+        self.is_stream = not isinstance(file_name, (str, pathlib.Path))
+        if self.is_stream:
+            self.output_stream = file_name
+        elif mode == "a" and os.path.isfile(file_name):
+            # new entries overwrite existing zip's central directory
+            with zipfile.ZipFile(file_name) as zip_file:
+                for entry in zip_file.infolist():
+                    self.add_entry(entry)
+            self.output_stream = open(file_name, "r+b")
+            self.output_stream.seek(zip_directory_offset(self.output_stream))
+        else:
+            self.output_stream = open(file_name, "wb")
+        self.offset = self.output_stream.tell()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_entry(self, entry):
+        """Add an entry already written to zip file (eg. a resumed zip's entries) to zip's central directory."""
+        entry.extra = strip_zip64_extra(entry.extra)
+        self.entries[entry.filename] = entry
+
+    def getinfo(self, entry_name):
+        """Return an entry's ZipInfo."""
+        return self.entries[entry_name]
+
+    def checkpoint(self):
+        """Return (offset, entries) of entries written so far; offset is where the next entry is written."""
+        with self.lock:
+            self.output_stream.flush()
+            return self.offset, list(self.entries.values())
+
+    def close(self):
+        """Write zip's central directory and end records and close zip file."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+
+            output_stream = self.output_stream
+            output_stream.seek(self.offset)
+            for entry in self.entries.values():
+                output_stream.write(self.central_directory_header(entry))
+            self.write_end_records(self.offset, output_stream.tell() - self.offset)
+            output_stream.truncate()
+            output_stream.flush()
+            if not self.is_stream:
+                output_stream.close()
+
+    def zip_entry(self, entry, compress_type=None):
+        """Return entry (an entry name or ZipInfo) as a ZipInfo set up to be written with compress_type."""
+        if not isinstance(entry, zipfile.ZipInfo):
+            date_time = datetime.datetime.now().timetuple()[:6]
+            entry = zipfile.ZipInfo(entry, date_time=date_time)
+        if not entry.external_attr:
+            entry.external_attr = 0o600 << 16
+        if compress_type is None:
+            compress_type = self.compression
+        entry.compress_type = compress_type
+
+        # Note: Bit 11 flags UTF8 entry names; bit 1 flags LZMA streams with end-of-stream markers.
+        entry.flag_bits = 0x00 if entry.filename.isascii() else 0x800
+        if compress_type == zipfile.ZIP_LZMA:
+            entry.flag_bits |= 0x02
+        entry.extra = strip_zip64_extra(entry.extra)
+        return entry
+
+    @staticmethod
+    def extract_version(entry, is_zip64):
+        """Return zip version needed to extract an entry."""
+        if entry.compress_type == zipfile.ZIP_LZMA:
+            return 63
+        elif entry.compress_type == zipfile.ZIP_BZIP2:
+            return 46
+        elif is_zip64:
+            return 45
+        else:
+            return 20
+
+    @staticmethod
+    def dos_date_time(entry):
+        """Return an entry's (date, time) in MS-DOS format."""
+        year, month, day, hour, minute, second = entry.date_time
+        dos_date = (year - 1980) << 9 | month << 5 | day
+        dos_time = hour << 11 | minute << 5 | second // 2
+        return dos_date, dos_time
+
+    def local_file_header(self, entry, is_zip64):
+        """Return an entry's local file header; Zip64 headers record sizes in a Zip64 extra field."""
+        entry_name = entry.filename.encode(
+            "ascii" if entry.filename.isascii() else "UTF8"
+        )
+        extra = entry.extra
+        file_size, compress_size = entry.file_size, entry.compress_size
+        if is_zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, file_size, compress_size) + extra
+            file_size = compress_size = 0xFFFFFFFF
+
+        dos_date, dos_time = self.dos_date_time(entry)
+        header = struct.pack(
+            "<4sHHHHHLLLHH",
+            b"PK\x03\x04",
+            self.extract_version(entry, is_zip64),
+            entry.flag_bits,
+            entry.compress_type,
+            dos_time,
+            dos_date,
+            entry.CRC,
+            compress_size,
+            file_size,
+            len(entry_name),
+            len(extra),
+        )
+        return header + entry_name + extra
+
+    def central_directory_header(self, entry):
+        """Return an entry's central directory header; sizes and offsets past zip's limits go in a Zip64 extra."""
+        entry_name = entry.filename.encode(
+            "ascii" if entry.filename.isascii() else "UTF8"
+        )
+        sizes = [entry.file_size, entry.compress_size, entry.header_offset]
+        zip64_values = [size for size in sizes if size > zip64_limit]
+        sizes = [min(size, 0xFFFFFFFF) for size in sizes]
+        extra = entry.extra
+        if zip64_values:
+            zip64_format = "<HH" + "Q" * len(zip64_values)
+            extra = (
+                struct.pack(zip64_format, 0x0001, 8 * len(zip64_values), *zip64_values)
+                + extra
+            )
+
+        extract_version = self.extract_version(entry, bool(zip64_values))
+        create_version = max(entry.create_version, extract_version)
+        dos_date, dos_time = self.dos_date_time(entry)
+        header = struct.pack(
+            "<4sHHHHHHLLLHHHHHLL",
+            b"PK\x01\x02",
+            entry.create_system << 8 | create_version,
+            extract_version,
+            entry.flag_bits,
+            entry.compress_type,
+            dos_time,
+            dos_date,
+            entry.CRC,
+            sizes[1],
+            sizes[0],
+            len(entry_name),
+            len(extra),
+            len(entry.comment),
+            0,
+            entry.internal_attr,
+            entry.external_attr,
+            sizes[2],
+        )
+        return header + entry_name + extra + entry.comment
+
+    def write_end_records(self, directory_offset, directory_size):
+        """Write end of central directory record, preceded by Zip64 end records when past zip's limits."""
+        entry_count = len(self.entries)
+        is_zip64 = (
+            entry_count > zip64_count_limit
+            or directory_offset > zip64_limit
+            or directory_size > zip64_limit
+        )
+        if is_zip64:
+            zip64_end_offset = self.output_stream.tell()
+            self.output_stream.write(
+                struct.pack(
+                    "<4sQHHLLQQQQ",
+                    b"PK\x06\x06",
+                    44,
+                    45,
+                    45,
+                    0,
+                    0,
+                    entry_count,
+                    entry_count,
+                    directory_size,
+                    directory_offset,
+                )
+            )
+            self.output_stream.write(
+                struct.pack("<4sLQL", b"PK\x06\x07", 0, zip64_end_offset, 1)
+            )
+
+        self.output_stream.write(
+            struct.pack(
+                "<4sHHHHLLH",
+                b"PK\x05\x06",
+                0,
+                0,
+                min(entry_count, zip64_count_limit),
+                min(entry_count, zip64_count_limit),
+                min(directory_size, 0xFFFFFFFF),
+                min(directory_offset, 0xFFFFFFFF),
+                0,
+            )
+        )
+
+    def compress(self, data, compress_type=None):
+        """Return (crc, compressed data) of data (bytes). Thread safe; call outside lock."""
+        if compress_type is None:
+            compress_type = self.compression
+        compressor = zip_compressor(compress_type, self.compresslevel)
+        if compressor:
+            compressed = compressor.compress(data) + compressor.flush()
+        else:
+            compressed = data
+        return zlib.crc32(data), compressed
+
+    def write_compressed(self, entry, data_size, crc, compressed, compress_type=None):
+        """
+        Append an entry compressed by compress() to zip file. Returns entry's ZipInfo.
+        Entry is an entry name or ZipInfo; rewritten entries replace their earlier
+        central directory entry.
+        """
+        entry = self.zip_entry(entry, compress_type)
+        entry.file_size = data_size
+        entry.compress_size = len(compressed)
+        entry.CRC = crc
+        is_zip64 = max(data_size, entry.compress_size) > zip64_limit
+
+        with self.lock:
+            if self.closed:
+                raise ValueError("Attempt to write to closed zip file")
+            entry.header_offset = self.offset
+            self.output_stream.seek(self.offset)
+            self.output_stream.write(self.local_file_header(entry, is_zip64))
+            self.output_stream.write(compressed)
+            self.offset = self.output_stream.tell()
+            self.entries.pop(entry.filename, None)
+            self.entries[entry.filename] = entry
+        return entry
+
+    def write_bytes(self, entry, data, compress_type=None):
+        """Compress data (bytes) and write it to zip file. Returns entry's ZipInfo."""
+        crc, compressed = self.compress(data, compress_type)
+        return self.write_compressed(entry, len(data), crc, compressed, compress_type)
+
+    def write_text(self, entry_name, text, compress_type=None):
+        """Compress text (UTF8) and write it to zip file. Returns entry's ZipInfo."""
+        return self.write_bytes(entry_name, text.encode("UTF8"), compress_type)
+
+    def compress_file(self, file_name, entry_name=None):
+        """
+        Return (entry, data size, crc, compressed data) of a file.
+        Returns None for directories and large files which write_file() streams.
+        """
+        entry = zipfile.ZipInfo.from_file(file_name, entry_name)
+        if entry.is_dir() or entry.file_size > self.max_entry_size:
+            return None
+        with open(file_name, "rb") as input_stream:
+            data = input_stream.read()
+        return (entry, len(data), *self.compress(data))
+
+    def write_file(self, file_name, entry_name=None, compressed_file=None):
+        """Write a file to zip; entry name defaults to file name. Returns entry's ZipInfo."""
+        if compressed_file is None:
+            compressed_file = self.compress_file(file_name, entry_name)
+        if compressed_file:
+            return self.write_compressed(*compressed_file)
+
+        entry = zipfile.ZipInfo.from_file(file_name, entry_name)
+        if entry.is_dir():
+            return self.write_compressed(entry, 0, 0, b"", zipfile.ZIP_STORED)
+        else:
+            return self.stream_file(file_name, entry)
+
+    def stream_file(self, file_name, entry, chunk_size=1024 * 1024):
+        """
+        Stream a large file into zip. Returns entry's ZipInfo.
+        Entry's local file header is rewritten with entry's sizes and crc once streamed.
+        """
+        entry = self.zip_entry(entry)
+        compressor = zip_compressor(entry.compress_type, self.compresslevel)
+
+        # Note: Zip64 header is reserved for files whose compressed size may exceed zip's limits.
+        is_zip64 = entry.file_size * 1.05 > zip64_limit
+        entry.file_size = entry.compress_size = entry.CRC = 0
+
+        with self.lock:
+            if self.closed:
+                raise ValueError("Attempt to write to closed zip file")
+            output_stream = self.output_stream
+            entry.header_offset = self.offset
+            output_stream.seek(self.offset)
+            output_stream.write(self.local_file_header(entry, is_zip64))
+            with open(file_name, "rb") as input_stream:
+                for data in iter(functools.partial(input_stream.read, chunk_size), b""):
+                    entry.file_size += len(data)
+                    entry.CRC = zlib.crc32(data, entry.CRC)
+                    compressed = compressor.compress(data) if compressor else data
+                    entry.compress_size += len(compressed)
+                    output_stream.write(compressed)
+            if compressor:
+                compressed = compressor.flush()
+                entry.compress_size += len(compressed)
+                output_stream.write(compressed)
+            if not is_zip64 and max(entry.file_size, entry.compress_size) > zip64_limit:
+                raise zipfile.LargeZipFile(
+                    f"File grew past zip's size limit while zipped: {file_name}"
+                )
+
+            self.offset = output_stream.tell()
+            output_stream.seek(entry.header_offset)
+            output_stream.write(self.local_file_header(entry, is_zip64))
+            self.entries.pop(entry.filename, None)
+            self.entries[entry.filename] = entry
+        return entry
+
+    def write_files(self, file_names, entry_names=None):
+        """
+        Write files to zip file in file name order; entry names default to file names.
+        Files are compressed in parallel across the writer's thread pool.
+        """
+        if entry_names is None:
+            entry_names = file_names
+
+        max_workers = self.max_workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for file_name, entry_name in zip(file_names, entry_names):
+                future = executor.submit(self.compress_file, file_name, entry_name)
+                futures.append((future, file_name, entry_name))
+
+                # limit compressed files held in memory waiting to be written
+                while len(futures) > max_workers * 2:
+                    future, file_name, entry_name = futures.pop(0)
+                    self.write_file(file_name, entry_name, future.result())
+
+            for future, file_name, entry_name in futures:
+                self.write_file(file_name, entry_name, future.result())
+
+
 def _archive(archive_file_name, file_names, relative_path="", mode=""):
     """Common code for create/append archive."""
 
     # insure paths end with '/'
     relative_path = force_trailing_slash(relative_path)
 
-    with zipfile.ZipFile(
-        archive_file_name, mode, compression=zipfile.ZIP_DEFLATED
-    ) as archive_file:
-        for file_name in file_names:
-            if relative_path and file_name.startswith(relative_path):
-                # if file name starts with relative path, strip off relative path
-                archive_file.write(file_name, file_name[len(relative_path):])
-            else:
-                # store file as its full source name
-                archive_file.write(file_name)
+    entry_names = []
+    for file_name in file_names:
+        if relative_path and file_name.startswith(relative_path):
+            # if file name starts with relative path, strip off relative path
+            entry_names.append(file_name[len(relative_path):])
+        else:
+            # store file as its full source name
+            entry_names.append(file_name)
+
+    # files are compressed in parallel
+    with ZipWriter(archive_file_name, mode) as archive_file:
+        archive_file.write_files(file_names, entry_names)
 
 
 def create_archive(archive_file_name, file_names, relative_path=""):
@@ -1685,6 +2143,62 @@ def test_make_key():
     logger.info(f'make_key("") = {make_key("")}')
 
 
+def test_zip_writer():
+    """Test ZipWriter compresses entries in parallel and writes a valid zip."""
+
+    class ParallelCheckZipWriter(ZipWriter):
+        """Breaks barrier unless the first 2 entries compress at the same time."""
+
+        barrier = threading.Barrier(2, timeout=30)
+        compress_count = 0
+
+        def compress(self, data, compress_type=None):
+            with self.lock:
+                self.compress_count += 1
+                is_checked = self.compress_count <= 2
+            if is_checked:
+                try:
+                    self.barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            return super().compress(data, compress_type)
+
+    test_folder = "test_zip_writer"
+    create_folder(test_folder)
+    file_names = []
+    for file_number in range(1, 9):
+        file_name = f"{test_folder}/test_{file_number}.txt"
+        save_text(file_name, f"line {file_number}\n" * 100_000)
+        file_names.append(file_name)
+
+    for compression in (
+        zipfile.ZIP_STORED,
+        zipfile.ZIP_DEFLATED,
+        zipfile.ZIP_BZIP2,
+        zipfile.ZIP_LZMA,
+    ):
+        archive_file_name = f"{test_folder}/test.zip"
+        ParallelCheckZipWriter.barrier.reset()
+        with ParallelCheckZipWriter(
+            archive_file_name, compression=compression, max_workers=4
+        ) as zip_writer:
+            zip_writer.write_files(file_names)
+            zip_writer.write_text("test.txt", "test")
+        assert (
+            not ParallelCheckZipWriter.barrier.broken
+        ), "Entries weren't compressed in parallel"
+
+        with zipfile.ZipFile(archive_file_name) as zip_file:
+            assert zip_file.testzip() is None, f"Bad zip entry: {zip_file.testzip()}"
+            assert zip_file.read(file_names[-1]) == load_text(file_names[-1]).encode(
+                "UTF8"
+            )
+        logger.info(
+            f"ZipWriter(compression={compression}): {file_size(archive_file_name):,} bytes; ok"
+        )
+    delete_folder(test_folder)
+
+
 def test_string_cleanup():
     """Test string cleanup functions."""
     text = (
@@ -1726,6 +2240,7 @@ def main():
     test_int()
     test_make_key()
     test_string_cleanup()
+    test_zip_writer()
 
 
 # test code
@@ -21,8 +21,15 @@ FUTURE:
 """
 
 # standard lib
+import collections
+import contextlib
+import copy
+import itertools
 import logging
 import pickle
+import queue
+import threading
+import time
 
 
 # common lib
@@ -30,6 +37,7 @@ from common import expand
 from common import log_setup
 from common import log_session_info
 from common import quote
+from common import split
 
 
 # udp classes
@@ -52,10 +60,90 @@ import pyodbc
 logger = logging.getLogger(__name__)
 
 
+# default number of rows stream cursors transfer from server per round trip
+default_itersize = 10_000
+
+# server side cursor names are unique per process
+cursor_numbers = itertools.count(1)
+
+
 class Object:
     pass
 
 
+# catalog-wide schema discovery commands used when a platform's sql config does not define them
+# Note: information_schema views are common to mssql and postgresql; views are treated as tables.
+default_sql_commands = dict(
+    select_schema_columns="""
+        select
+            table_name, column_name, data_type, is_nullable, character_maximum_length,
+            numeric_precision, numeric_scale, datetime_precision, character_set_name, collation_name
+        from information_schema.columns
+        where table_schema = '{schema_name}'
+        order by table_name, ordinal_position
+    """,
+    select_schema_pks="""
+        select key_columns.table_name, key_columns.column_name
+        from information_schema.table_constraints as table_constraints
+        join information_schema.key_column_usage as key_columns
+            on key_columns.constraint_schema = table_constraints.constraint_schema
+            and key_columns.constraint_name = table_constraints.constraint_name
+            and key_columns.table_name = table_constraints.table_name
+        where table_constraints.table_schema = '{schema_name}'
+            and table_constraints.constraint_type = 'PRIMARY KEY'
+    """,
+    add_table_columns="""
+        alter table "{schema_name}"."{table_name}" add
+        {column_definitions}
+    """,
+    # stage workers' dataset leases (see stagequeue.py); lease_expires in epoch seconds
+    create_named_table_udp_sys_stage_lease="""
+        create table "{schema_name}"."{table_name}" (
+            dataset_name varchar(128) not null primary key,
+            archive_file_name varchar(256) not null,
+            worker_id varchar(256) not null,
+            lease_token varchar(32) not null,
+            lease_expires float not null,
+            failure_count int not null default 0
+        )
+    """
+)
+
+
+# platform specific commands used when a platform's sql config does not define them
+platform_sql_commands = dict(
+    mssql=dict(
+        current_rowversion="""
+            select min_active_rowversion()
+        """,
+        select_schema_checksum="""
+            select
+                (select count(*) from information_schema.columns where table_schema = '{schema_name}'),
+                (select checksum_agg(checksum(
+                    table_name, column_name, ordinal_position, data_type, is_nullable, character_maximum_length,
+                    numeric_precision, numeric_scale, datetime_precision, collation_name))
+                from information_schema.columns where table_schema = '{schema_name}'),
+                (select checksum_agg(checksum(table_name, column_name, constraint_name))
+                from information_schema.key_column_usage where table_schema = '{schema_name}')
+        """
+    ),
+    postgresql=dict(
+        select_schema_checksum="""
+            select
+                (select count(*) from information_schema.columns where table_schema = '{schema_name}'),
+                (select md5(string_agg(concat_ws('|',
+                    table_name, column_name, ordinal_position, data_type, is_nullable, character_maximum_length,
+                    numeric_precision, numeric_scale, datetime_precision, collation_name),
+                    ',' order by table_name, ordinal_position))
+                from information_schema.columns where table_schema = '{schema_name}'),
+                (select md5(string_agg(concat_ws('|', table_name, column_name, constraint_name),
+                    ',' order by table_name, constraint_name, ordinal_position))
+                from information_schema.key_column_usage where table_schema = '{schema_name}')
+        """
+    )
+)
+
+
 class Connection:
 
     def __init__(self, connection):
@@ -68,6 +156,8 @@ class Connection:
         self.password = connection.password
         self.port = connection.port
         self.on_connect = connection.on_connect
+        self.endpoint = None
+        self.itersize = int(connection.itersize) if connection.itersize else default_itersize
 
         # configuration/version info
         self.client_drivers = ''
@@ -103,6 +193,17 @@ class Connection:
         """Subclass for connection specific details."""
         pass
 
+    def stream_cursor(self):
+        """
+        Return a cursor that streams a select's rows from the server as they're fetched vs loading the select's
+        entire result set into client memory. Stream cursors execute a single select; close when finished.
+
+        Default cursors (eg. pyodbc's forward-only, read-only firehose cursors) already stream rows as they're fetched.
+        """
+        cursor = self.conn.cursor()
+        cursor.arraysize = self.itersize
+        return cursor
+
 
 class MSSQL(Connection):
 
@@ -230,6 +331,15 @@ class PostgreSQL(Connection):
         self.conn.cursor_factory = psycopg2.extras.NamedTupleCursor
         self.cursor = self.conn.cursor()
 
+    def stream_cursor(self):
+        # psycopg2's default (client side) cursors load a select's entire result set on execute; named (server side)
+        # cursors fetch rows from the server as they're fetched (fetchmany(n)) or iterated (itersize rows at a time)
+        # Note: Server side cursors exist within the connection's (non-autocommit) transaction.
+        cursor = self.conn.cursor(name=f'udp_cursor_{next(cursor_numbers)}')
+        cursor.itersize = self.itersize
+        cursor.arraysize = self.itersize
+        return cursor
+
 
 """
 Python DB API-compliance: auto-commit is off by default. You need to call conn.commit to commit any pending transaction.
@@ -269,6 +379,15 @@ class Database:
     # def sql(self, command):
     # 	return self.sql_config.sections[command]
 
+    def sql_command(self, command_name):
+        """Return command's sql template from platform's sql config or its built-in default template."""
+        sql_template = self.sql(command_name)
+        if not sql_template:
+            sql_template = platform_sql_commands.get(self.platform, dict()).get(command_name)
+        if not sql_template:
+            sql_template = default_sql_commands[command_name]
+        return sql_template
+
     def is_null(self, sql_command):
         # Note: referenced in embedded f-string
 
@@ -315,9 +434,22 @@ class Database:
         self.cursor.execute(sql_command)
         return self.cursor.fetchone()[0]
 
-    def current_rowversion(self, table_name):
-        # Based on MS RowVersion CDC.
-        raise NotImplementedError(f'MS RowVersion CDC not supported yet ({table_name})')
+    # noinspection PyUnusedLocal
+    def current_rowversion(self, table_name=None):
+        """
+        Returns database's current rowversion (int) for MS RowVersion CDC. Rowversions are database wide;
+        min_active_rowversion() is the lowest rowversion of any active transaction so all rows with lower
+        rowversions are committed.
+        """
+        if self.platform != 'mssql':
+            raise NotImplementedError(f'RowVersion CDC not supported for {self.platform} ({table_name})')
+
+        command_name = 'current_rowversion'
+        sql_template = self.sql_command(command_name)
+        sql_command = expand(sql_template)
+        self.log(command_name, sql_command)
+        self.cursor.execute(sql_command)
+        return int.from_bytes(self.cursor.fetchone()[0], 'big')
 
     # noinspection PyUnusedLocal
     def current_sequence(self, table_name):
@@ -430,6 +562,72 @@ class Database:
                 pk_columns = ', '.join(pk_columns)
             return pk_columns
 
+    # noinspection PyUnusedLocal
+    # Note: schema_name used in embedded f-strings.
+    def select_schema_catalog(self, schema_name):
+        """
+        Returns a SchemaCatalog of all of a schema's table schemas and pks discovered via 2 catalog queries
+        vs the 4+ queries per table made by select_table_schema() and select_table_pk().
+        """
+        schema_catalog = tableschema.SchemaCatalog(schema_name)
+
+        command_name = 'select_schema_columns'
+        sql_template = self.sql_command(command_name)
+        sql_command = expand(sql_template)
+        self.log(command_name, sql_command)
+        self.cursor.execute(sql_command)
+
+        # make sure pickled table schemas are not tied to database client
+        rows = self.cursor.fetchall()
+        column_names = [column[0].lower() for column in self.cursor.description]
+        columns = []
+        for row in rows:
+            column = Object()
+            columns.append(column)
+            for column_name, value in zip(column_names, row):
+                setattr(column, column_name, value)
+        schema_catalog.add_columns(columns)
+
+        command_name = 'select_schema_pks'
+        sql_template = self.sql_command(command_name)
+        sql_command = expand(sql_template)
+        self.log(command_name, sql_command)
+        self.cursor.execute(sql_command)
+        schema_catalog.add_pk_columns([(row[0], row[1]) for row in self.cursor.fetchall()])
+
+        return schema_catalog
+
+    # noinspection PyUnusedLocal
+    # Note: schema_name used in embedded f-strings.
+    def select_schema_checksum(self, schema_name):
+        """Returns a cheap checksum (string) of a schema's column and pk definitions that changes with schema's DDL."""
+        command_name = 'select_schema_checksum'
+        sql_template = self.sql_command(command_name)
+        sql_command = expand(sql_template)
+        self.log(command_name, sql_command)
+        self.cursor.execute(sql_command)
+        return '|'.join([str(value) for value in self.cursor.fetchone()])
+
+    # noinspection PyUnusedLocal
+    # Note: schema_name, table_name, column_definitions used in embedded f-strings.
+    def add_table_columns(self, schema_name, table_name, table_schema, column_names):
+        """Add table_schema's column_names columns (as nullable columns) to an existing table."""
+        command_name = 'add_table_columns'
+        add_schema = tableschema.TableSchema(table_name, [])
+        for column_name in column_names:
+            column = copy.copy(table_schema.columns[column_name])
+            column.is_nullable = 'YES'
+            add_schema.columns[column_name] = column
+        column_definitions = add_schema.column_definitions()
+
+        autocommit = self.conn.autocommit
+        self.conn.autocommit = True
+        sql_template = self.sql_command(command_name)
+        sql_command = expand(sql_template)
+        self.log(command_name, sql_command)
+        self.cursor.execute(sql_command)
+        self.conn.autocommit = autocommit
+
     def create_table_from_table_schema(self, schema_name, table_name, table, extended_definitions=None):
         command_name = 'create_table_from_table_schema'
         if not self.does_table_exist(schema_name, table_name):
@@ -454,7 +652,7 @@ class Database:
         if not self.does_table_exist(schema_name, table_name):
             autocommit = self.conn.autocommit
             self.conn.autocommit = True
-            sql_template = self.sql(command_name)
+            sql_template = self.sql_command(command_name)
             sql_command = expand(sql_template)
             self.log(command_name, sql_command)
             self.cursor.execute(sql_command)
@@ -595,6 +793,149 @@ class Database:
         self.conn.autocommit = autocommit
 
 
+def connect(resource):
+    """Return (db, db_engine) for a [database:*] resource based on its platform."""
+    if resource.platform == 'postgresql':
+        db = PostgreSQL(resource)
+    elif resource.platform == 'mssql':
+        db = MSSQL(resource)
+    else:
+        raise NotImplementedError(f'Unknown database platform ({resource.platform})')
+    return db, Database(resource.platform, db.conn)
+
+
+def replica_resource(resource, endpoint):
+    """Return a copy of a [database:*] resource that connects to endpoint (host[:port])."""
+    resource = copy.copy(resource)
+    host, _, port = endpoint.partition(':')
+    resource.host = host
+    if port:
+        resource.port = port
+    return resource
+
+
+class ReplicaRouter:
+
+    """
+    Routes a [database:*] resource's connections across its readable replicas.
+
+    Replicas are a list of host[:port] endpoints (replicas); the resource's host when no replicas are listed.
+    Replica policies (replica_policy):
+    - round_robin (default) - connections rotate across replicas
+    - least_latency - connections go to the replica with the lowest measured connect latency weighted by
+      the replica's open connections (least loaded)
+    Connections may be pinned to an endpoint (eg. a table's replica). Connect errors fail over to the next replica;
+    failovers are logged and reported to events as replica:<endpoint> failover stats.
+    """
+
+    def __init__(self, resource, events=None):
+        self.resource = resource
+        self.events = events
+        if resource.replicas:
+            self.endpoints = split(resource.replicas)
+        elif resource.port:
+            self.endpoints = [f'{resource.host}:{resource.port}']
+        else:
+            self.endpoints = [resource.host]
+
+        self.policy = (resource.replica_policy or 'round_robin').lower()
+        if self.policy not in ('round_robin', 'least_latency'):
+            raise ValueError(f'Unknown replica_policy ({resource.replica_policy})')
+
+        # round robin position, smoothed connect latency and open connections of each endpoint
+        self.endpoint_numbers = itertools.count()
+        self.latencies = dict()
+        self.connection_counts = collections.Counter()
+
+        # (endpoint, error) of each failed connect
+        self.failovers = []
+
+        self.lock = threading.Lock()
+
+    def endpoint_order(self, endpoint=None):
+        """Return endpoints in the order a connection tries them; a pinned endpoint is tried first."""
+        with self.lock:
+            if endpoint:
+                return [endpoint] + [other_endpoint for other_endpoint in self.endpoints if other_endpoint != endpoint]
+            elif self.policy == 'round_robin':
+                start = next(self.endpoint_numbers) % len(self.endpoints)
+            else:
+                # measure endpoints without a latency first, then pick lowest latency weighted by open connections
+                def load(endpoint_name):
+                    latency = self.latencies.get(endpoint_name)
+                    return -1 if latency is None else latency * (1 + self.connection_counts[endpoint_name])
+                start = self.endpoints.index(min(self.endpoints, key=load))
+            return self.endpoints[start:] + self.endpoints[:start]
+
+    def connect(self, endpoint=None):
+        """Return (db, db_engine) connected to policy's next (or a pinned) endpoint; fails over to other endpoints."""
+        endpoints = self.endpoint_order(endpoint)
+        for endpoint_number, endpoint in enumerate(endpoints, 1):
+            start_time = time.perf_counter()
+            try:
+                db, db_engine = connect(replica_resource(self.resource, endpoint))
+            except Exception as e:
+                run_time = time.perf_counter() - start_time
+                with self.lock:
+                    self.failovers.append((endpoint, str(e)))
+                if self.events:
+                    self.events.add(f'replica:{endpoint}', 'failover', run_time)
+                if endpoint_number == len(endpoints):
+                    raise
+                logger.warning(f'Replica {endpoint} connect failed; failing over to {endpoints[endpoint_number]} ({e})')
+                continue
+
+            # smooth latency samples so a single slow connect doesn't starve a replica
+            latency = time.perf_counter() - start_time
+            with self.lock:
+                last_latency = self.latencies.get(endpoint)
+                self.latencies[endpoint] = latency if last_latency is None else 0.7 * last_latency + 0.3 * latency
+                self.connection_counts[endpoint] += 1
+            db.endpoint = endpoint
+            return db, db_engine
+
+    def disconnect(self, db):
+        """Close a connection opened by connect()."""
+        with self.lock:
+            self.connection_counts[db.endpoint] -= 1
+        with contextlib.suppress(Exception):
+            db.conn.close()
+
+
+class ConnectionPool:
+
+    """Bounded pool of (db, db_engine) connections shared by worker threads; one connection per active worker."""
+
+    def __init__(self, resource, size, router=None, endpoint=None):
+        """Connections are routed across resource's replicas by router (optional), optionally pinned to endpoint."""
+        self.resource = resource
+        self.size = size
+        self.router = router or ReplicaRouter(resource)
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(self.router.connect(endpoint))
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a (db, db_engine) connection for the duration of a with block."""
+        connection = self.connections.get()
+        try:
+            yield connection
+        finally:
+            self.connections.put(connection)
+
+    def rollback(self):
+        """End idle pooled connections' open transactions (releasing their locks and snapshots)."""
+        for db, db_engine in list(self.connections.queue):
+            db.conn.rollback()
+
+    def close(self):
+        """Close all pooled connections."""
+        while not self.connections.empty():
+            db, db_engine = self.connections.get_nowait()
+            self.router.disconnect(db)
+
+
 # test code
 def main():
     config = ConfigSectionKey('conf', 'local')
@@ -17,6 +17,7 @@ import datetime
 import logging
 import os
 import socket
+import threading
 import time
 
 
@@ -117,13 +118,35 @@ class Events:
 		extra_columns = 'script_name, script_version, script_instance, server_name, user_name, dataset_id, job_id'
 		self.extra_columns = [column_name for column_name in split(extra_columns)]
 
+		# events may be started, stopped and saved from parallel worker threads
+		self.lock = threading.RLock()
+
 	# stat_type = job, step (extract, compress, upload)
 	def start(self, stat_name, stat_type=None):
-		self.stats[stat_name] = Stat(stat_name, stat_type)
-		self.stats[stat_name].start()
+		with self.lock:
+			self.stats[stat_name] = Stat(stat_name, stat_type)
+			self.stats[stat_name].start()
 
 	def stop(self, stat_name, row_count=0, data_size=0):
-		self.stats[stat_name].stop(row_count, data_size)
+		with self.lock:
+			self.stats[stat_name].stop(row_count, data_size)
+
+	def add(self, stat_name, stat_type=None, run_time=0, row_count=0, data_size=0):
+		"""
+		Add a stat measured by caller, eg. the size of a package entry, without start/stop logging.
+		Adding to an existing stat accumulates its run time, row count and data size.
+		"""
+		with self.lock:
+			if stat_name not in self.stats:
+				stat = Stat(stat_name, stat_type)
+				stat.start_time = datetime.datetime.now() - datetime.timedelta(seconds=run_time)
+				self.stats[stat_name] = stat
+
+			stat = self.stats[stat_name]
+			stat.end_time = datetime.datetime.now()
+			stat.run_time += run_time
+			stat.row_count += row_count
+			stat.data_size += data_size
 
 	# save stat info in a json file format to preserve data types
 	def save(self, file_name=None):
@@ -138,25 +161,26 @@ class Events:
 			file_name = self.file_name
 
 		rows = []
-		for stat_name, stat in self.stats.items():
-			row = dict()
-
-			# session wide properties
-			row['script_name'] = self.script_name
-			row['script_instance'] = self.script_instance
-			row['server_name'] = self.server_name
-			row['user_name'] = self.user_name
-			row['dataset_id'] = self.dataset_id
-			row['job_id'] = self.job_id
-
-			# merge in stat properties
-			row = {**row, **stat.row()}
-
-			# save the row for output
-			rows.append(row)
-
-		# save the output
-		save_jsonpickle(file_name, rows)
+		with self.lock:
+			for stat_name, stat in self.stats.items():
+				row = dict()
+
+				# session wide properties
+				row['script_name'] = self.script_name
+				row['script_instance'] = self.script_instance
+				row['server_name'] = self.server_name
+				row['user_name'] = self.user_name
+				row['dataset_id'] = self.dataset_id
+				row['job_id'] = self.job_id
+
+				# merge in stat properties
+				row = {**row, **stat.row()}
+
+				# save the row for output
+				rows.append(row)
+
+			# save the output
+			save_jsonpickle(file_name, rows)
 
 
 # temp test harness ...
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+governor.py
+
+Source load governor: limits the load a capture job puts on its source database.
+
+Limits (per [database:*] source; blank or 0 is unlimited):
+- max_rows_per_second - rows fetched per second across all of a job's cursors
+- max_bytes_per_second - (estimated in-memory) bytes fetched per second across all of a job's cursors
+- max_concurrent_queries - table and partition selects running at the same time
+- governor_hours - hours of day (0-23) limits apply; limits apply at all hours when blank
+
+Rate limits pace fetches: each fetch's rows and bytes push back the time the job's next fetch may start. A job
+that has been idle may burst up to one second's worth of rows/bytes. Time spent waiting on rate limits and query
+slots is tracked as throttle time so it can be reported as a job metric.
+"""
+
+
+# standard lib
+import contextlib
+import datetime
+import logging
+import threading
+import time
+
+
+# common lib
+from common import log_setup
+from common import log_session_info
+from common import split
+
+
+# udp lib
+import batch
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# seconds of rate limit budget an idle job may use in a burst
+burst_seconds = 1.0
+
+
+class LoadGovernor:
+
+    """Paces a capture job's fetches and limits its concurrent queries; shared by all of a job's threads."""
+
+    def __init__(self, max_rows_per_second=0, max_bytes_per_second=0, max_concurrent_queries=0, governor_hours=''):
+        self.max_rows_per_second = int(max_rows_per_second or 0)
+        self.max_bytes_per_second = int(max_bytes_per_second or 0)
+        self.max_concurrent_queries = int(max_concurrent_queries or 0)
+        self.governor_hours = set([int(hour) for hour in split(governor_hours)]) if governor_hours else set()
+
+        # time (time.monotonic()) next fetch may start
+        self.next_time = 0.0
+
+        # seconds spent waiting on rate limits and query slots
+        self.throttle_time = 0.0
+        self.query_wait_time = 0.0
+
+        self.lock = threading.Lock()
+        if self.max_concurrent_queries:
+            self.query_slots = threading.BoundedSemaphore(self.max_concurrent_queries)
+        else:
+            self.query_slots = None
+
+    def __str__(self):
+        limits = []
+        if self.max_rows_per_second:
+            limits.append(f'{self.max_rows_per_second:,} rows/s')
+        if self.max_bytes_per_second:
+            limits.append(f'{self.max_bytes_per_second:,} bytes/s')
+        if self.max_concurrent_queries:
+            limits.append(f'{self.max_concurrent_queries} concurrent queries')
+        if self.governor_hours:
+            limits.append(f'hours {sorted(self.governor_hours)}')
+        return ', '.join(limits) or 'unlimited'
+
+    def is_limited(self):
+        """Return True if governor has limits and they apply at the current hour of day."""
+        if not (self.max_rows_per_second or self.max_bytes_per_second or self.max_concurrent_queries):
+            return False
+        return not self.governor_hours or datetime.datetime.now().hour in self.governor_hours
+
+    def throttle(self, rows):
+        """Pace a fetch; sleeps when fetches exceed the rows/bytes per second limits. Returns seconds throttled."""
+        if not rows or not (self.max_rows_per_second or self.max_bytes_per_second) or not self.is_limited():
+            return 0
+
+        # seconds of rate limit budget this fetch uses
+        budget_time = 0.0
+        if self.max_rows_per_second:
+            budget_time = len(rows) / self.max_rows_per_second
+        if self.max_bytes_per_second:
+            data_size = batch.estimate_row_size(rows) * len(rows)
+            budget_time = max(budget_time, data_size / self.max_bytes_per_second)
+
+        with self.lock:
+            current_time = time.monotonic()
+            self.next_time = max(self.next_time, current_time) + budget_time
+            wait_time = max(0.0, self.next_time - current_time - burst_seconds)
+            self.throttle_time += wait_time
+
+        if wait_time:
+            time.sleep(wait_time)
+        return wait_time
+
+    @contextlib.contextmanager
+    def query(self):
+        """Hold one of max_concurrent_queries query slots for the duration of a with block."""
+        if not self.query_slots or not self.is_limited():
+            yield
+            return
+
+        start_time = time.perf_counter()
+        self.query_slots.acquire()
+        wait_time = time.perf_counter() - start_time
+        with self.lock:
+            self.query_wait_time += wait_time
+        try:
+            yield
+        finally:
+            self.query_slots.release()
+
+
+def load_governor(resource):
+    """Return a LoadGovernor configured by a [database:*] resource's governor properties."""
+    return LoadGovernor(
+        resource.max_rows_per_second, resource.max_bytes_per_second, resource.max_concurrent_queries,
+        resource.governor_hours
+    )
+
+
+# temp test harness ...
+
+
+# test code
+def main():
+    governor = LoadGovernor(max_rows_per_second=10_000, max_concurrent_queries=2)
+    rows = [(row_number, f'value {row_number}') for row_number in range(1_000)]
+    start_time = time.perf_counter()
+    for _ in range(30):
+        with governor.query():
+            governor.throttle(rows)
+    run_time = time.perf_counter() - start_time
+    logger.info(f'Governor({governor}): 30,000 rows in {run_time:.1f}s; throttled {governor.throttle_time:.1f}s')
+
+
+# test code
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()
@@ -44,6 +44,7 @@ from common import log_setup
 from common import make_name
 from common import now
 from common import save_text
+from common import ZipWriter
 
 
 # resource lib
@@ -226,8 +227,8 @@ class KeyVault(KeyVaultABC):
 
 			# pickle the vault dict as a json string and save it to a json file in a zip file
 			json_data = jsonpickle.dumps(self.secrets)
-			zip_file = zipfile.ZipFile(self._file_name(), mode='w', compression=zipfile.ZIP_DEFLATED)
-			zip_file.writestr(self.vault_json_file, json_data.encode())
+			with ZipWriter(self._file_name()) as zip_file:
+				zip_file.write_bytes(self.vault_json_file, json_data.encode())
 
 			# clear is_updated status
 			self.is_updated = False
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+package.py
+
+Capture package (zip) writer and reader.
+
+Capture entries (*.table, *.schema, *.pk, *.sql, and table#nnnn.json batches) are written directly
+to the capture package as compressed zip entries as they are produced. Batches are never written
+to the work folder uncompressed and re-read by shutil.make_archive(), so capture touches the disk
+once per (compressed) byte and doesn't need free space for the full uncompressed dataset.
+
+Each entry's compressed size is reported to the job's events as an 'entry' stat. Entries are compressed (zip
+native codecs via common.ZipWriter.compress(), entry codecs via Codec.encode()) on the writing thread (eg. capture's
+pipeline workers and parallel table workers) outside the package's lock, so batches compress in parallel across all
+cores; only appending compressed entries to the package is serialized.
+
+Packages can be checkpointed and resumed: checkpoint() returns the package's file offset and entries written so far;
+a package resumed from a checkpoint truncates the file at the checkpoint's offset and re-registers the checkpoint's
+entries (optionally filtered) so they're included in the package's central directory when the package is closed.
+
+Package codecs (project package_codec): <codec>[:<level>]
+- store - no compression
+- deflate - zip's default codec (level 1-9, default 6)
+- bzip2, lzma - zip native codecs with higher compression ratios and lower throughput
+- zstd (level 1-22, default 3), lz4 (level 0-16, default 0) - fast 3rd party codecs (zstandard, lz4 packages)
+
+Zstd and lz4 aren't zip native codecs; entries are compressed by the package and stored in the zip uncompressed.
+Each package's codec and encoded entries are recorded in its capture.manifest entry; use PackageReader,
+read_package_entry() and extract_package() vs zipfile directly to read packages so entries are decoded transparently.
+
+PackageReader reads entries lazily, straight from the package, one entry at a time vs extracting the package to disk.
+"""
+
+
+# standard lib
+import fnmatch
+import json
+import logging
+import time
+import threading
+import zipfile
+
+
+# common lib
+from common import create_folder
+from common import file_size
+from common import is_folder
+from common import just_file_name
+from common import just_path
+from common import log_setup
+from common import log_session_info
+from common import ZipWriter
+
+
+# 3rd party lib (optional codecs)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# package entry describing package's codec and encoded entries
+manifest_entry_name = 'capture.manifest'
+
+# zip native codecs
+native_codecs = dict(
+    store=zipfile.ZIP_STORED, deflate=zipfile.ZIP_DEFLATED, bzip2=zipfile.ZIP_BZIP2, lzma=zipfile.ZIP_LZMA
+)
+
+# codecs applied to entry data by package; encoded entries are stored uncompressed
+entry_codecs = ('zstd', 'lz4')
+
+
+class Codec:
+
+    """Package codec (<codec>[:<level>]); default codec is deflate."""
+
+    def __init__(self, codec=''):
+        codec_name, _, level = codec.strip().lower().partition(':')
+        self.codec_name = codec_name or 'deflate'
+        self.level = int(level) if level else None
+
+        if self.codec_name not in native_codecs and self.codec_name not in entry_codecs:
+            raise ValueError(f'Unknown package codec: {codec}')
+        if self.codec_name == 'zstd' and not zstandard:
+            raise ValueError(f'Package codec {codec} requires zstandard package')
+        if self.codec_name == 'lz4' and not lz4:
+            raise ValueError(f'Package codec {codec} requires lz4 package')
+
+    def __str__(self):
+        return f'{self.codec_name}:{self.level}' if self.level is not None else self.codec_name
+
+    def is_entry_codec(self):
+        """Return True if codec is applied to entry data by package (vs zip)."""
+        return self.codec_name in entry_codecs
+
+    def compression(self):
+        """Return zip compression type of package's entries."""
+        return native_codecs.get(self.codec_name, zipfile.ZIP_STORED)
+
+    def compress_level(self):
+        """Return zip compresslevel of package's entries."""
+        return self.level if not self.is_entry_codec() else None
+
+    def encode(self, data):
+        """Return compressed data for entry codecs; data is returned as-is for zip native codecs."""
+        if self.codec_name == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        elif self.codec_name == 'lz4':
+            return lz4.frame.compress(data, compression_level=self.level or 0)
+        else:
+            return data
+
+
+def decode(codec_name, data):
+    """Return decompressed data of an entry encoded with codec_name."""
+    if codec_name == 'zstd':
+        if not zstandard:
+            raise ValueError('Package entry uses zstd codec; requires zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec_name == 'lz4':
+        if not lz4:
+            raise ValueError('Package entry uses lz4 codec; requires lz4 package')
+        return lz4.frame.decompress(data)
+    else:
+        return data
+
+
+class CapturePackage:
+
+    """Zip file that capture entries are streamed into; safe to write to from parallel table workers."""
+
+    def __init__(self, file_name, events=None, checkpoint=None, codec=''):
+        self.file_name = file_name
+        self.events = events
+        self.codec = Codec(codec)
+
+        # uncompressed and compressed bytes written
+        self.data_size = 0
+        self.compress_size = 0
+
+        # entries encoded by an entry codec indexed by entry name
+        self.encoded_entries = dict()
+
+        self.lock = threading.Lock()
+        zip_options = dict(compression=self.codec.compression(), compresslevel=self.codec.compress_level())
+        if not checkpoint:
+            self.output_stream = None
+            self.zip_writer = ZipWriter(file_name, **zip_options)
+        else:
+            # continue writing package from checkpoint's offset; zip header offsets are file absolute
+            offset, entries = checkpoint
+            self.output_stream = open(file_name, 'r+b')
+            self.output_stream.truncate(offset)
+            self.output_stream.seek(offset)
+            self.zip_writer = ZipWriter(self.output_stream, **zip_options)
+            for entry in entries:
+                entry = load_entry(entry)
+                self.zip_writer.add_entry(entry)
+                self.data_size += entry.file_size
+                self.compress_size += entry.compress_size
+                if entry.comment:
+                    self.encoded_entries[entry.filename] = entry.comment.decode('UTF8')
+            logger.info(f'Resuming package {file_name} at offset {offset:,} with {len(entries)} entries')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _track(self, entry, run_time, row_count, data_size):
+        """Track entry sizes and report entry's compressed size to events."""
+        entry_name = entry.filename
+        self.data_size += data_size
+        self.compress_size += entry.compress_size
+        logger.debug(f'Package entry {entry_name}: {data_size:,} bytes ({entry.compress_size:,} compressed)')
+        if self.events:
+            self.events.add(entry_name, 'entry', run_time, row_count, entry.compress_size)
+        return entry
+
+    def write_bytes(self, entry_name, data, row_count=0):
+        """Write data (bytes) to package as a compressed entry. Returns entry's ZipInfo."""
+
+        start_time = time.perf_counter()
+        entry = zipfile.ZipInfo(entry_name, date_time=time.localtime(time.time())[:6])
+        if not self.codec.is_entry_codec():
+            compress_type = None
+            entry_data = data
+        else:
+            # encoded entries are stored as-is; entry comment marks them so resumed packages know they're encoded
+            compress_type = zipfile.ZIP_STORED
+            entry.comment = self.codec.codec_name.encode('UTF8')
+            entry_data = self.codec.encode(data)
+
+        # compress outside of package's lock so entries written by parallel threads compress in parallel
+        crc, compressed = self.zip_writer.compress(entry_data, compress_type)
+
+        # a rewritten entry replaces its earlier directory entry
+        with self.lock:
+            self.encoded_entries.pop(entry_name, None)
+            if self.codec.is_entry_codec():
+                self.encoded_entries[entry_name] = self.codec.codec_name
+            entry = self.zip_writer.write_compressed(entry, len(entry_data), crc, compressed, compress_type)
+            return self._track(entry, time.perf_counter() - start_time, row_count, len(data))
+
+    def write_text(self, entry_name, text, row_count=0):
+        """Write text to package as a compressed UTF8 entry. Returns entry's ZipInfo."""
+        return self.write_bytes(entry_name, text.encode('UTF8'), row_count)
+
+    def write_file(self, file_name, entry_name=None):
+        """Write an existing file to package; entry name defaults to file's name without path."""
+        if not entry_name:
+            entry_name = just_file_name(file_name)
+        with open(file_name, 'rb') as input_stream:
+            return self.write_bytes(entry_name, input_stream.read())
+
+    def checkpoint(self):
+        """Return package's (offset, entries) checkpoint; entries are dicts of ZipInfo attributes."""
+        with self.lock:
+            offset, entries = self.zip_writer.checkpoint()
+            return offset, [save_entry(entry) for entry in entries]
+
+    def manifest(self):
+        """Return package's manifest (codec and encoded entries)."""
+        return dict(codec=str(self.codec), encoded_entries=self.encoded_entries)
+
+    def close(self):
+        """Finish package by writing its manifest and the zip's central directory. Returns package's file size."""
+        with self.lock:
+            if not self.zip_writer.closed:
+                self.encoded_entries.pop(manifest_entry_name, None)
+                manifest = json.dumps(self.manifest(), indent=2).encode('UTF8')
+                self.zip_writer.write_bytes(manifest_entry_name, manifest, zipfile.ZIP_DEFLATED)
+                self.zip_writer.close()
+            if self.output_stream:
+                self.output_stream.close()
+                self.output_stream = None
+        return file_size(self.file_name)
+
+
+def save_entry(entry):
+    """Return a ZipInfo's attributes as a dict."""
+    return {name: getattr(entry, name) for name in entry.__slots__ if hasattr(entry, name)}
+
+
+def load_entry(attributes):
+    """Return a ZipInfo from a dict of its attributes."""
+    entry = zipfile.ZipInfo(attributes['filename'])
+    for name, value in attributes.items():
+        setattr(entry, name, value)
+    return entry
+
+
+def load_manifest(zip_file):
+    """Return a package's manifest; packages without a manifest are zip native (deflate) packages."""
+    if manifest_entry_name in zip_file.namelist():
+        return json.loads(zip_file.read(manifest_entry_name).decode('UTF8'))
+    else:
+        return dict(codec='deflate', encoded_entries=dict())
+
+
+def read_entry(zip_file, manifest, entry_name):
+    """Return an entry's decoded data (bytes)."""
+    return decode(manifest['encoded_entries'].get(entry_name), zip_file.read(entry_name))
+
+
+def read_package_entry(file_name, entry_name, encoding='UTF8', default=None):
+    """
+    Return the contents of an entry from a capture package. Returns default if entry not present in the package.
+    If encoding is None, return contents as bytes, otherwise decode contents based on specified encoding.
+    """
+    with zipfile.ZipFile(file_name) as zip_file:
+        if entry_name not in zip_file.namelist():
+            return default
+        data = read_entry(zip_file, load_manifest(zip_file), entry_name)
+        return data if encoding is None else data.decode(encoding)
+
+
+class PackageReader:
+
+    """Reads a capture package's entries on demand (decoded per its manifest); safe to read from parallel threads."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.zip_file = zipfile.ZipFile(file_name)
+        self.manifest = load_manifest(self.zip_file)
+        self.entry_names = self.zip_file.namelist()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.zip_file.close()
+
+    @property
+    def codec(self):
+        return self.manifest['codec']
+
+    def exists(self, entry_name):
+        return entry_name in self.entry_names
+
+    def names(self, pattern='*'):
+        """Return sorted names of entries matching glob-style pattern, eg. table#*.json for a table's batches."""
+        return sorted([entry_name for entry_name in self.entry_names if fnmatch.fnmatchcase(entry_name, pattern)])
+
+    def read(self, entry_name):
+        """Return an entry's decoded data (bytes)."""
+        return read_entry(self.zip_file, self.manifest, entry_name)
+
+    def read_text(self, entry_name, default=None, encoding='UTF8'):
+        """Return an entry's decoded text or default if entry not present in the package."""
+        if not self.exists(entry_name):
+            return default
+        return self.read(entry_name).decode(encoding)
+
+    def entries(self, pattern='*'):
+        """Yield (entry name, data) of entries matching pattern; entries are read and decoded one at a time."""
+        for entry_name in self.names(pattern):
+            yield entry_name, self.read(entry_name)
+
+
+def extract_package(file_name, target_folder):
+    """Extract all entries of a capture package to target folder. Returns package's manifest."""
+    with zipfile.ZipFile(file_name) as zip_file:
+        manifest = load_manifest(zip_file)
+        for entry_name in zip_file.namelist():
+            # make sure destination folder present
+            folder_name = f'{target_folder}/{just_path(entry_name)}'
+            if not is_folder(folder_name):
+                create_folder(folder_name)
+
+            with open(f'{target_folder}/{entry_name}', 'wb') as output_stream:
+                output_stream.write(read_entry(zip_file, manifest, entry_name))
+    return manifest
+
+
+# temp test harness ...
+
+
+# test code
+def main():
+    with CapturePackage('test_package.zip') as package:
+        package.write_text('test.sql', 'select 1;')
+        package.write_text('test#0001.json', '[[1, 2, 3]]' * 1000, row_count=1000)
+        checkpoint = package.checkpoint()
+        package.write_text('test#0002.json', '[[4, 5, 6]]' * 1000, row_count=1000)
+    logger.info(f'Package entries: {zipfile.ZipFile("test_package.zip").namelist()}')
+
+    # resume package from checkpoint; entries written after checkpoint are discarded
+    with CapturePackage('test_package.zip', checkpoint=checkpoint) as package:
+        package.write_text('test#0002.json', '[[7, 8, 9]]' * 1000, row_count=1000)
+    with zipfile.ZipFile('test_package.zip') as zip_file:
+        logger.info(f'Resumed package entries: {zip_file.namelist()}; test: {zip_file.testzip()}')
+
+    # packages written with any codec read back the same
+    for codec in ('store', 'deflate:1', 'bzip2', 'lzma', 'zstd', 'lz4'):
+        try:
+            with CapturePackage('test_package.zip', codec=codec) as package:
+                package.write_text('test#0001.json', '[[1, 2, 3]]' * 1000, row_count=1000)
+        except ValueError as e:
+            logger.info(f'Codec {codec}: {e}')
+            continue
+        text = read_package_entry('test_package.zip', 'test#0001.json')
+        is_match = text == '[[1, 2, 3]]' * 1000
+        logger.info(f'Codec {codec}: {file_size("test_package.zip"):,} bytes; round trip: {is_match}')
+
+
+# test code
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()
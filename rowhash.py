@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+rowhash.py
+
+Rowhash CDC: detects new, changed and (optionally) deleted rows for tables without timestamps.
+
+Each captured row's pk and column values are hashed and compared against the table's row hash index
+from its last capture. Only new and changed rows are captured.
+
+Row hash index files (per table, in state_folder):
+- <table>.rowhash - sorted fixed width (pk digest, row hash) records; memory-mapped and binary searched
+- <table>.rowkeys - pk values (jsonpickle, one line per index record) in index record order
+
+A table's new index is built as rows are captured: records are sorted in bounded size runs and the runs
+merged into the new index, so memory use is bounded regardless of table size. Merging the new index with
+the last index identifies deleted keys. New index files replace the last index when commit() is called
+after the capture job succeeds.
+
+Each index has a fingerprint (record count and digest of its records) saved as the table history's
+last_rowhash. A last index that doesn't match the table's last_rowhash (eg. a job whose history was saved
+but whose new index wasn't committed) is ignored so every row is captured vs changes being missed.
+"""
+
+
+# standard lib
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+
+
+# common lib
+from common import delete_file
+from common import file_size
+from common import from_jsonpickle
+from common import is_file
+from common import log_setup
+from common import log_session_info
+from common import to_jsonpickle
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# index records: pk digest, row hash
+digest_size = 16
+index_record = struct.Struct(f'{digest_size}s{digest_size}s')
+
+# sort run records: pk digest, row hash, pk value length (followed by pk value)
+run_record = struct.Struct(f'{digest_size}s{digest_size}sI')
+
+
+def digest(values):
+    """Return a fixed size digest of a sequence of column values."""
+    return hashlib.blake2b(repr(tuple(values)).encode('UTF8'), digest_size=digest_size).digest()
+
+
+class RowHashIndex:
+
+    """
+    Row hash index of a table's pk digests and row hashes from its last capture. Thread safe so a table's
+    partitions can share an index.
+
+    file_name: index file name without extension
+    pk_positions: positions of pk columns in captured rows
+    column_count: number of leading row values hashed (excludes extended udp columns)
+    is_rebuild: ignore last capture's index (eg. target table is being rebuilt) so every row is captured; the new
+    index replaces the last index on commit()
+    last_fingerprint: fingerprint of the last index committed (table history's last_rowhash); a last index that
+    doesn't match is ignored
+    """
+
+    def __init__(
+        self, file_name, pk_positions, column_count, run_size=1_000_000, is_rebuild=False, last_fingerprint=None
+    ):
+        self.file_name = file_name
+        self.index_file_name = f'{file_name}.rowhash'
+        self.keys_file_name = f'{file_name}.rowkeys'
+        self.pk_positions = pk_positions
+        self.column_count = column_count
+        self.run_size = run_size
+
+        # last capture's index
+        self.index_file = None
+        self.index = None
+        self.record_count = 0
+
+        # new index's sort runs
+        self.run = []
+        self.run_file_names = []
+
+        # rows hashed and rows captured as new or changed
+        self.row_count = 0
+        self.change_count = 0
+
+        # new index's fingerprint (saved as table history's last_rowhash); set by finish()
+        self.fingerprint = None
+
+        self.lock = threading.Lock()
+        if is_rebuild:
+            logger.info(f'Rowhash: rebuild; ignoring last index ({self.index_file_name})')
+        else:
+            self.open(last_fingerprint)
+
+    def open(self, last_fingerprint=None):
+        """Memory-map last capture's index (if any); ignores an index that doesn't match last_fingerprint."""
+        if is_file(self.index_file_name) and file_size(self.index_file_name):
+            self.index_file = open(self.index_file_name, 'rb')
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.record_count = len(self.index) // index_record.size
+
+        if last_fingerprint and self.last_fingerprint() != last_fingerprint:
+            logger.warning(f'Rowhash: last index ({self.index_file_name}) not last committed index; ignoring it')
+            self.close()
+            self.record_count = 0
+
+    def last_fingerprint(self):
+        """Return last capture's index fingerprint: record count and digest of its records."""
+        hasher = hashlib.blake2b(digest_size=digest_size)
+        if self.index is not None:
+            hasher.update(self.index)
+        return f'{self.record_count}:{hasher.hexdigest()}'
+
+    def close(self):
+        """Release last capture's index and remove any sort runs."""
+        if self.index is not None:
+            self.index.close()
+            self.index_file.close()
+            self.index = None
+        for run_file_name in self.run_file_names:
+            delete_file(run_file_name)
+        self.run_file_names = []
+
+    def lookup(self, pk_digest, low=0):
+        """Return (row hash or None, position) of pk digest in last capture's index; searches from position low."""
+        high = self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * index_record.size
+            if self.index[offset:offset + digest_size] < pk_digest:
+                low = middle + 1
+            else:
+                high = middle
+        offset = low * index_record.size
+        if low < self.record_count and self.index[offset:offset + digest_size] == pk_digest:
+            return self.index[offset + digest_size:offset + index_record.size], low
+        return None, low
+
+    def changes(self, rows):
+        """Return new and changed rows; adds all rows to the table's new index."""
+        records = []
+        for row in rows:
+            pk_values = [row[position] for position in self.pk_positions]
+            records.append((digest(pk_values), digest(row[:self.column_count]), to_jsonpickle(pk_values), row))
+
+        # look up rows in pk digest order so each search can start from last match's position
+        changed_rows = []
+        position = 0
+        for pk_digest, row_hash, pk_value, row in sorted(records, key=lambda record: record[0]):
+            if self.index is not None:
+                last_row_hash, position = self.lookup(pk_digest, position)
+            else:
+                last_row_hash = None
+            if last_row_hash != row_hash:
+                changed_rows.append(row)
+
+        with self.lock:
+            self.row_count += len(rows)
+            self.change_count += len(changed_rows)
+            self.run.extend([record[:3] for record in records])
+            if len(self.run) >= self.run_size:
+                self.save_run()
+
+        return changed_rows
+
+    def save_run(self):
+        """Sort and save current run of new index records."""
+        run_file_name = f'{self.index_file_name}.run{len(self.run_file_names):04}'
+        with open(run_file_name, 'wb') as output_stream:
+            for pk_digest, row_hash, pk_value in sorted(self.run):
+                pk_value = pk_value.encode('UTF8')
+                output_stream.write(run_record.pack(pk_digest, row_hash, len(pk_value)))
+                output_stream.write(pk_value)
+        self.run_file_names.append(run_file_name)
+        self.run = []
+
+    @staticmethod
+    def load_run(run_file_name):
+        """Yield (pk digest, row hash, pk value) records from a saved run."""
+        with open(run_file_name, 'rb') as input_stream:
+            while True:
+                header = input_stream.read(run_record.size)
+                if not header:
+                    break
+                pk_digest, row_hash, pk_value_size = run_record.unpack(header)
+                yield pk_digest, row_hash, input_stream.read(pk_value_size).decode('UTF8')
+
+    def last_keys(self):
+        """Yield (pk digest, pk value) of last capture's index records."""
+        if self.index is None:
+            return
+        with open(self.keys_file_name, encoding='UTF8') as input_stream:
+            for position, pk_value in enumerate(input_stream):
+                offset = position * index_record.size
+                yield self.index[offset:offset + digest_size], pk_value.rstrip('\n')
+
+    def finish(self):
+        """Save new index (pending commit) by merging sorted runs. Returns list of deleted keys (pk value lists)."""
+        runs = [self.load_run(run_file_name) for run_file_name in self.run_file_names]
+        runs.append(iter(sorted(self.run)))
+        self.run = []
+
+        deleted_keys = []
+        last_keys = self.last_keys()
+        last_key = next(last_keys, None)
+        last_digest = None
+        hasher = hashlib.blake2b(digest_size=digest_size)
+        record_count = 0
+        with open(f'{self.index_file_name}.new', 'wb') as index_stream:
+            with open(f'{self.keys_file_name}.new', 'w', encoding='UTF8') as keys_stream:
+                for pk_digest, row_hash, pk_value in heapq.merge(*runs):
+                    # duplicate pk values (eg. views without a unique pk) keep a single index record
+                    if pk_digest == last_digest:
+                        continue
+                    last_digest = pk_digest
+                    record = index_record.pack(pk_digest, row_hash)
+                    index_stream.write(record)
+                    hasher.update(record)
+                    record_count += 1
+                    keys_stream.write(f'{pk_value}\n')
+
+                    # keys in last index that sort before current key are no longer present
+                    while last_key and last_key[0] <= pk_digest:
+                        if last_key[0] < pk_digest:
+                            deleted_keys.append(from_jsonpickle(last_key[1]))
+                        last_key = next(last_keys, None)
+
+        # remaining last index keys are no longer present
+        while last_key:
+            deleted_keys.append(from_jsonpickle(last_key[1]))
+            last_key = next(last_keys, None)
+
+        self.fingerprint = f'{record_count}:{hasher.hexdigest()}'
+        self.close()
+        logger.info(f'Rowhash: {self.row_count:,} rows, {self.change_count:,} new/changed, {len(deleted_keys):,} deleted')
+        return deleted_keys
+
+    def commit(self):
+        """Replace last capture's index with new index; call after capture job succeeds."""
+        commit_index(self.file_name)
+
+
+def commit_index(file_name):
+    """Replace a table's last capture index with its new index (file_name without extension)."""
+    os.replace(f'{file_name}.rowhash.new', f'{file_name}.rowhash')
+    os.replace(f'{file_name}.rowkeys.new', f'{file_name}.rowkeys')
+
+
+# temp test harness ...
+
+
+# test code
+def main():
+    rows = [[key, f'value {key}'] for key in range(10)]
+    index = RowHashIndex('test', [0], 2, run_size=4)
+    logger.info(f'First capture: {len(index.changes(rows))} changes; deleted keys: {index.finish()}')
+    index.commit()
+
+    rows = rows[2:] + [[10, 'value 10']]
+    rows[0][1] = 'changed'
+    index = RowHashIndex('test', [0], 2, run_size=4)
+    logger.info(f'Next capture: {index.changes(rows)} changes; deleted keys: {index.finish()}')
+    index.commit()
+
+    # an index that doesn't match table history's last_rowhash is ignored; every row is captured
+    index = RowHashIndex('test', [0], 2, run_size=4, last_fingerprint='0:stale')
+    logger.info(f'Stale index capture: {len(index.changes(rows))} changes; deleted keys: {index.finish()}')
+    index.commit()
+
+
+# test code
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()
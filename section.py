@@ -113,6 +113,21 @@ class SectionDatabase(Section):
         # non-standard options used at connection time
         self.options = ''
 
+        # rows capture's stream cursors transfer from server per round trip (default 10000)
+        self.itersize = ''
+
+        # capture's source load governor (blank = unlimited): rows and (estimated) bytes fetched per second and
+        # concurrent table/partition selects; governor_hours are hours of day (0-23) limits apply (blank = always)
+        self.max_rows_per_second = ''
+        self.max_bytes_per_second = ''
+        self.max_concurrent_queries = ''
+        self.governor_hours = ''
+
+        # readable replicas (host[:port] list) capture connections are routed across; replica_policy is
+        # round_robin (default) or least_latency; tables may be pinned to a replica via [table:*] replica
+        self.replicas = ''
+        self.replica_policy = ''
+
         # optional command executed at connection time
         self.on_connect = ''
 
@@ -219,6 +234,44 @@ class SectionProject(Section):
         self.options = ''
         self.batch_size = ''
 
+        # target batch size in bytes used to size batches when batch_size not specified (default 64M)
+        self.batch_bytes = ''
+
+        # capture batch file format: columnar (default) or jsonpickle (legacy list of row lists)
+        self.batch_format = ''
+
+        # capture (source connections) and stage (target connections) process tables in parallel across up to
+        # max_parallel_tables connections (default 1)
+        self.max_parallel_tables = ''
+
+        # stage loads each table's batches in parallel across up to max_parallel_loads target connections (default 1)
+        self.max_parallel_loads = ''
+
+        # stage workers (threads) that claim capture files from stage_arrival_queue (default 1); stage processes on
+        # other hosts may share the queue. Workers lease a file's dataset for stage_lease_seconds (default 300),
+        # renewing the lease while staging. Optional stage_shard (<index>/<count>, eg. 0/4) limits a process's
+        # workers to datasets in its shard. A file that fails to stage is retried after stage_retry_seconds
+        # (default 60, doubling with each consecutive failure up to an hour); workers stage other datasets meanwhile.
+        self.stage_workers = ''
+        self.stage_lease_seconds = ''
+        self.stage_shard = ''
+        self.stage_retry_seconds = ''
+
+        # threads that serialize and write fetched capture batches while next batch is fetched (default 2)
+        self.pipeline_workers = ''
+
+        # capture package codec: store, deflate (default), bzip2, lzma, zstd, lz4; optional :<level>, eg. zstd:3
+        self.package_codec = ''
+
+        # set to 1 to checkpoint captured batches so an interrupted capture job resumes where it left off
+        self.checkpoint = ''
+
+        # continuous capture: run micro-batch capture cycles every continuous_interval seconds (blank = scheduled jobs)
+        # with source connections, config, schemas and generated selects kept warm across continuous_cycles cycles
+        # (blank = until SIGINT/SIGTERM or a <session>/<dataset>/capture.stop file stops capture between cycles)
+        self.continuous_interval = ''
+        self.continuous_cycles = ''
+
         # cloud and database resources
         self.key_vault = ''
         self.database_source = ''
@@ -228,6 +281,9 @@ class SectionProject(Section):
         self.blobstore_landing = ''
         self.blobstore_archive = ''
         self.blobstore_recovery = ''
+
+        # upload a full recovery state snapshot every recovery_snapshot_jobs jobs; deltas in between (default 24)
+        self.recovery_snapshot_jobs = ''
         self.blobstore_system = ''
 
 
@@ -368,3 +424,18 @@ class SectionTable(Section):
         self.where = ''
         self.order = ''
         self.delete_when = ''
+
+        # pin table's capture connections to a database_source replica (host[:port])
+        self.replica = ''
+
+        # set to 1 to skip timestamp/rowversion cdc tables whose cheap exists probe finds no changes
+        self.probe = ''
+
+        # rowhash cdc: set to 1 to capture keys of rows deleted since table's last capture
+        self.rowhash_deletes = ''
+
+        # split very large tables into partition_count key ranges (pk or timestamp column) extracted concurrently
+        # partition_method: ntile (default; evenly sized partitions) or range (evenly spaced min/max values)
+        self.partition_column = ''
+        self.partition_count = ''
+        self.partition_method = ''
@@ -14,25 +14,30 @@ Depending on CDC type of table:
 
 
 # standard lib
-import glob
+import concurrent.futures
+import contextlib
+import copy
+import datetime
+import decimal
 import logging
-import pathlib
-import zipfile
+import time
 
 
 # common lib
 from common import clear_folder
-from common import is_file
+from common import from_jsonpickle
 from common import just_file_name
 from common import just_file_stem
-from common import load_jsonpickle
-from common import load_text
 from common import now
+from common import split
 
 
 # udp lib
+import batch
 import cdc_merge
 import database
+import package
+import stagequeue
 import tableschema
 import udp
 
@@ -40,6 +45,7 @@ import udp
 # udp classes
 from blobstore import BlobStore
 from daemon import Daemon
+from event import Events
 
 
 # 3rd party lib
@@ -50,26 +56,121 @@ from daemon import Daemon
 logger = logging.getLogger(__name__)
 
 
-def convert_data_types(rows, table_schema):
-    for column_index, column in enumerate(table_schema.columns.values()):
-        # print(f'{column.column_name} ({column.data_type}) (index {column_index})')
-
-        # convert all date, datetime, time strings to datetime values
-        # if column.data_type in ('date', 'datetime', 'datetime2', 'smalldatetime', 'time'):
-        # 	# print(f'Converting {column.column_name} ({column.data_type}) (index {column_index}) to datetime')
-        # 	for row in rows:
-        # 		if row[column_index] is not None:
-        # 			# shorten high precision values to avoid ODBC Datetime field overflow errors
-        # 			if len(row[column_index]) > 23:
-        # 				row[column_index] = row[column_index][0:25]
-        # 			row[column_index] = arrow.get(row[column_index]).datetime
-
-        # make sure nvarchar are really strings
-        if column.data_type == "nvarchar":
-            # print(f'Converting {column.column_name} ({column.data_type}) (index {column_index}) to str')
-            for row in rows:
-                if row[column_index] is not None:
-                    row[column_index] = str(row[column_index])
+# target data types whose values must be str
+str_data_types = ("char", "nchar", "nvarchar", "varchar")
+
+# fractional second digits of target datetime/time data types; datetime2 columns are created as datetime2(7)
+datetime_precisions = dict(datetime=3, datetime2=7, smalldatetime=0, time=7)
+
+
+def convert_str(value):
+    """Make sure nvarchar (and other str column) values are really strings."""
+    return value if type(value) is str else str(value)
+
+
+def parse_datetime(text):
+    """Return datetime from ISO format text; digits beyond microseconds are truncated."""
+    # shorten high precision values (eg. datetime2(7)) to avoid ODBC datetime field overflow errors
+    if len(text) > 26 and text[19:20] == ".":
+        text = text[:26]
+    return datetime.datetime.fromisoformat(text)
+
+
+def datetime_converter(data_type, precision):
+    """Return converter of datetime/time (or ISO text) values trimmed to precision fractional second digits."""
+    trim = 10 ** (6 - precision) if precision < 6 else 0
+
+    def convert(value):
+        if type(value) is str and data_type == "time":
+            value = datetime.time.fromisoformat(value[:15])
+        elif type(value) is str:
+            value = parse_datetime(value)
+        if data_type == "smalldatetime":
+            return value.replace(second=0, microsecond=0)
+        if trim and value.microsecond % trim:
+            microsecond = value.microsecond - value.microsecond % trim
+            value = value.replace(microsecond=microsecond)
+        return value
+
+    return convert
+
+
+def convert_date(value):
+    """Convert date text and datetime values to date values."""
+    if type(value) is str:
+        return datetime.date.fromisoformat(value[:10])
+    elif isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def decimal_converter(scale):
+    """Return converter of numeric values to decimals rounded to (optional) scale digits."""
+    exponent = decimal.Decimal(1).scaleb(-scale) if scale is not None else None
+
+    def convert(value):
+        if type(value) is not decimal.Decimal:
+            value = decimal.Decimal(str(value))
+        # non-finite values (NaN, Infinity) have no digits to round; pass them through
+        if not value.is_finite():
+            return value
+        if exponent is not None and value.as_tuple().exponent < -scale:
+            value = value.quantize(exponent, rounding=decimal.ROUND_HALF_UP)
+        return value
+
+    return convert
+
+
+def column_converter(column):
+    """Return function that converts a column's non-null values to its target data type; None if not required."""
+    data_type = column.data_type.lower()
+    if data_type in str_data_types:
+        return convert_str
+    elif data_type in datetime_precisions:
+        precision = datetime_precisions[data_type]
+        if data_type == "time" and column.datetime_precision not in (None, ""):
+            precision = int(column.datetime_precision)
+
+        # captured time values only need converting when their target trims their precision
+        if data_type == "time" and precision >= 6:
+            return None
+        return datetime_converter(data_type, precision)
+    elif data_type == "date":
+        return convert_date
+    elif data_type in ("decimal", "numeric"):
+        scale = column.numeric_scale
+        return decimal_converter(int(scale) if scale not in (None, "") else None)
+    else:
+        return None
+
+
+class ConversionPlan:
+
+    """
+    Table schema (converted to target data types) compiled once into the minimal list of column converters its
+    batches need. Converters are applied to non-null values as batches are decoded (see batch.decode_batch()).
+    """
+
+    def __init__(self, table_schema):
+        self.schema_key = self.table_schema_key(table_schema)
+        self.column_names = []
+        self.converters = []
+        for column_index, column in enumerate(table_schema.columns.values()):
+            converter = column_converter(column)
+            if converter:
+                self.column_names.append(column.column_name)
+                self.converters.append((column_index, converter))
+
+    def __str__(self):
+        return ", ".join(self.column_names) or "no conversions"
+
+    @staticmethod
+    def table_schema_key(table_schema):
+        """Return the column attributes that determine a table schema's conversion plan."""
+        return tuple(
+            (column_name, column.data_type, column.numeric_scale, column.datetime_precision)
+            for column_name, column in table_schema.columns.items()
+        )
 
 
 """
@@ -160,6 +261,28 @@ class StageDaemon(Daemon):
 
     """Daemon class integrates core config, option, and schedule functionality."""
 
+    def __init__(self, project_file=None):
+        # inherit and extend default __init__ behavior
+        super().__init__(project_file)
+
+        # capture package being staged; entries are read from package on demand
+        self.package_reader = None
+
+        # target connections that stage a package's tables in parallel (project max_parallel_tables)
+        self.table_pool = None
+
+        # target connections that load a table's batches in parallel (project max_parallel_loads)
+        self.load_pool = None
+
+        # staged file's metrics, eg. each batch's load rate
+        self.events = None
+
+        # tables' conversion plans indexed by <dataset>.<table>; cached across staged files (jobs)
+        self.conversion_plans = dict()
+
+        # worker's view of the stage queue tables; claims queued files by leasing their datasets
+        self.stage_queue = None
+
     def start(self):
         super().start()
 
@@ -189,197 +312,414 @@ class StageDaemon(Daemon):
         bs_archive.get(local_work_file_name, archive_capture_file_blob_name)
         bs_archive.disconnect()
 
-        # unzip the capture file we retrieved from archive
-        with zipfile.ZipFile(local_work_file_name) as zf:
-            zf.extractall(self.work_folder)
-
         # create the file's dataset_name schema if missing
         self.target_db_conn.create_schema(dataset_name)
 
-        # process all table files in our work folder
-        for file_name in sorted(glob.glob(f"{self.work_folder}/*.table")):
-            table_name = just_file_stem(file_name)
-            logger.info(f"Processing {table_name} ...")
-
-            # always load table objects
-            table_object = load_jsonpickle(f"{self.work_folder}/{table_name}.table")
-
-            # skip table if no schema file exists
-            schema_file_name = f"{self.work_folder}/{table_name}.schema"
-            if not is_file(schema_file_name):
-                logger.warning(f"Table skipped ({table_name}); schema file not found")
-                continue
-
-            # always load table schema
-            table_schema = load_jsonpickle(schema_file_name)
-
-            # always load table pk
-            table_pk = load_text(f"{self.work_folder}/{table_name}.pk").strip()
+        # track staged file's metrics
+        self.events = Events(
+            f"{self.work_folder}/stage.log", dataset_id=dataset_name, job_id=job_id
+        )
 
-            # extend table object with table table and column names from table_schema object
-            table_object.table_name = table_name
-            table_object.column_names = [
-                column_name for column_name in table_schema.columns
+        # stage tables reading their entries lazily, straight from the capture package
+        # Note: Entries are decoded one at a time (per package's manifest) vs extracting package to work folder.
+        with package.PackageReader(local_work_file_name) as self.package_reader:
+            logger.info(f"Capture package codec: {self.package_reader.codec}")
+            table_entry_names = self.package_reader.names("*.table")
+            table_names = [
+                just_file_stem(entry_name) for entry_name in table_entry_names
             ]
+            self.stage_tables(dataset_name, table_names)
+
+        # all tables staged; save staged file's metrics
+        self.events.save()
+
+    def stage_tables(self, dataset_name, table_names):
+        """
+        Stage a capture package's tables, in parallel across the table pool's connections (project
+        max_parallel_tables) when present. Tables are independent; each table's drop/create, load, merge and temp
+        table cleanup run in order on one connection.
+
+        A failed table cancels queued tables and fails the package once in-flight tables finish, so a package is only
+        marked staged (advancing its dataset's pending queue) once all of its tables succeed. Restaging a package
+        reloads all of its tables.
+        """
+        if not self.table_pool or len(table_names) < 2:
+            for table_name in table_names:
+                self.stage_table(self.target_db_conn, dataset_name, table_name)
+            return
+
+        max_workers = min(self.table_pool.size, len(table_names))
+        logger.info(
+            f"Staging {len(table_names)} tables across {max_workers} connections"
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict()
+            for table_name in table_names:
+                future = executor.submit(
+                    self.stage_pooled_table, dataset_name, table_name
+                )
+                futures[future] = table_name
+
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except Exception:
+                # a failed table fails the package; don't start tables that are still queued
+                logger.error(f"Table {futures[future]} failed; cancelling queued tables")
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def stage_pooled_table(self, dataset_name, table_name):
+        """Stage a table over a connection borrowed from the table pool."""
+        with self.table_pool.connection() as (db, db_engine):
+            self.stage_table(db_engine, dataset_name, table_name)
+
+    def stage_table(self, db_engine, dataset_name, table_name):
+        """Stage a table's captured entries over db_engine (target database connection)."""
+        logger.info(f"Processing {table_name} ...")
+
+        # always load table objects
+        table_object = from_jsonpickle(self.package_reader.read_text(f"{table_name}.table"))
+
+        # skip tables whose contents haven't changed since their last capture (filehash cdc)
+        if self.package_reader.exists(f"{table_name}.unchanged"):
+            logger.info(f"Table skipped ({table_name}); table unchanged")
+            return
+
+        # skip table if no schema file exists
+        schema_entry_name = f"{table_name}.schema"
+        if not self.package_reader.exists(schema_entry_name):
+            logger.warning(f"Table skipped ({table_name}); schema file not found")
+            return
+
+        # always load table schema
+        table_schema = from_jsonpickle(self.package_reader.read_text(schema_entry_name))
+
+        # always load table pk
+        table_pk = self.package_reader.read_text(f"{table_name}.pk", "").strip()
+
+        # extend table object with table table and column names from table_schema object
+        table_object.table_name = table_name
+        table_object.column_names = [column_name for column_name in table_schema.columns]
+
+        # if drop_table, drop table; the package's other tables are staged independently
+        if table_object.drop_table:
+            logger.info(f"Table drop request; table_drop=1")
+            db_engine.drop_table(dataset_name, table_name)
+            return
+
+        # convert table schema to our target database and add extended column definitions
+        extended_definitions = "udp_jobid int, udp_timestamp datetime2".split(",")
+        convert_to_mssql(table_schema, extended_definitions)
+
+        # Future: support custom staging table type overrides
+        # [table].table_type = < blank > | standard, columnar, memory, columnar - memory
+
+        # handle cdc vs non-cdc table workflows differently
+        logger.debug(
+            f"{table_name}.cdc={table_object.cdc}, timestamp={table_object.timestamp}"
+        )
+        if not table_object.cdc or table_object.cdc.lower() == "none" or not table_pk:
+            # if table cdc=none, drop the target table
+            logger.info(f"Table cdc=[{table_object.cdc}]; rebuilding table")
+            db_engine.drop_table(dataset_name, table_name)
+
+            # then re-create target table with latest schema
+            # FUTURE: Add udp_pk, udp_nk, udp_nstk and other extended columns
+            logger.info(f"Re-creating non-CDC table: {dataset_name}.{table_name}")
+            db_engine.create_table_from_table_schema(
+                dataset_name, table_name, table_schema, extended_definitions
+            )
 
-            # if drop_table, drop table and exit
-            if table_object.drop_table:
-                logger.info(f"Table drop request; table_drop=1")
-                self.target_db_conn.drop_table(dataset_name, table_name)
-                return
-
-            # convert table schema to our target database and add extended column definitions
-            extended_definitions = "udp_jobid int, udp_timestamp datetime2".split(",")
-            convert_to_mssql(table_schema, extended_definitions)
+            # no cdc in effect for this table - insert directly to target table
+            self.load_batches(
+                db_engine, dataset_name, table_name, table_name, table_schema
+            )
 
-            # Future: support custom staging table type overrides
-            # [table].table_type = < blank > | standard, columnar, memory, columnar - memory
+        else:
+            # table has cdc updates
+
+            # apply capture's schema change to existing target table; capture recaptures rebuilt tables in full
+            schema_change_entry_name = f"{table_name}.schema_change"
+            if self.package_reader.exists(
+                schema_change_entry_name
+            ) and db_engine.does_table_exist(dataset_name, table_name):
+                schema_change = from_jsonpickle(
+                    self.package_reader.read_text(schema_change_entry_name)
+                )
+                if schema_change["action"] == "alter":
+                    logger.info(
+                        f"Schema change; adding columns to {dataset_name}.{table_name}: {schema_change['added_columns']}"
+                    )
+                    db_engine.add_table_columns(
+                        dataset_name,
+                        table_name,
+                        table_schema,
+                        schema_change["added_columns"],
+                    )
+                elif schema_change["action"] == "rebuild":
+                    logger.info(
+                        f"Schema change; rebuilding table: {dataset_name}.{table_name}"
+                    )
+                    db_engine.drop_table(dataset_name, table_name)
 
-            # handle cdc vs non-cdc table workflows differently
-            logger.debug(
-                f"{table_name}.cdc={table_object.cdc}, timestamp={table_object.timestamp}"
-            )
-            if (
-                not table_object.cdc
-                or table_object.cdc.lower() == "none"
-                or not table_pk
-            ):
-                # if table cdc=none, drop the target table
-                logger.info(f"Table cdc=[{table_object.cdc}]; rebuilding table")
-                self.target_db_conn.drop_table(dataset_name, table_name)
-
-                # then re-create target table with latest schema
+            # create target table if it doesn't exist
+            if not db_engine.does_table_exist(dataset_name, table_name):
                 # FUTURE: Add udp_pk, udp_nk, udp_nstk and other extended columns
-                logger.info(f"Re-creating non-CDC table: {dataset_name}.{table_name}")
-                self.target_db_conn.create_table_from_table_schema(
+                logger.info(f"Creating table: {dataset_name}.{table_name}")
+                db_engine.create_table_from_table_schema(
                     dataset_name, table_name, table_schema, extended_definitions
                 )
 
-                # no cdc in effect for this table - insert directly to target table
-                work_folder_obj = pathlib.Path(self.work_folder)
-                batch_number = 0
-                for json_file in sorted(work_folder_obj.glob(f"{table_name}#*.json")):
-                    # load rows from json file
-                    # input_stream = open(json_file)
-                    # rows = json.load(input_stream)
-                    # input_stream.close()
-                    rows = load_jsonpickle(json_file)
-
-                    # insert/upsert/merge *.json into target tables
-                    if not rows:
-                        logger.info(f"Table {table_name} has 0 rows; no updates")
-                    else:
-                        batch_number += 1
-                        logger.info(
-                            f"Job {job_id}, batch {batch_number}, table {table_name}"
-                        )
-                        self.progress_message(
-                            f"loading {just_file_stem(capture_file_name)}({table_name}.{batch_number:04}) ..."
-                        )
-
-                        # convert date/datetime columns to date/datetime values
-                        convert_data_types(rows, table_schema)
-                        self.target_db_conn.bulk_insert_into_table(
-                            dataset_name, table_name, table_schema, rows
-                        )
-
-            else:
-                # table has cdc updates
-
-                # create target table if it doesn't exist
-                if not self.target_db_conn.does_table_exist(dataset_name, table_name):
-                    # FUTURE: Add udp_pk, udp_nk, udp_nstk and other extended columns
-                    logger.info(f"Creating table: {dataset_name}.{table_name}")
-                    self.target_db_conn.create_table_from_table_schema(
-                        dataset_name, table_name, table_schema, extended_definitions
-                    )
+            # create temp table to receive captured changes
+            # FUTURE: Create a database wrapper function for creating 'portable' temp table names vs hard-coding '#'.
+            temp_table_name = f"_{table_name}"
+            db_engine.drop_table(dataset_name, temp_table_name)
+            db_engine.create_table_from_table_schema(
+                dataset_name, temp_table_name, table_schema, extended_definitions
+            )
 
-                # create temp table to receive captured changes
-                # FUTURE: Create a database wrapper function for creating 'portable' temp table names vs hard-coding '#'.
-                temp_table_name = f"_{table_name}"
-                self.target_db_conn.drop_table(dataset_name, temp_table_name)
-                self.target_db_conn.create_table_from_table_schema(
-                    dataset_name, temp_table_name, table_schema, extended_definitions
+            # insert captured updates into temp table; an empty batch means table has no updates
+            # Note: Temp table is merged only after all of its batches have been loaded and committed.
+            row_counts = self.load_batches(
+                db_engine, dataset_name, table_name, temp_table_name, table_schema
+            )
+            if all(row_counts):
+                # merge (upsert) temp table to target table
+                merge_cdc = cdc_merge.MergeCDC(table_object, extended_definitions)
+                sql_command = merge_cdc.merge(dataset_name, table_pk)
+
+                # TODO: Capture SQL commands in a sql specific log.
+                logger.debug(sql_command)
+                db_engine.cursor.execute(sql_command)
+
+            # delete rows whose keys were deleted from source (rowhash cdc)
+            deletes_entry_name = f"{table_name}.deletes"
+            if self.package_reader.exists(deletes_entry_name):
+                self.delete_keys(
+                    db_engine,
+                    dataset_name,
+                    table_object,
+                    table_schema,
+                    table_pk,
+                    deletes_entry_name,
                 )
 
-                # insert captured updates into temp table
-                work_folder_obj = pathlib.Path(self.work_folder)
-                batch_number = 0
-                for json_file in sorted(work_folder_obj.glob(f"{table_name}#*.json")):
-                    # load rows from json file
-                    # input_stream = open(json_file)
-                    # rows = json.load(input_stream)
-                    # input_stream.close()
-                    rows = load_jsonpickle(json_file)
-
-                    # insert/upsert/merge *.json into target tables
-                    if not rows:
-                        logger.info(f"Table {table_name} has 0 rows; no updates")
-                        break
-                    else:
-                        batch_number += 1
-                        logger.info(
-                            f"Job {job_id}, batch {batch_number}, table {table_name}"
-                        )
-                        self.progress_message(
-                            f"loading {just_file_stem(capture_file_name)}({table_name}.{batch_number:04}) ..."
-                        )
-
-                        # convert date/datetime columns to date/datetime values
-                        convert_data_types(rows, table_schema)
-                        self.target_db_conn.bulk_insert_into_table(
-                            dataset_name, temp_table_name, table_schema, rows
-                        )
-                else:
-                    # merge (upsert) temp table to target table
-                    merge_cdc = cdc_merge.MergeCDC(table_object, extended_definitions)
-                    sql_command = merge_cdc.merge(dataset_name, table_pk)
-
-                    # TODO: Capture SQL commands in a sql specific log.
-                    logger.debug(sql_command)
-                    self.target_db_conn.cursor.execute(sql_command)
-
-                # drop temp table after merge
-                self.target_db_conn.drop_table(dataset_name, temp_table_name)
+            # drop temp table after merge
+            db_engine.drop_table(dataset_name, temp_table_name)
+
+    def load_batches(
+        self, db_engine, dataset_name, table_name, load_table_name, table_schema
+    ):
+        """
+        Bulk insert table_name's batch entries into load_table_name (target or temp table). Returns list of batch
+        row counts in batch order. Batches load over db_engine (the table's connection) unless there's a load pool.
+
+        Batches are read from the capture package and decoded one at a time as they're loaded, so loading starts with
+        the package's first batch. Batches are inserted in parallel across the load pool's connections (project
+        max_parallel_loads) and each batch commits on its own connection as soon as it is inserted. A failed batch
+        fails its table once in-flight batches finish; queued batches are cancelled. Restaging a capture file drops
+        and reloads its tables.
+        """
+        plan = self.conversion_plan(dataset_name, table_name, table_schema)
+        load_args = (dataset_name, load_table_name, table_schema, plan.converters)
+        if not self.load_pool:
+            batch_entries = self.package_reader.entries(f"{table_name}#*.json")
+            return [
+                self.load_batch(db_engine, *load_args, batch_name, data)
+                for batch_name, data in batch_entries
+            ]
 
-    def process_next_file_to_stage(self):
+        # pooled workers read their batch's entry when they start loading it
+        batch_names = self.package_reader.names(f"{table_name}#*.json")
+        max_workers = min(self.load_pool.size, max(1, len(batch_names)))
+        logger.info(
+            f"Loading {len(batch_names)} {table_name} batches across {max_workers} connections"
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for batch_name in batch_names:
+                pooled_args = (*load_args, batch_name)
+                futures.append(executor.submit(self.load_pooled_batch, *pooled_args))
+
+            try:
+                return [future.result() for future in futures]
+            except Exception:
+                # a failed batch fails the table; don't start batches that are still queued
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def load_pooled_batch(self, *args):
+        """Load a batch over a connection borrowed from the load pool."""
+        batch_name = args[-1]
+        data = self.package_reader.read(batch_name)
+        with self.load_pool.connection() as (db, db_engine):
+            return self.load_batch(db_engine, *args, data)
+
+    def load_batch(
+        self,
+        db_engine,
+        dataset_name,
+        load_table_name,
+        table_schema,
+        converters,
+        entry_name,
+        data,
+    ):
+        """Bulk insert a batch entry's rows into load_table_name and record its load rate. Returns row count."""
+        batch_name = just_file_stem(entry_name)
+
+        # convert values to their target data types as batch is decoded
+        rows = batch.decode_batch(data.decode("UTF8"), converters)
+        if not rows:
+            logger.info(f"Batch {batch_name} has 0 rows; no updates")
+            return 0
+
+        self.progress_message(f"loading {batch_name} ...")
+        start_time = time.perf_counter()
+        db_engine.bulk_insert_into_table(
+            dataset_name, load_table_name, table_schema, rows
+        )
 
-        # any new arrivals that we can process? job_id=1 or next job in sequence?
-        cursor = self.target_db_conn.execute("select_from_stage_arrival_queue")
-        row = cursor.fetchone()
-        if not row:
-            return False
-        else:
-            # get blob name we should fetch for staging
-            logger.info(f"Found next file to stage: {row}")
-            archive_file_name = row.archive_file_name
+        run_time = time.perf_counter() - start_time
+        row_rate = len(rows) / max(run_time, 0.000001)
+        logger.info(
+            f"Loaded {batch_name}: {len(rows):,} rows in {run_time:.2f} secs ({row_rate:,.0f} rows/sec)"
+        )
+        self.events.add(batch_name, "load", run_time, len(rows), len(data))
+        return len(rows)
+
+    def conversion_plan(self, dataset_name, table_name, table_schema):
+        """Return table's conversion plan; cached plans are recompiled when their table's schema changes."""
+        plan_key = f"{dataset_name}.{table_name}".lower()
+        plan = self.conversion_plans.get(plan_key)
+        if not plan or plan.schema_key != ConversionPlan.table_schema_key(table_schema):
+            plan = ConversionPlan(table_schema)
+            self.conversion_plans[plan_key] = plan
+            logger.info(f"Conversion plan ({table_name}): {plan}")
+        return plan
+
+    def delete_keys(
+        self,
+        db_engine,
+        dataset_name,
+        table_object,
+        table_schema,
+        table_pk,
+        deletes_entry_name,
+    ):
+        """Delete target table rows whose keys are in a captured batch of deleted keys."""
+        table_name = table_object.table_name
+
+        # deleted keys have the table's pk columns
+        pk_schema = tableschema.TableSchema(table_name, [])
+        for column_name in split(table_pk):
+            pk_schema.columns[column_name] = table_schema.columns[column_name]
+        plan = self.conversion_plan(dataset_name, f"{table_name}_deletes", pk_schema)
+        deletes_text = self.package_reader.read_text(deletes_entry_name)
+        rows = batch.decode_batch(deletes_text, plan.converters)
+        logger.info(f"Deleting {len(rows):,} deleted keys from {table_name}")
+
+        # load deleted keys into a temp table and delete matching target rows
+        temp_table_name = f"_{table_name}_deletes"
+        db_engine.drop_table(dataset_name, temp_table_name)
+        db_engine.create_table_from_table_schema(
+            dataset_name, temp_table_name, pk_schema
+        )
+        db_engine.bulk_insert_into_table(dataset_name, temp_table_name, pk_schema, rows)
 
-            job_id = int(archive_file_name.split(".")[0].rsplit("#", 1)[-1])
-            dataset_name = archive_file_name.partition("#")[0]
-            archive_file_blob_name = f"{dataset_name}/{archive_file_name}"
+        merge_cdc = cdc_merge.MergeCDC(table_object)
+        sql_command = merge_cdc.delete(dataset_name, table_pk)
+        logger.debug(sql_command)
+        db_engine.cursor.execute(sql_command)
+        db_engine.drop_table(dataset_name, temp_table_name)
 
-            # stage the file we found
-            self.progress_message(f"processing {archive_file_name} ...")
-            self.stage_file(archive_file_blob_name)
+    def process_next_file_to_stage(self):
+        """
+        Claim and stage the next queued capture file. Returns False when there's no file this worker can claim.
 
-            # after archive capture file processed then remove it from arrival/pending queues
-            self.target_db_conn.execute(
-                "delete_from_stage_arrival_queue", archive_file_name
-            )
-            self.target_db_conn.execute(
-                "delete_from_stage_pending_queue", archive_file_name
-            )
+        Files are claimed by leasing their dataset (see stagequeue.py), so a dataset's files stage one at a time in
+        job order while other workers stage other datasets. A failed file is recorded as failed and backs off (its
+        dataset stays leased until its retry time) while this worker moves on to other datasets' files.
+        """
 
-            # post the next file in sequence for dataset_name to pending queue
-            next_archive_file_name = f"{dataset_name}#{job_id+1:09}.zip"
-            row = dict(archive_file_name=next_archive_file_name)
-            self.target_db_conn.insert_into_table(
-                "udp_sys", "stage_pending_queue", **row
-            )
+        # any new arrivals that we can process? job_id=1 or next job in sequence of a dataset that isn't leased?
+        lease = self.stage_queue.claim()
+        if not lease:
+            return False
 
-            # return True to indicate we should continue processing queued up archived files
+        # get blob name we should fetch for staging
+        logger.info(f"Found next file to stage: {lease}")
+        archive_file_name = lease.archive_file_name
+        archive_file_blob_name = f"{lease.dataset_name}/{archive_file_name}"
+
+        # stage the file we found, renewing its dataset's lease while it stages
+        self.progress_message(f"processing {archive_file_name} ...")
+        try:
+            with self.stage_queue.renewing(lease):
+                self.stage_file(archive_file_blob_name)
+        except Exception:
+            logger.exception(f"Failed to stage {archive_file_name}")
+
+            # discard failed file's uncommitted target changes before staging other files
+            with contextlib.suppress(Exception):
+                self.target_db_conn.conn.rollback()
+            self.stage_queue.fail(lease)
             return True
 
+        # after archive capture file processed then remove it from arrival/pending queues, post the next file in
+        # sequence for its dataset to pending queue and release the dataset's lease
+        self.stage_queue.complete(lease)
+
+        # return True to indicate we should continue processing queued up archived files
+        return True
+
+    def run_stage_worker(self, stage_resource):
+        """Stage queued files until there are no more files to claim; leases are managed over their own connection."""
+        queue_db, queue_db_engine = database.connect(stage_resource)
+        self.stage_queue = stagequeue.StageQueue(
+            queue_db.conn,
+            lease_seconds=self.project.stage_lease_seconds,
+            shard=self.project.stage_shard,
+            retry_seconds=self.project.stage_retry_seconds,
+        )
+        logger.info(f"Stage worker: {self.stage_queue}")
+        try:
+            have_archive_file_to_process = True
+            while have_archive_file_to_process:
+                # keep processing archived files until there are no more to process
+                have_archive_file_to_process = self.process_next_file_to_stage()
+        finally:
+            queue_db.conn.close()
+            self.stage_queue = None
+
+    def run_stage_workers(self, stage_resource, stage_workers):
+        """
+        Stage queued files across stage_workers worker threads. Failed files back off without stopping their worker;
+        a failed worker (eg. a lost queue connection) doesn't stop the other workers; its error is raised once all
+        workers finish.
+        """
+        logger.info(f"Starting {stage_workers} stage workers")
+        with concurrent.futures.ThreadPoolExecutor(stage_workers) as executor:
+            futures = [
+                executor.submit(self.run_pooled_stage_worker, stage_resource, number)
+                for number in range(1, stage_workers + 1)
+            ]
+        for future in futures:
+            future.result()
+
+    def run_pooled_stage_worker(self, stage_resource, worker_number):
+        """Run a stage worker thread: a copy of daemon with its own target connection and work folder."""
+        worker = copy.copy(self)
+        worker.work_folder = f"{self.work_folder}/worker_{worker_number:02}"
+        db, worker.target_db_conn = database.connect(stage_resource)
+        try:
+            worker.run_stage_worker(stage_resource)
+        finally:
+            db.conn.close()
+
     def main(self):
         logger.info(
             f"{now():%Y-%m-%d %H:%M:%S}: Polling for queued files to process ..."
@@ -393,11 +733,44 @@ class StageDaemon(Daemon):
         self.target_db_conn = database.Database("mssql", db.conn)
         self.target_db_conn.use_database("udp_stage")
 
+        # stage tables and load table batches in parallel over pools of target connections that open udp_stage
+        stage_resource = copy.copy(db_resource)
+        stage_resource.database = "udp_stage"
+        if self.project.max_parallel_tables:
+            max_parallel_tables = int(self.project.max_parallel_tables)
+        else:
+            max_parallel_tables = 1
+        if max_parallel_tables > 1:
+            self.table_pool = database.ConnectionPool(
+                stage_resource, max_parallel_tables
+            )
+
+        if self.project.max_parallel_loads:
+            max_parallel_loads = int(self.project.max_parallel_loads)
+        else:
+            max_parallel_loads = 1
+        if max_parallel_loads > 1:
+            self.load_pool = database.ConnectionPool(stage_resource, max_parallel_loads)
+
+        # stage workers claim queued files via dataset leases and share this process's table and load pools
+        if self.project.stage_workers:
+            stage_workers = int(self.project.stage_workers)
+        else:
+            stage_workers = 1
+
         # process queued files, then exit and let daemon scheduler loop handle polling
-        have_archive_file_to_process = True
-        while have_archive_file_to_process:
-            # keep processing archived files until there are no more to process
-            have_archive_file_to_process = self.process_next_file_to_stage()
+        try:
+            if stage_workers > 1:
+                self.run_stage_workers(stage_resource, stage_workers)
+            else:
+                self.run_stage_worker(stage_resource)
+        finally:
+            if self.table_pool:
+                self.table_pool.close()
+                self.table_pool = None
+            if self.load_pool:
+                self.load_pool.close()
+                self.load_pool = None
 
 
 # main
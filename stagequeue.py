@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+stagequeue.py
+
+Stage work queue: stage workers (threads in one process and/or processes across hosts) claim capture files from
+stage_arrival_queue using per-dataset leases.
+
+- A dataset's capture files stage in job order: a worker only claims a dataset's next file (its job 1 or the file
+  posted to stage_pending_queue) and holds the dataset's lease while staging it, so job N+1 can't be claimed
+  until job N completes and posts it to stage_pending_queue
+- Different datasets are leased by different workers and stage in parallel
+- Leases expire after lease_seconds unless renewed; workers renew their lease while staging, so a crashed worker's
+  dataset is reclaimed (and its file restaged) once its lease expires
+- Completing a file is fenced by its lease token: a worker whose expired lease was reclaimed by another worker
+  can't complete (dequeue) the file a second time
+- A file that fails to stage backs off: its dataset's lease is held for a retry delay that doubles with each
+  consecutive failure (retry_seconds up to max_retry_seconds), so workers skip the failed file's dataset and keep
+  staging other datasets until the file is retried
+- Workers may be sharded by dataset (shard <index>/<count>): a worker only claims datasets whose name hashes to
+  its shard index
+
+Queue tables (udp_sys schema):
+- stage_arrival_queue (archive_file_name, job_id) - archived capture files waiting to stage
+- stage_pending_queue (archive_file_name) - each dataset's next capture file in sequence
+- stage_lease (dataset_name, archive_file_name, worker_id, lease_token, lease_expires, failure_count) - dataset
+  leases; failure_count counts consecutive failed stages of the dataset's next file
+
+StageQueue works over any qmark (?) parameter style DB-API connection, eg. pyodbc (SQL Server target database) or
+sqlite3 (SQLiteStageQueue, a stand-in for the target database's queue tables when testing). Lease expiry times are
+epoch seconds from worker clocks; hosts sharing a queue should keep their clocks synchronized (NTP).
+"""
+
+
+# standard lib
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+
+# common lib
+from common import log_setup
+from common import log_session_info
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# seconds a dataset lease lasts unless renewed; workers renew leases every lease_seconds / renew_ratio seconds
+default_lease_seconds = 300
+renew_ratio = 3
+
+# seconds a failed file's dataset waits before the file is retried; doubles with each consecutive failure
+default_retry_seconds = 60
+max_retry_seconds = 3600
+
+
+# a dataset's next capture file: its first job or the file posted to its pending queue
+select_next_files_sql = '''
+    select archive_file_name, job_id
+    from udp_sys.stage_arrival_queue
+    where job_id = 1
+        or archive_file_name in (select archive_file_name from udp_sys.stage_pending_queue)
+    order by job_id, archive_file_name
+'''
+
+select_next_file_sql = '''
+    select count(*)
+    from udp_sys.stage_arrival_queue
+    where archive_file_name = ?
+        and (job_id = 1 or archive_file_name in (select archive_file_name from udp_sys.stage_pending_queue))
+'''
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class StageLease:
+
+    """A worker's lease on a dataset while it stages the dataset's next capture file."""
+
+    def __init__(self, dataset_name, archive_file_name, job_id, worker_id, lease_token, lease_expires):
+        self.dataset_name = dataset_name
+        self.archive_file_name = archive_file_name
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_token = lease_token
+        self.lease_expires = lease_expires
+
+        # set when a renewal finds the lease was reclaimed by another worker
+        self.is_lost = False
+
+    def __str__(self):
+        return f'{self.dataset_name}:{self.archive_file_name} ({self.worker_id})'
+
+
+def dataset_shard(dataset_name, shard_count):
+    """Return dataset's shard index; stable across processes and hosts (vs hash())."""
+    return zlib.crc32(dataset_name.lower().encode('utf8')) % shard_count
+
+
+def parse_shard(shard):
+    """Return (shard index, shard count) of a '<index>/<count>' shard, eg. '0/4'; (0, 1) when blank."""
+    if not shard:
+        return 0, 1
+    shard_index, _, shard_count = str(shard).partition('/')
+    shard_index, shard_count = int(shard_index), int(shard_count)
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f'Stage shard index out of range: {shard}')
+    return shard_index, shard_count
+
+
+def is_integrity_error(e):
+    """Return True if e is a DB-API IntegrityError, eg. a duplicate key inserted by another worker."""
+    return any(cls.__name__ == 'IntegrityError' for cls in type(e).__mro__)
+
+
+class StageQueue:
+
+    """
+    A stage worker's view of the stage queue tables over its own connection (conn, a DB-API connection).
+    Thread safe: a lease's renewal thread shares the worker's connection.
+    """
+
+    def __init__(self, conn, worker_id=None, lease_seconds=None, shard=None, retry_seconds=None):
+        self.conn = conn
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        self.lease_seconds = float(lease_seconds or default_lease_seconds)
+        self.retry_seconds = float(retry_seconds or default_retry_seconds)
+        self.shard_index, self.shard_count = parse_shard(shard)
+        self.lock = threading.RLock()
+
+    def __str__(self):
+        return f'StageQueue({self.worker_id}, shard {self.shard_index}/{self.shard_count})'
+
+    def execute(self, sql, *parameters):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, parameters)
+        return cursor
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def is_shard(self, dataset_name):
+        return self.shard_count == 1 or dataset_shard(dataset_name, self.shard_count) == self.shard_index
+
+    def claim(self):
+        """Lease the dataset of the next capture file this worker may stage. Returns StageLease or None."""
+        with self.lock:
+            current_time = time.time()
+            next_files = self.execute(select_next_files_sql).fetchall()
+            sql = 'select dataset_name from udp_sys.stage_lease where lease_expires > ?'
+            leased_datasets = set([row[0] for row in self.execute(sql, current_time).fetchall()])
+            self.commit()
+
+            for archive_file_name, job_id in next_files:
+                dataset_name = archive_file_name.partition('#')[0]
+                if dataset_name in leased_datasets or not self.is_shard(dataset_name):
+                    continue
+
+                # a dataset's later files wait for its first file
+                leased_datasets.add(dataset_name)
+                lease = self.acquire(dataset_name, archive_file_name, job_id, current_time)
+                if not lease:
+                    continue
+
+                # file may have been completed by another worker since it was selected
+                if not self.execute(select_next_file_sql, archive_file_name).fetchone()[0]:
+                    self.commit()
+                    self.release(lease)
+                    continue
+
+                self.commit()
+                logger.info(f'Claimed {lease}')
+                return lease
+
+        return None
+
+    def acquire(self, dataset_name, archive_file_name, job_id, current_time):
+        """Lease dataset if it has no live lease. Returns StageLease or None if another worker holds the lease."""
+        lease_token = uuid.uuid4().hex
+        lease_expires = current_time + self.lease_seconds
+        lease = StageLease(dataset_name, archive_file_name, job_id, self.worker_id, lease_token, lease_expires)
+        values = (archive_file_name, self.worker_id, lease_token, lease_expires, dataset_name)
+        try:
+            # take over an expired (or released) lease; only one worker's update matches an expired lease
+            sql = '''
+                update udp_sys.stage_lease
+                set archive_file_name = ?, worker_id = ?, lease_token = ?, lease_expires = ?
+                where dataset_name = ? and lease_expires <= ?
+            '''
+            cursor = self.execute(sql, *values, current_time)
+            if cursor.rowcount != 1:
+                # dataset's first lease; a live lease (or another worker's first lease) fails with a duplicate key
+                sql = '''
+                    insert into udp_sys.stage_lease
+                    (archive_file_name, worker_id, lease_token, lease_expires, dataset_name)
+                    values (?, ?, ?, ?, ?)
+                '''
+                self.execute(sql, *values)
+            self.commit()
+            return lease
+        except Exception as e:
+            self.rollback()
+            if is_integrity_error(e):
+                return None
+            raise
+
+    def renew(self, lease):
+        """Extend lease; returns False (and flags lease as lost) if another worker reclaimed it."""
+        with self.lock:
+            lease_expires = time.time() + self.lease_seconds
+            sql = 'update udp_sys.stage_lease set lease_expires = ? where dataset_name = ? and lease_token = ?'
+            cursor = self.execute(sql, lease_expires, lease.dataset_name, lease.lease_token)
+            self.commit()
+            if cursor.rowcount != 1:
+                logger.error(f'Lease lost: {lease}')
+                lease.is_lost = True
+                return False
+            lease.lease_expires = lease_expires
+            return True
+
+    def release(self, lease):
+        """Release lease without completing its file, eg. after a failed stage, so the file can be claimed again."""
+        with self.lock:
+            sql = 'update udp_sys.stage_lease set lease_expires = 0 where dataset_name = ? and lease_token = ?'
+            self.execute(sql, lease.dataset_name, lease.lease_token)
+            self.commit()
+
+    def fail(self, lease):
+        """
+        Record a failed stage of lease's file: the dataset stays leased for a retry delay (doubling with each
+        consecutive failure) so workers stage other datasets before the file is retried. Returns failure count.
+        """
+        with self.lock:
+            try:
+                sql = 'select failure_count from udp_sys.stage_lease where dataset_name = ? and lease_token = ?'
+                row = self.execute(sql, lease.dataset_name, lease.lease_token).fetchone()
+                if not row:
+                    self.commit()
+                    logger.error(f'Lease lost before recording failure: {lease}')
+                    return 0
+
+                failure_count = row[0] + 1
+                retry_seconds = min(self.retry_seconds * 2 ** (failure_count - 1), max_retry_seconds)
+                sql = '''
+                    update udp_sys.stage_lease
+                    set failure_count = ?, lease_expires = ?
+                    where dataset_name = ? and lease_token = ?
+                '''
+                lease_expires = time.time() + retry_seconds
+                self.execute(sql, failure_count, lease_expires, lease.dataset_name, lease.lease_token)
+                self.commit()
+            except Exception:
+                self.rollback()
+                raise
+
+        logger.warning(f'Failed {lease} ({failure_count} consecutive failures); retry in {retry_seconds:g}s')
+        return failure_count
+
+    def complete(self, lease):
+        """
+        Dequeue lease's staged file, post its dataset's next file in sequence to stage_pending_queue and release
+        lease in a single transaction. Raises LeaseLost if another worker reclaimed the lease.
+        """
+        archive_file_name = lease.archive_file_name
+        next_archive_file_name = f'{lease.dataset_name}#{lease.job_id + 1:09}.zip'
+        with self.lock:
+            try:
+                sql = '''
+                    update udp_sys.stage_lease
+                    set lease_expires = 0, failure_count = 0
+                    where dataset_name = ? and lease_token = ?
+                '''
+                cursor = self.execute(sql, lease.dataset_name, lease.lease_token)
+                if cursor.rowcount != 1:
+                    raise LeaseLost(f'Lease lost before completing: {lease}')
+
+                sql = 'delete from udp_sys.stage_arrival_queue where archive_file_name = ?'
+                self.execute(sql, archive_file_name)
+                sql = 'delete from udp_sys.stage_pending_queue where archive_file_name = ?'
+                self.execute(sql, archive_file_name)
+                sql = 'insert into udp_sys.stage_pending_queue (archive_file_name) values (?)'
+                self.execute(sql, next_archive_file_name)
+                self.commit()
+            except Exception:
+                self.rollback()
+                raise
+
+        logger.info(f'Completed {lease}; next file in sequence: {next_archive_file_name}')
+
+    def renew_lease(self, lease, is_done):
+        """Renew lease every lease_seconds / renew_ratio seconds until is_done is set or lease is lost."""
+        while not is_done.wait(self.lease_seconds / renew_ratio):
+            try:
+                if not self.renew(lease):
+                    return
+            except Exception as e:
+                # keep trying; lease only expires after lease_seconds
+                logger.warning(f'Lease renewal failed ({lease}): {e}')
+
+    @contextlib.contextmanager
+    def renewing(self, lease):
+        """Renew lease in a background thread for the duration of a with block."""
+        is_done = threading.Event()
+        thread = threading.Thread(target=self.renew_lease, args=(lease, is_done), daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            is_done.set()
+            thread.join()
+
+
+class SQLiteStageQueue(StageQueue):
+
+    """
+    Stand-in for the target database's stage queue tables: a SQLite database file attached as the udp_sys schema.
+    Workers (threads or processes) share a queue by opening their own SQLiteStageQueue on the same file.
+    """
+
+    def __init__(self, file_name, worker_id=None, lease_seconds=None, shard=None, retry_seconds=None):
+        conn = sqlite3.connect(':memory:', timeout=30, check_same_thread=False)
+        conn.execute('attach database ? as udp_sys', (file_name,))
+        with conn:
+            conn.execute('''
+                create table if not exists udp_sys.stage_arrival_queue
+                (archive_file_name text primary key, job_id integer not null)
+            ''')
+            conn.execute('create table if not exists udp_sys.stage_pending_queue (archive_file_name text primary key)')
+            conn.execute('''
+                create table if not exists udp_sys.stage_lease
+                (dataset_name text primary key, archive_file_name text not null, worker_id text not null,
+                lease_token text not null, lease_expires real not null, failure_count integer not null default 0)
+            ''')
+        super().__init__(conn, worker_id, lease_seconds, shard, retry_seconds)
+
+    def add_arrival(self, archive_file_name, job_id):
+        """Register an archived capture file (archive's stage_arrival_queue update)."""
+        with self.lock:
+            sql = 'insert into udp_sys.stage_arrival_queue (archive_file_name, job_id) values (?, ?)'
+            self.execute(sql, archive_file_name, job_id)
+            self.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# temp test harness ...
+
+
+# test code
+def main():
+    # 4 workers stage 5 datasets' jobs; each dataset's jobs must stage in job order
+    # dataset_5's job 2 always fails to stage; workers back off from dataset_5 and keep staging other datasets
+    file_name = 'stage_queue_test.db'
+    if os.path.exists(file_name):
+        os.remove(file_name)
+
+    stage_queue = SQLiteStageQueue(file_name)
+    for job_id in range(1, 5):
+        for dataset_number in range(1, 6):
+            stage_queue.add_arrival(f'dataset_{dataset_number}#{job_id:09}.zip', job_id)
+    stage_queue.close()
+
+    staged_files = []
+    poison_file_name = f'dataset_5#{2:09}.zip'
+
+    def worker(worker_number):
+        worker_id = f'worker_{worker_number}'
+        worker_queue = SQLiteStageQueue(file_name, worker_id=worker_id, lease_seconds=2, retry_seconds=0.1)
+        idle_count = 0
+        while idle_count < 10:
+            lease = worker_queue.claim()
+            if not lease:
+                idle_count += 1
+                time.sleep(0.05)
+                continue
+            idle_count = 0
+            with worker_queue.renewing(lease):
+                time.sleep(0.1)
+            if lease.archive_file_name == poison_file_name:
+                worker_queue.fail(lease)
+                continue
+            worker_queue.complete(lease)
+            staged_files.append((lease.dataset_name, lease.job_id, lease.worker_id))
+        worker_queue.close()
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(worker_number,)) for worker_number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    run_time = time.perf_counter() - start_time
+
+    for dataset_number in range(1, 6):
+        job_ids = [job_id for dataset_name, job_id, _ in staged_files if dataset_name == f'dataset_{dataset_number}']
+        logger.info(f'dataset_{dataset_number} staged jobs: {job_ids}')
+    logger.info(f'Staged {len(staged_files)} files in {run_time:.1f}s')
+
+    stage_queue = SQLiteStageQueue(file_name)
+    sql = 'select failure_count from udp_sys.stage_lease where dataset_name = ?'
+    failure_count = stage_queue.execute(sql, 'dataset_5').fetchone()[0]
+    logger.info(f'{poison_file_name} failures: {failure_count}')
+    stage_queue.close()
+    os.remove(file_name)
+
+
+# test code
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()
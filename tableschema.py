@@ -11,6 +11,8 @@ Note: Moved here from database.py to create a pickle-able class that doesn't req
 
 
 # standard lib
+import copy
+import hashlib
 from collections import OrderedDict
 
 
@@ -50,6 +52,22 @@ class TableSchema:
 		for column in columns:
 			self.columns[column.column_name] = Column(column)
 
+	def fingerprint(self):
+		"""Return a hash of column metadata that changes when a column is added, dropped, altered or reordered."""
+		columns = [tuple(vars(column).values()) for column in self.columns.values()]
+		return hashlib.sha256(repr(columns).encode('utf8')).hexdigest()
+
+	def compare(self, previous_schema):
+		"""Return lists of (added, dropped, altered) column names vs a previous version of this table's schema."""
+		added = [column_name for column_name in self.columns if column_name not in previous_schema.columns]
+		dropped = [column_name for column_name in previous_schema.columns if column_name not in self.columns]
+		altered = []
+		for column_name, column in self.columns.items():
+			previous_column = previous_schema.columns.get(column_name)
+			if previous_column and vars(previous_column) != vars(column):
+				altered.append(column_name)
+		return added, dropped, altered
+
 	def add_definition(self, definition):
 		attributes = definition.split()
 
@@ -94,3 +112,47 @@ class TableSchema:
 			column_definitions.append(f'  "{column.column_name}" {column.data_type}{details} {null_mode}')
 
 		return ',\n'.join(column_definitions)
+
+
+class SchemaCatalog:
+
+	"""Index of a schema's table schemas and pk columns discovered via catalog-wide queries."""
+
+	def __init__(self, schema_name):
+		self.schema_name = schema_name
+
+		# indexed by lowercase table name
+		self.table_schemas = dict()
+		self.table_pks = dict()
+
+	def add_columns(self, columns):
+		"""Add column rows (column attributes plus table_name) to their table's schema."""
+		for column in columns:
+			table_key = column.table_name.lower()
+			if table_key not in self.table_schemas:
+				self.table_schemas[table_key] = TableSchema(column.table_name, [])
+			self.table_schemas[table_key].columns[column.column_name] = Column(column)
+
+	def add_pk_columns(self, rows):
+		"""Add (table_name, column_name) pk column rows as comma delimited strings of sorted pk column names."""
+		pk_columns = dict()
+		for table_name, column_name in rows:
+			pk_columns.setdefault(table_name.lower(), []).append(column_name)
+		for table_key, column_names in pk_columns.items():
+			self.table_pks[table_key] = ', '.join(sorted(column_names))
+
+	def table_schema(self, table_name):
+		"""Return a copy (callers may remove ignored columns) of a table's schema or None if table does not exist."""
+		table_schema = self.table_schemas.get(table_name.lower())
+		if table_schema is None:
+			return None
+		table_schema = copy.deepcopy(table_schema)
+		table_schema.table_name = table_name
+		return table_schema
+
+	def table_pk(self, table_name):
+		"""Return table's comma delimited pk column names, '' if no pk is defined, or None if table does not exist."""
+		table_key = table_name.lower()
+		if table_key not in self.table_schemas:
+			return None
+		return self.table_pks.get(table_key, '')
@@ -63,6 +63,7 @@ def setup(config):
     db_conn.create_named_table(udp_sys_schema, "table_log")
     db_conn.create_named_table(udp_sys_schema, "stage_arrival_queue")
     db_conn.create_named_table(udp_sys_schema, "stage_pending_queue")
+    db_conn.create_named_table(udp_sys_schema, "stage_lease")
 
 
 # temp test scaffolding ...
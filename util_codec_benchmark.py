@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+util_codec_benchmark.py
+
+Benchmark capture package codecs against real batch files: reports each codec's compression ratio and
+compress/decompress throughput so projects can pick a package_codec.
+
+Usage: python util_codec_benchmark.py <batch files, capture packages or glob patterns> [--codecs=<codec>,...]
+
+Capture packages (*.zip) contribute their batch (table#nnnn.json) entries.
+"""
+
+
+# standard lib
+import glob
+import logging
+import sys
+import time
+import zipfile
+
+
+# common lib
+from common import delete_file
+from common import file_size
+from common import log_setup
+from common import log_session_info
+
+
+# udp lib
+import package
+
+
+# module level logger
+logger = logging.getLogger(__name__)
+
+
+# codecs benchmarked when --codecs not specified; codecs whose 3rd party packages aren't installed are skipped
+default_codecs = 'store, deflate:1, deflate:6, deflate:9, bzip2, lzma, zstd:1, zstd:3, zstd:9, lz4:0, lz4:9'
+
+
+def load_batches(file_patterns):
+    """Return list of (entry name, data) batches from batch files and capture packages."""
+    batches = []
+    for file_pattern in file_patterns:
+        for file_name in sorted(glob.glob(file_pattern)):
+            if file_name.lower().endswith('.zip'):
+                with zipfile.ZipFile(file_name) as zip_file:
+                    manifest = package.load_manifest(zip_file)
+                    for entry_name in zip_file.namelist():
+                        if '#' in entry_name and entry_name.endswith('.json'):
+                            batches.append((entry_name, package.read_entry(zip_file, manifest, entry_name)))
+            else:
+                with open(file_name, 'rb') as input_stream:
+                    batches.append((file_name, input_stream.read()))
+    return batches
+
+
+def benchmark_codec(codec, batches, file_name='codec_benchmark.zip'):
+    """
+    Return (data size, package size, compress time, decompress time) of batches packaged with codec.
+    Raises RuntimeError if a batch doesn't read back (zip CRC/size check and decoded data) as written.
+    """
+    start_time = time.perf_counter()
+    with package.CapturePackage(file_name, codec=codec) as capture_package:
+        for batch_number, (_, data) in enumerate(batches, 1):
+            capture_package.write_bytes(f'benchmark#{batch_number:04}.json', data)
+    compress_time = time.perf_counter() - start_time
+    data_size = capture_package.data_size
+
+    start_time = time.perf_counter()
+    entries = []
+    with zipfile.ZipFile(file_name) as zip_file:
+        manifest = package.load_manifest(zip_file)
+        for batch_number in range(1, len(batches) + 1):
+            entry_name = f'benchmark#{batch_number:04}.json'
+            entries.append((entry_name, package.read_entry(zip_file, manifest, entry_name)))
+    decompress_time = time.perf_counter() - start_time
+
+    # round trip check: every batch reads back as written
+    for (entry_name, entry_data), (batch_name, data) in zip(entries, batches):
+        if entry_data != data:
+            delete_file(file_name)
+            raise RuntimeError(f'Codec {codec} round trip failed: {entry_name} ({batch_name})')
+
+    package_size = file_size(file_name)
+    delete_file(file_name)
+    return data_size, package_size, compress_time, decompress_time
+
+
+def benchmark(file_patterns, codecs=default_codecs):
+    """Log each codec's compression ratio vs throughput. Returns (codec, ratio, compress MB/s, decompress MB/s) list."""
+    batches = load_batches(file_patterns)
+    if not batches:
+        logger.warning(f'No batch files found: {file_patterns}')
+        return []
+
+    total_size = sum(len(data) for _, data in batches)
+    logger.info(f'Benchmarking {len(batches):,} batches ({total_size:,} bytes)')
+    logger.info(f'{"codec":<12} {"ratio":>8} {"compress MB/s":>14} {"decompress MB/s":>16} {"package bytes":>16}')
+
+    results = []
+    for codec in [codec.strip() for codec in codecs.split(',') if codec.strip()]:
+        try:
+            data_size, package_size, compress_time, decompress_time = benchmark_codec(codec, batches)
+        except ValueError as e:
+            logger.info(f'{codec:<12} skipped: {e}')
+            continue
+
+        megabytes = data_size / 1_000_000
+        ratio = data_size / max(1, package_size)
+        compress_rate = megabytes / max(compress_time, 1e-9)
+        decompress_rate = megabytes / max(decompress_time, 1e-9)
+        logger.info(f'{codec:<12} {ratio:>8.2f} {compress_rate:>14.1f} {decompress_rate:>16.1f} {package_size:>16,}')
+        results.append((codec, ratio, compress_rate, decompress_rate))
+    return results
+
+
+def main():
+    file_patterns = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    codecs = default_codecs
+    for arg in sys.argv[1:]:
+        if arg.startswith('--codecs='):
+            codecs = arg.partition('=')[2]
+
+    if not file_patterns:
+        logger.info(__doc__)
+    else:
+        benchmark(file_patterns, codecs)
+
+
+# main
+if __name__ == '__main__':
+    log_setup()
+    log_session_info()
+    main()